@@ -0,0 +1,280 @@
+"""
+Benchmark suite: throughput (images/s) of the input pipelines, of the training step and of the inference of each model,
+of the evaluation and of the CIFAR-10 blurring, on synthetic data (no downloaded dataset needed, runs on CPU).
+
+Run from the repository root:
+    python benchmarks/run.py --quick
+    python benchmarks/run.py --output new.json --compare old.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.optimizers import Adam
+
+from synthetic import make_reds, make_flat_pairs, make_cifar
+from dataset.manifest import build_manifest
+from dataset.TensorflowDatasetLoader import TensorflowDatasetLoader
+from nn.models import build_model, model_types
+from nn.predict import PredictEngine
+from utils.dataset import blur_cifar, PairFileIterator, random_crops
+from utils.eval import evaluate
+
+groups = ['input', 'train', 'inference', 'eval', 'blur']
+
+
+def timed(fn, iterations, warmup=1):
+    """
+    Calls a function warmup times (not measured), then iterations times.
+
+    :param fn (function): Function without arguments
+    :param iterations (int): Number of measured calls
+    :param warmup (int): Number of calls before the measure (compilation, caches)
+    :return: seconds (float): Time of the measured calls
+    """
+    for _ in range(warmup):
+        fn()
+
+    a = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+
+    return time.perf_counter() - a
+
+
+def result(group, name, params, images, seconds):
+    """
+    A benchmark result.
+
+    :param group (string): Group of the benchmark (one of groups)
+    :param name (string): Name of the benchmark
+    :param params (dict): Parameters of the benchmark
+    :param images (int): Number of processed images
+    :param seconds (float): Time spent
+    :return: result (dict): Result
+    """
+    r = {'group': group, 'name': name, 'params': params, 'images': images, 'seconds': seconds,
+         'images_per_s': images / seconds if seconds > 0 else None}
+    print('{:10s} {:28s} {:50s} {:10.2f} images/s'.format(group, name, json.dumps(params), r['images_per_s'] or 0))
+
+    return r
+
+
+def bench_input(args, data_path):
+    """
+    Input pipelines of the reds training: indexing of the set (manifest), PairFileIterator + random_crops (keras
+    backend), TensorflowDatasetLoader without cache and with the memory cache.
+    """
+    sharp_path, blur_path = make_reds(os.path.join(data_path, 'reds'), args.scenes, args.frames, args.frame_size)
+    crop = (args.crop, args.crop)
+    params = {'batch_size': args.batch_size, 'frame_size': list(args.frame_size), 'crop': args.crop}
+    samples = args.scenes * args.frames
+    epoch_batches = max(1, samples // args.batch_size)
+    results = []
+
+    manifest = build_manifest(sharp_path, blur_path)
+    seconds = timed(lambda: build_manifest(sharp_path, blur_path), 3, 0)
+    results.append(result('input', 'manifest', params, 3 * len(manifest), seconds))
+
+    generator = random_crops(PairFileIterator([row['sharp'] for row in manifest], [row['blur'] for row in manifest],
+                                              batch_size=args.batch_size, seed=0), crop)
+    seconds = timed(lambda: next(generator), args.input_batches)
+    results.append(result('input', 'keras', params, args.input_batches * args.batch_size, seconds))
+
+    for cache in [False, 'memory']:
+        loader = TensorflowDatasetLoader(manifest=manifest, batch_size=args.batch_size, patch_size=crop,
+                                         centered=False, cache=cache, seed=0)
+        iterator = iter(loader.dataset)
+        # The measure starts from the second epoch (cache filled)
+        seconds = timed(lambda: next(iterator), args.input_batches, epoch_batches + 1)
+        results.append(result('input', 'tfdata' + ('-' + cache if cache else ''), params,
+                              args.input_batches * args.batch_size, seconds))
+
+    return results
+
+
+def bench_train(args, data_path):
+    """
+    Training step (forward, backward, update) of each model at each resolution.
+    """
+    results = []
+
+    for model_type in args.models:
+        for resolution in args.resolutions:
+            tf.keras.backend.clear_session()
+            model, _ = build_model(model_type)
+            model.compile(optimizer=Adam(learning_rate=1e-4))
+
+            shape = (args.batch_size, resolution, resolution, 3)
+            batch = [np.random.rand(*shape).astype(np.float32), np.random.rand(*shape).astype(np.float32)]
+
+            seconds = timed(lambda: model.train_on_batch(batch), args.steps)
+            results.append(result('train', model_type, {'batch_size': args.batch_size, 'resolution': resolution},
+                                  args.steps * args.batch_size, seconds))
+
+    return results
+
+
+def bench_inference(args, data_path):
+    """
+    Inference (blur input only, compiled forward pass) of each model at each resolution.
+    """
+    results = []
+
+    for model_type in args.models:
+        for resolution in args.resolutions:
+            tf.keras.backend.clear_session()
+            _, inference_model = build_model(model_type)
+            engine = PredictEngine(inference_model, jit_compile=args.jit_compile, writers=1)
+
+            images = np.random.rand(args.batch_size, resolution, resolution, 3).astype(np.float32)
+
+            seconds = timed(lambda: engine.predict(images), args.steps)
+            engine.close()
+            results.append(result('inference', model_type, {'batch_size': args.batch_size, 'resolution': resolution,
+                                                            'jit_compile': args.jit_compile},
+                                  args.steps * args.batch_size, seconds))
+
+    return results
+
+
+def bench_eval(args, data_path):
+    """
+    Evaluation (MSE, PSNR, SSIM) of a folder of images.
+    """
+    sharp_path, deblurred_path = make_flat_pairs(os.path.join(data_path, 'eval'), args.eval_images, args.frame_size)
+    workers = os.cpu_count() or 1
+
+    seconds = timed(lambda: evaluate(sharp_path, deblurred_path, workers=workers), 1, warmup=0)
+
+    return [result('eval', 'evaluate', {'image_size': list(args.frame_size), 'workers': workers}, args.eval_images,
+                   seconds)]
+
+
+def bench_blur(args, data_path):
+    """
+    Blurring of a CIFAR-10-like dataset, in the current process and in a pool of processes.
+    """
+    dataset = make_cifar(1, args.cifar_images)
+    n_images = 2 * args.cifar_images  # train and test
+    results = []
+
+    for workers in sorted(set([1, os.cpu_count() or 1])):
+        seconds = timed(lambda: blur_cifar(dataset, workers=workers), 1, warmup=0)
+        results.append(result('blur', 'blur_cifar', {'workers': workers}, n_images, seconds))
+
+    return results
+
+
+def metadata(args):
+    """
+    Environment of the run (commit, versions, devices).
+
+    :param args (argparse.Namespace): Arguments
+    :return: metadata (dict): Metadata
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'commit': commit, 'date': datetime.datetime.now().isoformat(), 'python': platform.python_version(),
+            'tensorflow': tf.__version__, 'numpy': np.__version__, 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'gpus': [gpu.name for gpu in tf.config.list_physical_devices('GPU')],
+            'args': {key: value for key, value in vars(args).items() if key not in ['output', 'compare']}}
+
+
+def compare(results, old_results):
+    """
+    Prints the speedup of each benchmark with respect to a previous run.
+
+    :param results (list): Results of this run
+    :param old_results (list): Results of the previous run
+    :return: void
+    """
+    def key(r):
+        return r['group'], r['name'], json.dumps(r['params'], sort_keys=True)
+
+    old = {key(r): r for r in old_results}
+
+    print('\nSpeedup with respect to the previous run:')
+    for r in results:
+        o = old.get(key(r))
+        if o is None or not o['images_per_s'] or not r['images_per_s']:
+            continue
+        print('{:10s} {:28s} {:50s} {:6.2f}x'.format(r['group'], r['name'], json.dumps(r['params']),
+                                                     r['images_per_s'] / o['images_per_s']))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='DeepDeblur benchmark suite (synthetic data)')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file of the results')
+    parser.add_argument('--compare', default=None, help='JSON file of a previous run to compare with')
+    parser.add_argument('--data', default=os.path.join(tempfile.gettempdir(), 'deepdeblur-benchmark'),
+                        help='Folder of the synthetic data (reused between runs)')
+    parser.add_argument('--groups', nargs='+', default=groups, choices=groups, help='Benchmarks to run')
+    parser.add_argument('--models', nargs='+', default=model_types, choices=model_types, help='Models')
+    parser.add_argument('--resolutions', nargs='+', type=int, default=[64, 128, 256],
+                        help='Sizes of the (square) images of the train/inference benchmarks (multiples of 16)')
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--steps', type=int, default=5, help='Measured steps of the train/inference benchmarks')
+    parser.add_argument('--jit-compile', action='store_true', help='XLA-compiled inference')
+    parser.add_argument('--scenes', type=int, default=2, help='Scenes of the synthetic reds set')
+    parser.add_argument('--frames', type=int, default=16, help='Frames per scene of the synthetic reds set')
+    parser.add_argument('--frame-size', nargs=2, type=int, default=[720, 1280], help='height and width of the frames')
+    parser.add_argument('--crop', type=int, default=256, help='Size of the training crops')
+    parser.add_argument('--input-batches', type=int, default=20, help='Measured batches of the input benchmarks')
+    parser.add_argument('--eval-images', type=int, default=32, help='Images of the evaluation benchmark')
+    parser.add_argument('--cifar-images', type=int, default=10000, help='Images per set of the blur benchmark')
+    parser.add_argument('--quick', action='store_true', help='Small sizes, for a smoke run')
+    args = parser.parse_args()
+
+    if args.quick:
+        args.resolutions = [64]
+        args.batch_size = 2
+        args.steps = 2
+        args.frames = 4
+        args.frame_size = [288, 512]
+        args.input_batches = 8
+        args.eval_images = 4
+        args.cifar_images = 1000
+    args.frame_size = tuple(args.frame_size)
+
+    return args
+
+
+def main():
+    args = parse_args()
+
+    np.random.seed(0)
+    tf.random.set_seed(0)
+
+    benchmarks = {'input': bench_input, 'train': bench_train, 'inference': bench_inference, 'eval': bench_eval,
+                  'blur': bench_blur}
+
+    results = []
+    for group in args.groups:
+        results += benchmarks[group](args, args.data)
+
+    with open(args.output, 'w') as f:
+        json.dump({'metadata': metadata(args), 'results': results}, f, indent=2)
+    print('Saved the results to {}'.format(args.output))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
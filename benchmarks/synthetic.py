@@ -0,0 +1,99 @@
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+
+def random_image(rng, size):
+    """
+    Random smooth-ish RGB image (noise upsampled from a coarser grid, so that the png compression behaves like on
+    natural images more than on pure noise).
+
+    :param rng (np.random.Generator): Random generator
+    :param size (Tuple[int, int]): height and width
+    :return: image (np.array): uint8 image with shape (height, width, 3)
+    """
+    h, w = size
+    coarse = rng.integers(0, 256, (max(1, h // 8), max(1, w // 8), 3), dtype=np.uint8)
+
+    return cv2.resize(coarse, (w, h), interpolation=cv2.INTER_LINEAR)
+
+
+def make_reds(root, scenes=2, frames=8, size=(720, 1280), seed=0):
+    """
+    Creates a REDS-like set: sharp/<scene>/<frame>.png and blur/<scene>/<frame>.png, the blur images being the
+    gaussian blurred sharp ones. Existing images are kept.
+
+    :param root (string): Folder of the set
+    :param scenes (int): Number of scenes
+    :param frames (int): Number of frames per scene
+    :param size (Tuple[int, int]): height and width of the frames
+    :param seed (int): Seed
+    :return: paths (Tuple[string, string]): sharp and blur paths (with the trailing '/')
+    """
+    rng = np.random.default_rng(seed)
+    sharp_path = os.path.join(root, 'sharp') + '/'
+    blur_path = os.path.join(root, 'blur') + '/'
+
+    for scene in range(scenes):
+        scene_name = '{:03d}'.format(scene)
+        Path(sharp_path + scene_name).mkdir(parents=True, exist_ok=True)
+        Path(blur_path + scene_name).mkdir(parents=True, exist_ok=True)
+
+        for frame in range(frames):
+            name = '{}/{:08d}.png'.format(scene_name, frame)
+            if os.path.exists(sharp_path + name) and os.path.exists(blur_path + name):
+                continue
+
+            image = random_image(rng, size)
+            cv2.imwrite(sharp_path + name, image)
+            cv2.imwrite(blur_path + name, cv2.GaussianBlur(image, (0, 0), 2))
+
+    return sharp_path, blur_path
+
+
+def make_flat_pairs(root, n_images=32, size=(720, 1280), seed=0):
+    """
+    Creates two flat folders of images with the same names (sharp and 'deblurred'), as evaluated by utils/eval.py.
+
+    :param root (string): Folder of the set
+    :param n_images (int): Number of images
+    :param size (Tuple[int, int]): height and width of the images
+    :param seed (int): Seed
+    :return: paths (Tuple[string, string]): sharp and deblurred paths (with the trailing '/')
+    """
+    rng = np.random.default_rng(seed)
+    sharp_path = os.path.join(root, 'sharp') + '/'
+    deblurred_path = os.path.join(root, 'deblurred') + '/'
+    Path(sharp_path).mkdir(parents=True, exist_ok=True)
+    Path(deblurred_path).mkdir(parents=True, exist_ok=True)
+
+    for i in range(n_images):
+        name = '{:08d}.png'.format(i)
+        if os.path.exists(sharp_path + name) and os.path.exists(deblurred_path + name):
+            continue
+
+        image = random_image(rng, size)
+        cv2.imwrite(sharp_path + name, image)
+        cv2.imwrite(deblurred_path + name, cv2.GaussianBlur(image, (0, 0), 1))
+
+    return sharp_path, deblurred_path
+
+
+def make_cifar(n_batches=1, batch_images=10000, seed=0):
+    """
+    Creates a CIFAR-like dataset in memory, in the format returned by utils.dataset.load_cifar.
+
+    :param n_batches (int): Number of training batches
+    :param batch_images (int): Number of images per batch
+    :param seed (int): Seed
+    :return: dataset (dict): for each set (train, val, test), a list of batches ({b'data': (n, 3072) uint8, ...})
+    """
+    rng = np.random.default_rng(seed)
+
+    def batch():
+        return {b'data': rng.integers(0, 256, (batch_images, 3 * 32 * 32), dtype=np.uint8),
+                b'labels': list(rng.integers(0, 10, batch_images))}
+
+    return {'train': [batch() for _ in range(n_batches)], 'val': [], 'test': [batch()]}
@@ -0,0 +1,713 @@
+"""
+Commands of main.py. Each command imports (and builds) only what it needs: TensorFlow is loaded by the commands using
+a model (train, predict, export, quantize, stream, serve), not by prepare and by the reds evaluation.
+"""
+import os
+import random
+import sys
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+
+
+def seed_everything(seed):
+    """
+    Sets the seed of the random generators (and of TensorFlow, if loaded).
+
+    :param seed (int): Seed
+    :return: void
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+
+    if 'tensorflow' in sys.modules:
+        sys.modules['tensorflow'].random.set_seed(seed)
+
+
+def setup(params):
+    """
+    Configures the devices (memory growth on every GPU, optional virtual CPUs), the seeds and the precision policy.
+    Must be called before any other TensorFlow operation.
+
+    :param params (Params): Parameters
+    :return: void
+    """
+    from nn.distribute import configure_devices
+    from nn.precision import set_precision
+
+    configure_devices(params.virtual_cpus)
+    seed_everything(params.seed)
+    # Mixed precision policy (float32 outputs, losses and metrics)
+    set_precision(params.precision)
+
+
+def load_weights(params, paths, model):
+    """
+    Loads the weights saved after load_epoch epochs (nothing if load_epoch is 0).
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :param model (tf.keras.Model): Training or inference model
+    :return: void
+    """
+    if params.load_epoch != 0:
+        model.load_weights(paths.model_weights)
+        print('Loaded model/weights!')
+
+
+def load_inference_weights(params, paths, inference_model):
+    """
+    Loads the trained weights into an inference model: from the latest or best checkpoint of the training with
+    load_checkpoint (see nn/checkpoint.py), else from the weights saved after load_epoch epochs (see load_weights).
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :param inference_model (tf.keras.Model): Inference model (blur input only)
+    :return: void
+    """
+    from nn.checkpoint import restore_inference_model
+
+    if params.load_checkpoint is not None:
+        restore_inference_model(inference_model, paths.checkpoints, params.load_checkpoint)
+    else:
+        load_weights(params, paths, inference_model)
+
+
+def create_callbacks(params, paths, checkpoints):
+    """
+    Creates the training callbacks.
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :param checkpoints (RotatingCheckpoint): Checkpoint callback (see nn/checkpoint.py)
+    :return: callbacks (list): Keras callbacks
+    """
+    from tensorflow.keras.callbacks import TensorBoard, LearningRateScheduler
+    from nn.decay import MyPolynomialDecay
+    from nn.profiling import StepTimer
+
+    # When profiling, TensorBoard also captures a TF profiler trace of the steps in the profile_steps window
+    tensorboard_callback = TensorBoard(log_dir=paths.logs, profile_batch=params.profile_steps if params.profile else 0)
+
+    callbacks = [tensorboard_callback, checkpoints]
+
+    if params.profile:
+        # Per-step time, split in input wait and compute (custom loop), with a summary at the end of each epoch
+        callbacks.append(StepTimer(paths.logs+'/step_times.csv'))
+
+    if 'cifar' in params.task:
+        callbacks.append(LearningRateScheduler(MyPolynomialDecay(max_epochs=params.epochs, init_lr=params.initial_lr,
+                                                                 power=5)))
+
+    return callbacks
+
+
+def prepare(params, paths):
+    """
+    Prepares the dataset of the task (blurred cifar as .npy, manifests of the reds sets, rebuilt if existing).
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :return: void
+    """
+    from dataset.prepare import prepare_cifar, prepare_reds
+
+    seed_everything(params.seed)
+
+    if 'reds' in params.task:
+        prepare_reds(paths, rebuild=True)
+    else:
+        prepare_cifar(paths, blur=not params.online_blur)
+
+
+def train(params, paths):
+    """
+    Trains the model and saves it. The training resumes from the latest checkpoint (if resume is set and there is
+    one), otherwise from the weights of load_epoch (if not 0).
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :return: history (tf.keras.callbacks.History): History of the metrics
+    """
+    import tensorflow as tf
+    from tensorflow.keras.optimizers import Adam
+    from dataset.inputs import training_inputs, input_shape
+    from nn.checkpoint import RotatingCheckpoint, checkpointable_dataset
+    from nn.distribute import get_strategy
+    from nn.models import build_model
+    from nn.precision import wrap_optimizer
+    from nn.training import Trainer
+
+    setup(params)
+    strategy = get_strategy(params.strategy)
+
+    # batch_size is per replica: each training step processes batch_size images on each replica
+    batch_size = params.batch_size * strategy.num_replicas_in_sync
+
+    train_data, validation_data, train_steps, validation_steps = training_inputs(params, paths, batch_size, strategy)
+
+    # The variables (model, loss graph, optimizer) are created inside the strategy scope, mirrored on each replica
+    with strategy.scope():
+        # Training model (sharp and blur inputs, loss and metric) and inference model (blur input only), sharing the
+        # weights
+        model, inference_model = build_model(params.model, input_shape)
+
+        # Compile the model
+        optimizer = wrap_optimizer(Adam(learning_rate=params.initial_lr), params.precision)
+        model.compile(optimizer=optimizer, steps_per_execution=params.steps_per_execution)
+
+    # Print the summary
+    print(model.summary())
+
+    train_iterator = None
+    if params.training_loop == 'custom':
+        # Custom loop, with gradient accumulation
+        trainer = Trainer(model, accumulation_steps=params.accumulation_steps,
+                          steps_per_execution=params.steps_per_execution, strategy=strategy)
+
+        if params.checkpoint_input and isinstance(train_data, tf.data.Dataset):
+            # The iterator exists before the restore, to be saved and restored with the checkpoints
+            train_iterator = trainer.distribute(checkpointable_dataset(train_data), input_shape)
+            train_data = train_iterator
+
+    # The inference model is saved too, to be restored alone (load_checkpoint)
+    checkpoints = RotatingCheckpoint(paths.checkpoints, model, max_to_keep=params.keep_checkpoints,
+                                     period=params.mc_period, async_save=params.async_checkpoint,
+                                     inference_model=inference_model, iterator=train_iterator)
+    callbacks = create_callbacks(params, paths, checkpoints)
+
+    # Restart the training from the latest checkpoint, or else from a model (weights)
+    initial_epoch = checkpoints.restore() if params.resume else None
+    if initial_epoch is None:
+        load_weights(params, paths, model)
+        initial_epoch = params.load_epoch
+
+    if params.training_loop == 'custom':
+        history = trainer.fit(train_data, epochs=params.epochs, steps_per_epoch=train_steps, callbacks=callbacks,
+                              validation_data=validation_data, validation_steps=validation_steps,
+                              initial_epoch=initial_epoch, input_shape=input_shape)
+    else:
+        history = model.fit(train_data, epochs=params.epochs, steps_per_epoch=train_steps, callbacks=callbacks,
+                            validation_data=validation_data, validation_steps=validation_steps,
+                            initial_epoch=initial_epoch)
+
+    # Save the model/weights
+    model.save(paths.final_model+'/final_model.h5')
+    model.save_weights(paths.final_model+'/final_weights.h5')
+    print('Saved model/weights!')
+
+    return history
+
+
+def inference_engine(params, paths):
+    """
+    Builds the inference model (blur input only), loads the weights and wraps it in a PredictEngine. With tflite_mode,
+    the engine runs the TFLite model of the mode instead (see quantize), by tiles of its fixed input size.
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :return: engine (PredictEngine): Engine
+    """
+    from dataset.inputs import input_shape
+    from nn.models import build_inference_model
+    from nn.predict import PredictEngine
+    from nn.quantize import TFLiteModel
+    from utils.tiling import predict_tiled
+
+    setup(params)
+
+    if params.tflite_mode is not None:
+        tflite_model = TFLiteModel(model_path=paths.tflite + '-' + params.tflite_mode + '.tflite')
+        tile_size = tuple(int(size) for size in tflite_model.input['shape'][1:3])
+        print('Predicting with {}-{}.tflite, by tiles of {}x{}'.format(paths.tflite, params.tflite_mode, *tile_size))
+
+        return PredictEngine(None, predict_function=lambda images: predict_tiled(
+            tflite_model.predict, images, tile_size, params.tile_overlap, params.predict_batch_size))
+
+    inference_model = build_inference_model(params.model, input_shape)
+    load_inference_weights(params, paths, inference_model)
+
+    # Compiled forward pass; the images are encoded and written by other threads
+    return PredictEngine(inference_model, jit_compile=params.jit_compile)
+
+
+def predict_tiled_frames(params, engine, frames, frame_names, out_path):
+    """
+    Predicts a group of frames by overlapping tiles and queues the predictions to be saved.
+
+    :param params (Params): Parameters
+    :param engine (PredictEngine): Engine running the predictions and writing the images
+    :param frames (list): Blur frames (height, width, channels), all with the same shape
+    :param frame_names (list): Names of the frames (relative to out_path)
+    :param out_path (string): Path where to save the predictions
+    :return: void
+    """
+    from utils.tiling import predict_tiled
+
+    predictions = predict_tiled(engine.predict, np.stack(frames), params.tile_size, params.tile_overlap,
+                                params.predict_batch_size)
+
+    for name, prediction in zip(frame_names, predictions):
+        engine.submit(prediction, out_path+name)
+
+
+def prediction_cache(params, paths, engine):
+    """
+    Opens the prediction cache (see utils/prediction_cache.py), if enabled. The keys depend on the weights of the
+    engine and on the inference settings.
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :param engine (PredictEngine): Engine running the predictions
+    :return: cache, cache_key (Tuple[PredictionCache, function]): Cache and function of the digest of an input
+        returning its key (None, None if the cache is disabled)
+    """
+    from utils.prediction_cache import PredictionCache, arrays_digest, file_digest
+
+    if not params.prediction_cache:
+        return None, None
+
+    cache = PredictionCache(paths.prediction_cache, int(params.prediction_cache_gb * 1e9))
+    if params.tflite_mode is None:
+        weights = arrays_digest(engine.model.get_weights())
+    else:
+        weights = file_digest(paths.tflite + '-' + params.tflite_mode + '.tflite')
+    settings = {'task': params.task_path, 'model': params.model, 'precision': params.precision,
+                'jit_compile': params.jit_compile, 'tile_size': params.tile_size, 'tile_overlap': params.tile_overlap,
+                'tflite_mode': params.tflite_mode}
+
+    return cache, lambda input_digest: cache.key(input_digest, weights, settings)
+
+
+def predict_cached(engine, cache, cache_key, images):
+    """
+    Predicts a batch of images, running the model only on the images whose prediction is not in the cache.
+
+    :param engine (PredictEngine): Engine running the predictions
+    :param cache (PredictionCache): Cache of the predictions (.npy entries)
+    :param cache_key (function): Function of the digest of an image returning its key (see prediction_cache)
+    :param images (np.array): Blur images with shape (n_images, height, width, channels), in [0, 1]
+    :return: predictions (np.array): Deblurred images, same shape of images
+    """
+    from utils.prediction_cache import arrays_digest, array_from_bytes, array_to_bytes
+
+    keys = [cache_key(arrays_digest([image])) for image in images]
+    cached = [cache.get(key) for key in keys]
+    missing = [i for i, data in enumerate(cached) if data is None]
+
+    predictions = np.empty(images.shape, dtype=np.float32)
+    if len(missing) > 0:
+        predictions[missing] = engine.predict(images[missing])
+
+    for i, data in enumerate(cached):
+        if data is None:
+            cache.put(keys[i], array_to_bytes(predictions[i]))
+        else:
+            predictions[i] = array_from_bytes(data)
+
+    return predictions
+
+
+def predict_reds_frames(params, paths, engine, manifest, out):
+    """
+    Predicts the frames of the reds validation set and queues the predictions to be saved.
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :param engine (PredictEngine): Engine running the predictions and writing the images
+    :param manifest (list): Rows of the validation manifest to predict
+    :param out (string): Path where to save the predictions
+    :return: count (int): Number of predicted frames
+    """
+    from dataset.inputs import reds_test_inputs
+    from utils.tiling import count_tiles
+
+    # Only the blur frames are read
+    test_val_generator, test_val_names, test_val_batches = reds_test_inputs(params, paths, manifest, sharp=False)
+    names = iter(test_val_names)
+
+    # The keras generators are infinite
+    batches = (np.asarray(batch) for batch in islice(test_val_generator, test_val_batches))
+
+    if params.tile_size is None:
+        return engine.run(batches, names, out)
+
+    # Predict by overlapping tiles, batched across frames
+    count = 0
+    frames = []
+    frame_names = []
+    for batch in engine.timed(batches):
+        for frame in batch:
+            frames.append(frame)
+            frame_names.append(next(names))
+
+            # Group the frames until they fill a batch of tiles
+            if count_tiles(frames[0].shape, params.tile_size, params.tile_overlap) * len(frames) >= \
+                    params.predict_batch_size:
+                predict_tiled_frames(params, engine, frames, frame_names, out)
+                count += len(frames)
+                print('Predicted {}/{}'.format(count, len(test_val_names)))
+                frames = []
+                frame_names = []
+
+    if len(frames) > 0:
+        predict_tiled_frames(params, engine, frames, frame_names, out)
+        count += len(frames)
+        print('Predicted {}/{}'.format(count, len(test_val_names)))
+
+    return count
+
+
+def predict_reds(params, paths):
+    """
+    Predicts the reds validation set (used as a test set) and saves the predictions. The frames whose prediction is in
+    the prediction cache are not predicted again.
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :return: void
+    """
+    from dataset.manifest import frame_name
+    from dataset.prepare import prepare_reds
+    from utils.prediction_cache import file_digest
+
+    engine = inference_engine(params, paths)
+    manifest = prepare_reds(paths)['val']
+
+    # Path where to save predicted images, with the scenes of the set (out/<scene>/<frame>.png)
+    out = paths.out_reds
+    for scene in set(row['scene'] for row in manifest):
+        Path(out+scene).mkdir(parents=True, exist_ok=True)
+
+    cache, cache_key = prediction_cache(params, paths, engine)
+    # Keys of the predicted frames, for each name
+    keys = {}
+    if cache is not None:
+        # The cached predictions (png bytes) are copied to the output folder, the other frames are predicted
+        missing = []
+        for row in manifest:
+            key = cache_key(file_digest(row['blur']))
+            data = cache.get(key)
+
+            if data is None:
+                keys[frame_name(row)] = key
+                missing.append(row)
+            else:
+                with open(out+frame_name(row), 'wb') as f:
+                    f.write(data)
+
+        print('{} of {} frames in the prediction cache'.format(len(manifest) - len(missing), len(manifest)))
+        manifest = missing
+
+    count = predict_reds_frames(params, paths, engine, manifest, out) if len(manifest) > 0 else 0
+    engine.report(engine.close(), count)
+
+    if cache is not None:
+        for name, key in keys.items():
+            with open(out+name, 'rb') as f:
+                cache.put(key, f.read())
+        cache.report()
+
+
+def predict_cifar(params, paths, save_images=False):
+    """
+    Predicts the cifar test set, computing the metrics batch by batch. The images whose prediction is in the prediction
+    cache are not predicted again.
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :param save_images (boolean): True for saving the predictions
+    :return: metrics (Tuple[float, float, float]): average MSE, PSNR, SSIM
+    """
+    from dataset.inputs import cifar_test_inputs
+    from nn.metrics import StreamingImageMetrics
+
+    engine = inference_engine(params, paths)
+    test_generator = cifar_test_inputs(params, paths, params.batch_size)
+    cache, cache_key = prediction_cache(params, paths, engine)
+
+    # Path where to save the images
+    out = paths.out_cifar
+    Path(out).mkdir(parents=True, exist_ok=True)
+
+    # The metrics are accumulated batch by batch, as the predictions come out of the model
+    metrics = StreamingImageMetrics()
+
+    count = 0
+    for batch in test_generator:
+        # Make prediction
+        p = engine.predict(batch[1]) if cache is None else predict_cached(engine, cache, cache_key, batch[1])
+        metrics.update(batch[0], p)
+
+        if save_images:  # Save the images
+            for i in range(len(p)):
+                engine.submit(p[i], out+str(count+i)+'.png')
+
+        count += len(p)
+        print('Predicted {}/{}'.format(count, test_generator.samples))
+
+        if count >= test_generator.samples:  # Infinite generator
+            break
+
+    engine.report(engine.close(), count)
+    if cache is not None:
+        cache.report()
+
+    a_m, a_p, a_s = metrics.result()
+    print('Avg. MSE, PSNR, SSIM: {:.5f}, {:.5f}, {:.5f}'.format(a_m, a_p, a_s))  # TODO1 write to a file
+
+    return a_m, a_p, a_s
+
+
+def predict(params, paths):
+    """
+    Predicts the test set of the task (reds: saves the images; cifar: also computes the metrics).
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :return: void
+    """
+    if 'reds' in params.task:
+        predict_reds(params, paths)
+    else:
+        predict_cifar(params, paths)
+
+
+def evaluate(params, paths):
+    """
+    Computes the metrics of the predictions (reds: of the saved predictions, without TensorFlow; cifar: predicting the
+    test set).
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :return: metrics (Tuple[float, float, float]): average MSE, PSNR, SSIM
+    """
+    if 'reds' not in params.task:
+        return predict_cifar(params, paths)
+
+    from dataset.manifest import frame_name
+    from dataset.prepare import prepare_reds
+    from utils.eval import evaluate_pairs
+
+    # The predictions of the frames of the manifest (see predict_reds)
+    pairs = [(frame_name(row), row['sharp'], paths.out_reds+frame_name(row)) for row in prepare_reds(paths)['val']]
+    missing = [pair[0] for pair in pairs if not os.path.isfile(pair[2])]
+    if len(missing) > 0:
+        print('{} sharp images without a deblurred image (e.g. {})'.format(len(missing), missing[0]))
+
+    # Compute metrics
+    metrics = evaluate_pairs([pair for pair in pairs if os.path.isfile(pair[2])])
+    a_m, a_p, a_s = metrics['mse'], metrics['psnr'], metrics['ssim']
+    print('Avg. MSE, PSNR, SSIM: {:.5f}, {:.5f}, {:.5f}'.format(a_m, a_p, a_s))
+
+    return a_m, a_p, a_s
+
+
+def export(params, paths):
+    """
+    Exports the inference model (blur input only, no loss) as a SavedModel.
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :return: void
+    """
+    from dataset.inputs import input_shape
+    from nn.models import build_inference_model, export_inference_model
+
+    setup(params)
+
+    # Built from scratch and loaded with the trained weights
+    export_model = build_inference_model(params.model, input_shape)
+    if params.load_checkpoint is None:
+        export_model.load_weights(paths.model_weights)
+    else:
+        load_inference_weights(params, paths, export_model)
+
+    export_inference_model(export_model, paths.export, input_shape)
+    print('Exported the inference model to {}'.format(paths.export))
+
+
+def stream(params, paths):
+    """
+    Deblurs videos frame by frame, with decoding, inference and encoding running at the same time (see
+    nn/streaming.py): the stream_input video file or frame directory, or else each scene of the reds validation set.
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :return: stats (list): Stats of each stream (see StreamingPipeline.run)
+    """
+    from nn.streaming import FrameSource, FrameSink, StreamingPipeline
+    from utils.tiling import pad_to_multiple, predict_tiled
+
+    if params.stream_input is not None:
+        streams = [(params.stream_input, params.stream_output or paths.out_stream+'stream.mp4')]
+    elif 'reds' in params.task:
+        scenes = sorted(d for d in os.listdir(paths.reds['val_b']) if os.path.isdir(paths.reds['val_b']+d))
+        streams = [(paths.reds['val_b']+scene, os.path.join(params.stream_output or paths.out_stream, scene+'.mp4'))
+                   for scene in scenes]
+    else:
+        raise ValueError('Set stream_input to a video file or a frame directory')
+
+    engine = inference_engine(params, paths)
+
+    def predict(frames):
+        if params.tile_size is not None:
+            return predict_tiled(engine.predict, frames, params.tile_size, params.tile_overlap,
+                                 params.predict_batch_size)
+
+        # The srn and unet models need sizes multiple of 16
+        height, width = frames.shape[1:3]
+        return engine.predict(np.stack([pad_to_multiple(frame, 16) for frame in frames]))[:, :height, :width]
+
+    pipeline = StreamingPipeline(predict, batch_size=params.predict_batch_size, queue_size=params.stream_queue_size)
+
+    all_stats = []
+    for input_path, output_path in streams:
+        source = FrameSource(input_path, fps=params.stream_fps)
+        print('Deblurring {} ({} frames) to {}'.format(input_path, len(source), output_path))
+
+        stats = pipeline.run(source, FrameSink(output_path, fps=source.fps))
+        pipeline.report(stats)
+        all_stats.append(stats)
+
+    engine.close()
+
+    return all_stats
+
+
+def serve(params, paths):
+    """
+    Serves the exported inference model (see export) over HTTP, batching the concurrent requests (see nn/serving.py),
+    until interrupted.
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :return: void
+    """
+    import tensorflow as tf
+    from nn.serving import DynamicBatcher, ServerMetrics, DeblurServer
+
+    setup(params)
+
+    if not os.path.exists(paths.export):
+        raise FileNotFoundError('No export in {}: run the export command first'.format(paths.export))
+
+    # Loaded once: the signature accepts any batch size and image size
+    model = tf.saved_model.load(paths.export)
+    signature = model.signatures['serving_default']
+
+    def predict(images):
+        return signature(input_blur=tf.convert_to_tensor(images, tf.float32))['output'].numpy()
+
+    metrics = ServerMetrics()
+    batcher = DynamicBatcher(predict, max_batch_size=params.serve_max_batch_size,
+                             batch_window=params.serve_batch_window_ms / 1000, metrics=metrics)
+    server = DeblurServer((params.serve_host, params.serve_port), batcher, metrics)
+
+    print('Serving {} on http://{}:{} (POST /deblur, GET /metrics)'.format(paths.export, params.serve_host,
+                                                                         server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+
+
+def take_images(batches, n):
+    """
+    Takes the first images of ((sharp, blur),) batches.
+
+    :param batches (iterable): Batches (tf.data.Dataset or generator)
+    :param n (int): Number of images
+    :return: images (Tuple[np.array, np.array]): n sharp and n blur images
+    """
+    sharp = []
+    blur = []
+
+    for batch in batches:
+        sharp.extend(np.asarray(batch[0][0]))
+        blur.extend(np.asarray(batch[0][1]))
+        if len(blur) >= n:
+            break
+
+    return np.stack(sharp[:n]), np.stack(blur[:n])
+
+
+def quantize(params, paths):
+    """
+    Exports the inference model as TFLite models (one per mode of tflite_modes), then reports their metrics on the
+    validation images (random crops for reds) and their drift with respect to the float Keras model. The int8
+    quantization is calibrated on the training images.
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :return: report (dict): For each model ('keras' and the modes), its metrics, latency and size
+    """
+    import dataclasses
+    import json
+    from dataset.inputs import training_inputs, input_shape
+    from nn.models import build_inference_model
+    from nn.quantize import convert_tflite, TFLiteModel, evaluate_predictions
+
+    setup(params)
+
+    # Images of the size of the training crops; the cache would be filled only partially
+    train_data, validation_data, _, _ = training_inputs(dataclasses.replace(params, cache=False), paths,
+                                                        params.batch_size)
+    _, representative = take_images(train_data, params.representative_samples)
+    sharp, blur = take_images(validation_data, params.drift_samples)
+    input_size = blur.shape[1:3]
+
+    inference_model = build_inference_model(params.model, input_shape)
+    if params.load_checkpoint is None:
+        inference_model.load_weights(paths.model_weights)
+    else:
+        load_inference_weights(params, paths, inference_model)
+
+    report = {'keras': evaluate_predictions(lambda images: inference_model(images, training=False).numpy(), sharp,
+                                            blur)}
+    Path(os.path.dirname(paths.tflite)).mkdir(parents=True, exist_ok=True)
+
+    for mode in params.tflite_modes:
+        print('Converting to TFLite ({})'.format(mode))
+        model_content = convert_tflite(inference_model, mode, input_size, representative)
+        with open(paths.tflite + '-' + mode + '.tflite', 'wb') as f:
+            f.write(model_content)
+
+        report[mode] = evaluate_predictions(TFLiteModel(model_content).predict, sharp, blur)
+        report[mode]['size_mb'] = len(model_content) / 1e6
+
+    print('Input {}x{}, {} images'.format(input_size[0], input_size[1], len(blur)))
+    print('{:10s} {:>9s} {:>9s} {:>8s} {:>11s} {:>11s} {:>10s}'.format('model', 'size (MB)', 'PSNR', 'SSIM',
+                                                                       'PSNR drift', 'SSIM drift', 'ms/image'))
+    for name, metrics in report.items():
+        metrics['psnr_drift'] = metrics['psnr'] - report['keras']['psnr']
+        metrics['ssim_drift'] = metrics['ssim'] - report['keras']['ssim']
+        print('{:10s} {:>9s} {:9.4f} {:8.4f} {:11.4f} {:11.4f} {:10.2f}'.format(
+            name, '{:.2f}'.format(metrics['size_mb']) if 'size_mb' in metrics else '-', metrics['psnr'],
+            metrics['ssim'], metrics['psnr_drift'], metrics['ssim_drift'], metrics['ms_per_image']))
+
+    with open(paths.tflite + '-report.json', 'w') as f:
+        json.dump({'input_size': list(input_size), 'images': len(blur), 'models': report}, f, indent=2)
+    print('Saved the TFLite models and their report to {}-*'.format(paths.tflite))
+
+    return report
+
+
+def benchmark(argv):
+    """
+    Runs the benchmark suite (benchmarks/run.py) with the given command line arguments.
+
+    :param argv (list): Arguments of benchmarks/run.py
+    :return: void
+    """
+    import runpy
+
+    benchmarks_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks')
+    sys.path.insert(0, benchmarks_path)
+    sys.argv = [os.path.join(benchmarks_path, 'run.py')] + list(argv)
+
+    runpy.run_path(sys.argv[0], run_name='__main__')
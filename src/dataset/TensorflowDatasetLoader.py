@@ -1,9 +1,37 @@
+import hashlib
+import os
+from glob import glob
 from os import listdir
-from os.path import isfile, join
+from os.path import isfile, join, getsize
+from pathlib import Path
+from tempfile import gettempdir
 
 import tensorflow as tf
 from numpy import float32
 
+from dataset.manifest import frame_name
+from dataset.tfrecord import parse_pair, shard_counts
+from utils.dataset import reds_pairs, png_size
+
+
+def select_patches(images, patch_size_x, patch_size_y, seed=None):
+    """
+    Select a patch on several images (e.g. sharp and blur) at the same localization.
+
+    :param images (Tuple[tf.Tensor]): Tensors for the images, with the same shape
+    :param patch_size_x (int): Size of patch along x axis
+    :param patch_size_y (int): Size of patch along y axis
+    :param seed (tf.Tensor): Stateless seed (shape (2,)) of the localization; None for a random one
+    :return: patches (Tuple[tf.Tensor]): Tuple of tensors with shape (patch_size_x, patch_size_y, 3)
+    """
+    stack = tf.stack(images, axis=0)
+    size = [len(images), patch_size_x, patch_size_y, 3]
+    if seed is None:
+        patches = tf.image.random_crop(stack, size=size)
+    else:
+        patches = tf.image.stateless_random_crop(stack, size=size, seed=seed)
+    return tuple(tf.unstack(patches, axis=0))
+
 
 def select_patch(sharp, blur, patch_size_x, patch_size_y):
     """
@@ -17,74 +45,361 @@ def select_patch(sharp, blur, patch_size_x, patch_size_y):
     :returns:
         patch (Tuple[tf.Tensor, tf.Tensor]): Tuple of tensors with shape (patch_size_x, patch_size_y, 3)
     """
-    stack = tf.stack([sharp, blur], axis=0)
-    patches = tf.image.random_crop(stack, size=[2, patch_size_x, patch_size_y, 3])
-    return patches[0], patches[1]
+    return select_patches((sharp, blur), patch_size_x, patch_size_y)
+
+
+def process_running(pid):
+    """
+    Checks whether a process is running.
+
+    :param pid (int): Process id
+    :return: running (boolean): True if the process exists
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # Running, owned by another user
+        return True
+
+    return True
+
+
+def model_inputs(sharp, blur):
+    """
+    Packs a (sharp, blur) pair as the inputs of the models, which have no targets (the loss is added to the model).
+
+    :param sharp (tf.Tensor): Tensor for the sharp images
+    :param blur (tf.Tensor): Tensor for the blur images
+    :return: inputs (Tuple[Tuple[tf.Tensor, tf.Tensor]]): (x,) with x = (sharp, blur)
+    """
+    return (sharp, blur),
+
+
+def to_float(image, dtype, centered=True):
+    """
+    Converts a decoded uint8 image to float.
+
+    :param image (tf.Tensor): uint8 image
+    :param dtype (dtype): dtype of the converted image
+    :param centered (boolean): True for an image in [-1, 1]; False for an image in [0, 1]
+    :return: image (tf.Tensor): converted image
+    """
+    image = tf.image.convert_image_dtype(image, dtype)
+    if centered:
+        image = (image - 0.5) * 2
+
+    return image
 
 
 class TensorflowDatasetLoader:
     """
     Class to load dataset using the TensorFlow Data API.
+
+    The images are cropped while still uint8 and only the patches are converted to float. The cache (if any) holds
+    the png bytes or the decoded uint8 images, in memory or in a file on disk.
     """
-    def __init__(self, dataset_path, batch_size=8, patch_size=(256, 256)):
+    def __init__(self, dataset_path=None, batch_size=8, patch_size=(256, 256), sharp_path=None, blur_path=None,
+                 manifest=None, subset=None, validation_split=0.0, shuffle=True, repeat=True, crop=True, centered=True,
+                 cache=True, cache_content='bytes', cache_budget=None, cache_path=None, seed=None,
+                 blur_augmentation=None, fixed=False, shuffle_buffer=1024):
         """
         Class constructor.
 
+        The images can be given with a manifest (see dataset/manifest.py), with dataset_path (dataset_path/sharp/ and
+        dataset_path/blur/) or with sharp_path and blur_path (e.g. the reds train_sharp and train_blur folders, paired
+        by relative path).
+
         :param dataset_path (string): Path to the dataset
         :param batch_size (int): batch size
         :param patch_size (Tuple[int, int]): dimension of the patch
+        :param sharp_path (string): Path to the sharp set
+        :param blur_path (string): Path to the blur set
+        :param manifest (list): Rows of a manifest, in order
+        :param subset (string): 'training', 'validation' or None (whole set). Same semantic of the
+            ImageDataGenerator: the validation subset is the first validation_split fraction of the sorted images
+        :param validation_split (float): Fraction of the images reserved to the validation subset
+        :param shuffle (boolean): True for shuffling the images, in a new order at each pass
+        :param repeat (boolean): True for repeating the dataset indefinitely
+        :param crop (boolean): True for selecting a random patch; False for the whole images
+        :param centered (boolean): True for images in [-1, 1]; False for images in [0, 1]
+        :param cache (boolean or string): False (or None) for no cache; True (or 'memory') for caching in memory, or on
+            disk if the cache would exceed cache_budget; 'disk' for caching on disk
+        :param cache_content (string): 'bytes' for caching the png bytes; 'uint8' for caching the decoded images
+        :param cache_budget (int): Max size (in bytes) of the memory cache; None for no limit. The estimated size of the
+            memory cache is then in the cache_bytes attribute (e.g. to share a budget among several loaders)
+        :param cache_path (string): Folder of the disk cache (default: the system temporary folder)
+        :param seed (int): Seed of the shuffling
+        :param blur_augmentation (BlurAugmentation): If given, the blur images are not read: they are synthesized
+            from the sharp patches, on the fly (see dataset/augment.py)
+        :param fixed (boolean): True for the same patches and degradations at each pass (e.g. a validation set, not
+            shuffled); False for new ones at each pass
+        :param shuffle_buffer (int): Number of (uint8) patches of the shuffle buffer, after the cache
         """
-        p = dataset_path+'sharp/'
-        # List all images paths
-        # sharp_images_paths = [str(path) for path in Path(dataset_path).glob("*/sharp/*.png")]
-        sharp_images_paths = [p+f for f in listdir(p) if isfile(join(p, f))]
-        # if n_images is not None:
-        #     sharp_images_paths = sharp_images_paths[0:n_images]
-
-        # Generate corresponding blurred images paths
-        blur_images_paths = [path.replace("sharp", "blur") for path in sharp_images_paths]
-
-        # Load sharp and blurred images
-        sharp_dataset = tf.data.Dataset.from_tensor_slices(sharp_images_paths).map(
-            lambda path: self.load_image(path, float32),
+        if manifest is not None:
+            names = [frame_name(row) for row in manifest]
+            sharp_images_paths = [row['sharp'] for row in manifest]
+            blur_images_paths = [row['blur'] for row in manifest]
+        elif sharp_path is not None:
+            pairs = reds_pairs(sharp_path, blur_path)
+            names = [pair[0] for pair in pairs]
+            sharp_images_paths = [pair[1] for pair in pairs]
+            blur_images_paths = [pair[2] for pair in pairs]
+        else:
+            p = dataset_path+'sharp/'
+            # List all images paths
+            # sharp_images_paths = [str(path) for path in Path(dataset_path).glob("*/sharp/*.png")]
+            names = sorted([f for f in listdir(p) if isfile(join(p, f))])
+            sharp_images_paths = [p+f for f in names]
+            # if n_images is not None:
+            #     sharp_images_paths = sharp_images_paths[0:n_images]
+
+            # Generate corresponding blurred images paths
+            blur_images_paths = [path.replace("sharp", "blur") for path in sharp_images_paths]
+
+        # Split the images as the ImageDataGenerator does
+        split = int(validation_split * len(names))
+        if subset == 'training':
+            selected = slice(split, len(names))
+        elif subset == 'validation':
+            selected = slice(0, split)
+        else:
+            selected = slice(0, len(names))
+
+        self.names = names[selected]
+        self.samples = len(self.names)
+        sharp_images_paths = sharp_images_paths[selected]
+        blur_images_paths = blur_images_paths[selected]
+
+        if blur_augmentation is not None:
+            # Only the sharp images are read, the blur ones are synthesized
+            blur_images_paths = []
+        images_paths = [sharp_images_paths, blur_images_paths] if blur_augmentation is None else [sharp_images_paths]
+
+        if cache_content not in ['bytes', 'uint8']:
+            raise ValueError('Unknown cache_content {}, expected \'bytes\' or \'uint8\''.format(cache_content))
+        cache_filename, self.cache_bytes = self.cache_filename(sharp_images_paths, blur_images_paths, cache,
+                                                              cache_content, cache_budget, cache_path)
+
+        # Each element is a (sharp, blur) pair, or a (sharp,) tuple with the blur augmentation
+        paths = tf.data.Dataset.from_tensor_slices(tuple(images_paths))
+        if shuffle:
+            # Cheap shuffle of the paths, in a new order at each pass. A cache replays the order of the first pass:
+            # the patches are shuffled again below
+            paths = paths.shuffle(buffer_size=max(1, self.samples), seed=seed)
+
+        # Read the png bytes of sharp and blurred images
+        dataset = paths.map(
+            lambda *images_paths: tuple(tf.io.read_file(path) for path in images_paths),
             num_parallel_calls=tf.data.experimental.AUTOTUNE,
         )
-        blur_dataset = tf.data.Dataset.from_tensor_slices(blur_images_paths).map(
-            lambda path: self.load_image(path, float32),
+        if cache_filename is not None and cache_content == 'bytes':
+            dataset = dataset.cache(cache_filename)
+
+        # Decode them to uint8
+        dataset = dataset.map(
+            lambda *images: tuple(tf.image.decode_png(image, channels=3) for image in images),
             num_parallel_calls=tf.data.experimental.AUTOTUNE,
         )
-
-        dataset = tf.data.Dataset.zip((sharp_dataset, blur_dataset))
-        dataset = dataset.cache()
+        if cache_filename is not None and cache_content == 'uint8':
+            dataset = dataset.cache(cache_filename)
 
         # Select the same patch on the sharp image and its corresponding blurred
+        if crop and fixed:
+            # Localization drawn from the index of the image: the same patches at each pass
+            crop_seed = seed if seed is not None else 0
+            dataset = dataset.enumerate().map(
+                lambda i, images: select_patches(images, patch_size[0], patch_size[1],
+                                                 tf.stack([tf.constant(crop_seed, tf.int64), i])),
+                num_parallel_calls=tf.data.experimental.AUTOTUNE,
+            )
+        elif crop:
+            dataset = dataset.map(
+                lambda *images: select_patches(images, patch_size[0], patch_size[1]),
+                num_parallel_calls=tf.data.experimental.AUTOTUNE,
+            )
+
+        if shuffle:
+            # New order at each pass, also after the cache: the small uint8 patches fill the buffer
+            dataset = dataset.shuffle(buffer_size=max(1, min(self.samples, shuffle_buffer)), seed=seed)
+
+        # Only the patches are converted to float
         dataset = dataset.map(
-            lambda sharp_image, blur_image: select_patch(
-                sharp_image, blur_image, patch_size[0], patch_size[1]
-            ),
+            lambda *images: tuple(to_float(image, float32, centered) for image in images),
             num_parallel_calls=tf.data.experimental.AUTOTUNE,
         )
 
         # Define dataset characteristics (batch_size, number_of_epochs, shuffling)
         dataset = dataset.batch(batch_size)
-        dataset = dataset.shuffle(buffer_size=50)
-        dataset = dataset.repeat()
+        if blur_augmentation is not None and fixed:
+            # Before the repeat: the batch indexes (and so the degradations) start again at each pass
+            dataset = blur_augmentation.apply(dataset.map(lambda sharp_image: sharp_image))
+        if repeat:
+            dataset = dataset.repeat()
+        if blur_augmentation is not None and not fixed:
+            # After the repeat: each pass sees new degradations
+            dataset = blur_augmentation.apply(dataset.map(lambda sharp_image: sharp_image))
         dataset = dataset.prefetch(buffer_size=tf.data.experimental.AUTOTUNE)
 
         self.dataset = dataset
 
     @staticmethod
-    def load_image(image_path, dtype):
+    def cache_filename(sharp_images_paths, blur_images_paths, cache, cache_content, cache_budget, cache_path):
+        """
+        Chooses where to cache the dataset.
+
+        :param sharp_images_paths (list): Paths to the sharp images
+        :param blur_images_paths (list): Paths to the blur images
+        :param cache (boolean or string): See the class constructor
+        :param cache_content (string): 'bytes' or 'uint8'
+        :param cache_budget (int): Max size (in bytes) of the memory cache; None for no limit
+        :param cache_path (string): Folder of the disk cache
+        :return: cache (Tuple[string, int]): filename (None for no cache, '' for the memory cache, the cache file
+            otherwise) and estimated size in bytes of the memory cache (0 if it is not checked against a budget)
+        """
+        if cache is None or cache is False or len(sharp_images_paths) == 0:
+            return None, 0
+
+        if cache is True or cache == 'memory':
+            if cache_budget is None:
+                return '', 0
+
+            # Estimate the size of the cache
+            if cache_content == 'bytes':
+                size = sum(getsize(p) for p in sharp_images_paths + blur_images_paths)
+            else:
+                height, width = png_size(sharp_images_paths[0])
+                size = height * width * 3 * (len(sharp_images_paths) + len(blur_images_paths))
+
+            if size <= cache_budget:
+                return '', size
+
+            print('Cache of {:.1f} GB exceeds the budget of {:.1f} GB: caching on disk'.format(size / 1e9,
+                                                                                            cache_budget / 1e9))
+        elif cache != 'disk':
+            raise ValueError('Unknown cache {}, expected True, False, \'memory\' or \'disk\''.format(cache))
+
+        if cache_path is None:
+            cache_path = gettempdir()
+        Path(cache_path).mkdir(parents=True, exist_ok=True)
+
+        # Different sets (or contents) never share the same cache file, nor the concurrent runs: the file (and its
+        # lockfile) belongs to the process. The files left by the runs that are over are removed
+        key = hashlib.md5('\n'.join([cache_content] + sharp_images_paths + blur_images_paths).encode()).hexdigest()
+        prefix = join(cache_path, 'deblur-cache-' + key + '-')
+        for stale in glob(prefix + '*'):
+            pid = stale[len(prefix):].split('.')[0].split('_')[0]
+            if pid.isdigit() and int(pid) != os.getpid() and not process_running(int(pid)):
+                os.remove(stale)
+
+        return prefix + str(os.getpid()), 0
+
+    @staticmethod
+    def load_image(image_path, dtype, centered=True):
         """
         Loads an image.
 
         :param image_path (string): Path to the image
         :param dtype (dtype): dtype of the loaded image
+        :param centered (boolean): True for an image in [-1, 1]; False for an image in [0, 1]
         :return:
         """
         image = tf.io.read_file(image_path)
         image = tf.image.decode_png(image, channels=3)
-        image = tf.image.convert_image_dtype(image, dtype)
-        image = (image - 0.5) * 2
 
-        return image
+        return to_float(image, dtype, centered)
+
+
+class TFRecordDatasetLoader:
+    """
+    Class to load the (sharp, blur) pairs packed in sharded TFRecord files (see dataset/tfrecord.py), reading the
+    shards in parallel.
+    """
+    def __init__(self, file_pattern, batch_size=8, patch_size=(256, 256), subset=None, validation_split=0.0,
+                 shuffle=True, repeat=True, crop=True, centered=True, cycle_length=None, seed=None,
+                 blur_augmentation=None, fixed=False):
+        """
+        Class constructor.
+
+        :param file_pattern (string): Glob pattern of the shards (e.g. '../res/datasets/REDS/tfrecord/train/*.tfrecord')
+        :param batch_size (int): batch size
+        :param patch_size (Tuple[int, int]): dimension of the patch
+        :param subset (string): 'training', 'validation' or None (all the shards). The validation subset is made of the
+            first validation_split fraction of the sorted shards (at least one), that hold the first frames of the set
+        :param validation_split (float): Fraction of the shards reserved to the validation subset
+        :param shuffle (boolean): True for shuffling the shards and the pairs
+        :param repeat (boolean): True for repeating the dataset indefinitely
+        :param crop (boolean): True for selecting a random patch; False for the whole images
+        :param centered (boolean): True for images in [-1, 1]; False for images in [0, 1]
+        :param cycle_length (int): Number of shards read concurrently (None for AUTOTUNE)
+        :param seed (int): Seed of the shuffling
+        :param blur_augmentation (BlurAugmentation): If given, the blur images of the records are dropped: they are
+            synthesized from the sharp patches, on the fly (see dataset/augment.py)
+        :param fixed (boolean): True for the same patches and degradations at each pass (e.g. a validation set, not
+            shuffled); False for new ones at each pass
+        """
+        autotune = tf.data.experimental.AUTOTUNE
+
+        files = sorted(tf.io.gfile.glob(file_pattern))
+        if len(files) == 0:
+            raise ValueError('No TFRecord shard matches {}'.format(file_pattern))
+
+        if subset is not None:
+            if len(files) < 2:
+                raise ValueError('Splitting {} needs at least 2 shards, found {}'.format(file_pattern, len(files)))
+            split = min(max(1, int(validation_split * len(files))), len(files) - 1)
+            files = files[:split] if subset == 'validation' else files[split:]
+
+        self.files = files
+        self.samples = sum(shard_counts(files))
+
+        files = tf.data.Dataset.from_tensor_slices(files)
+        if shuffle:
+            files = files.shuffle(buffer_size=len(self.files), seed=seed)
+        # Large sequential reads from several shards at the same time
+        dataset = files.interleave(tf.data.TFRecordDataset,
+                                   cycle_length=cycle_length if cycle_length is not None else autotune,
+                                   num_parallel_calls=autotune, deterministic=not shuffle)
+
+        if shuffle:
+            dataset = dataset.shuffle(buffer_size=50, seed=seed)
+
+        dataset = dataset.map(parse_pair, num_parallel_calls=autotune)
+        if blur_augmentation is None:
+            dataset = dataset.map(lambda name, sharp, blur: (sharp, blur), num_parallel_calls=autotune)
+        else:
+            # Only the sharp images are kept, the blur ones are synthesized
+            dataset = dataset.map(lambda name, sharp, blur: (sharp,), num_parallel_calls=autotune)
+
+        # Crop the uint8 images, then convert only the patches to float
+        if crop and fixed:
+            # Localization drawn from the index of the pair: the same patches at each pass
+            crop_seed = seed if seed is not None else 0
+            dataset = dataset.enumerate().map(
+                lambda i, images: select_patches(images, patch_size[0], patch_size[1],
+                                                 tf.stack([tf.constant(crop_seed, tf.int64), i])),
+                num_parallel_calls=autotune,
+            )
+        elif crop:
+            dataset = dataset.map(
+                lambda *images: select_patches(images, patch_size[0], patch_size[1]),
+                num_parallel_calls=autotune,
+            )
+
+        dataset = dataset.map(
+            lambda *images: tuple(to_float(image, float32, centered) for image in images),
+            num_parallel_calls=autotune,
+        )
+
+        dataset = dataset.batch(batch_size)
+        if blur_augmentation is not None and fixed:
+            # Before the repeat: the batch indexes (and so the degradations) start again at each pass
+            dataset = blur_augmentation.apply(dataset.map(lambda sharp_image: sharp_image))
+        if repeat:
+            dataset = dataset.repeat()
+        if blur_augmentation is not None and not fixed:
+            # After the repeat: each pass sees new degradations
+            dataset = blur_augmentation.apply(dataset.map(lambda sharp_image: sharp_image))
+        dataset = dataset.prefetch(buffer_size=autotune)
+
+        self.dataset = dataset
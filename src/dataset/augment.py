@@ -0,0 +1,154 @@
+import math
+
+import numpy as np
+import tensorflow as tf
+
+from utils.dataset import min_sigma, max_sigma
+
+
+def gaussian_kernels(sigmas, radius):
+    """
+    1D gaussian kernels, one per sigma (a sigma of 0 gives the identity kernel).
+
+    :param sigmas (tf.Tensor): Standard deviations with shape (batch_size,)
+    :param radius (int): Radius of the kernels (size 2 * radius + 1)
+    :return: kernels (tf.Tensor): Normalized kernels with shape (batch_size, 2 * radius + 1)
+    """
+    x = tf.range(-radius, radius + 1, dtype=tf.float32)
+    sigmas = tf.maximum(tf.cast(sigmas, tf.float32), 1e-3)[:, None]
+    kernels = tf.exp(-0.5 * tf.square(x[None, :] / sigmas))
+
+    return kernels / tf.reduce_sum(kernels, axis=1, keepdims=True)
+
+
+def motion_kernels(lengths, angles, size):
+    """
+    2D linear motion kernels: segments centered in the kernel, anti-aliased (weight 1 - distance from the segment).
+
+    :param lengths (tf.Tensor): Lengths of the segments in pixels, with shape (batch_size,)
+    :param angles (tf.Tensor): Angles of the segments in radians, with shape (batch_size,)
+    :param size (int): Size of the kernels (odd)
+    :return: kernels (tf.Tensor): Normalized kernels with shape (batch_size, size, size)
+    """
+    r = size // 2
+    y, x = tf.meshgrid(tf.range(-r, r + 1, dtype=tf.float32), tf.range(-r, r + 1, dtype=tf.float32), indexing='ij')
+    dx = tf.cos(angles)[:, None, None]
+    dy = tf.sin(angles)[:, None, None]
+    half = (tf.cast(lengths, tf.float32) / 2)[:, None, None]
+
+    # Distance of each pixel from the segment [-half, half] along the direction (dx, dy)
+    t = tf.clip_by_value(x[None] * dx + y[None] * dy, -half, half)
+    distance = tf.sqrt(tf.square(x[None] - t * dx) + tf.square(y[None] - t * dy))
+    kernels = tf.nn.relu(1. - distance)
+
+    return kernels / tf.reduce_sum(kernels, axis=[1, 2], keepdims=True)
+
+
+def filter_images(images, kernels):
+    """
+    Filters each image with its own kernel, as a single depthwise convolution (the images of the batch are moved to
+    the channels). The borders are reflected, as in scipy.ndimage.gaussian_filter.
+
+    :param images (tf.Tensor): Images with shape (batch_size, height, width, channels)
+    :param kernels (tf.Tensor): Kernels with shape (batch_size, kernel_height, kernel_width), odd sizes not larger
+        than twice the images
+    :return: filtered (tf.Tensor): Filtered images, same shape of images
+    """
+    kh, kw = kernels.shape[1] // 2, kernels.shape[2] // 2
+    shape = tf.shape(images)
+    channels = images.shape[-1]
+
+    padded = tf.pad(images, [[0, 0], [kh, kh], [kw, kw], [0, 0]], mode='SYMMETRIC')
+    # (batch_size, height, width, channels) -> (1, height, width, batch_size * channels)
+    x = tf.transpose(padded, [1, 2, 0, 3])
+    x = tf.reshape(x, [1, shape[1] + 2 * kh, shape[2] + 2 * kw, shape[0] * channels])
+
+    # The kernel of an image is repeated for each of its channels
+    f = tf.repeat(tf.transpose(tf.cast(kernels, images.dtype), [1, 2, 0]), channels, axis=2)[..., None]
+
+    y = tf.nn.depthwise_conv2d(x, f, strides=[1, 1, 1, 1], padding='VALID')
+    y = tf.reshape(y, [shape[1], shape[2], shape[0], channels])
+
+    return tf.transpose(y, [2, 0, 1, 3])
+
+
+class BlurAugmentation:
+    """
+    Class to blur sharp images on the fly, inside the input pipeline: a gaussian blur with a random (continuous) sigma
+    per image, optionally followed by a random linear motion blur. The random parameters are drawn with stateless
+    random ops, from the seed and the index of the batch: a given seed always produces the same degradations.
+    """
+    def __init__(self, sigma_range=(min_sigma, max_sigma), motion_probability=0., max_motion_length=15, seed=None,
+                 truncate=4.0):
+        """
+        Class constructor.
+
+        :param sigma_range (Tuple[float, float]): Range of the sigmas of the gaussian blur
+        :param motion_probability (float): Probability of a motion blur (0 for gaussian blur only)
+        :param max_motion_length (int): Max length of the motion blur, in pixels
+        :param seed (int): Seed of the degradations (default: random)
+        :param truncate (float): Radius of the gaussian kernels, in sigmas (as in scipy.ndimage.gaussian_filter)
+        """
+        self.sigma_range = tuple(float(s) for s in sigma_range)
+        self.motion_probability = float(motion_probability)
+        self.max_motion_length = int(max_motion_length)
+        self.seed = int(seed) if seed is not None else np.random.randint(2 ** 31 - 1)
+        self.radius = int(math.floor(truncate * self.sigma_range[1] + 0.5))
+
+    def __call__(self, sharp, seed):
+        """
+        Blurs a batch of images.
+
+        :param sharp (tf.Tensor): Float images with shape (batch_size, height, width, channels)
+        :param seed (tf.Tensor): Stateless seed (shape (2,)) of the batch
+        :return: blur (tf.Tensor): Blurred images, same shape and dtype of sharp
+        """
+        seeds = tf.random.experimental.stateless_split(tf.cast(seed, tf.int64), 4)
+        n = tf.shape(sharp)[0]
+
+        sigmas = tf.random.stateless_uniform([n], seeds[0], self.sigma_range[0], self.sigma_range[1])
+        kernels = gaussian_kernels(sigmas, self.radius)
+        # Separable gaussian: vertical, then horizontal pass
+        blur = filter_images(sharp, kernels[:, :, None])
+        blur = filter_images(blur, kernels[:, None, :])
+
+        if self.motion_probability > 0:
+            size = self.max_motion_length // 2 * 2 + 1
+            lengths = tf.random.stateless_uniform([n], seeds[1], 1., float(self.max_motion_length))
+            angles = tf.random.stateless_uniform([n], seeds[2], 0., math.pi)
+            motion = tf.random.stateless_uniform([n], seeds[3]) < self.motion_probability
+
+            # No motion: a segment of length 0, i.e. the identity kernel
+            blur = filter_images(blur, motion_kernels(tf.where(motion, lengths, 0.), angles, size))
+
+        return blur
+
+    def apply(self, dataset):
+        """
+        Adds the blur to a dataset of sharp batches. The seed of each batch is derived from its position in the
+        dataset: applied to a repeated dataset, each pass sees new degradations.
+
+        :param dataset (tf.data.Dataset): Batches of float sharp images
+        :return: dataset (tf.data.Dataset): (sharp, blur) batches
+        """
+        def blur_batch(i, sharp):
+            return sharp, self(sharp, tf.stack([tf.constant(self.seed, tf.int64), i]))
+
+        return dataset.enumerate().map(blur_batch, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+
+    def blur_array(self, images, batch_size=1024):
+        """
+        Blurs an array of uint8 images (e.g. a fixed blurred test set, the same for a given seed).
+
+        :param images (np.array): uint8 images with shape (n_images, height, width, channels)
+        :param batch_size (int): Number of images blurred at once
+        :return: blurred (np.array): Blurred uint8 images
+        """
+        result = np.empty(images.shape, dtype=np.uint8)
+
+        for i, start in enumerate(range(0, len(images), batch_size)):
+            sharp = tf.convert_to_tensor(np.asarray(images[start:start + batch_size], dtype=np.float32))
+            blur = self(sharp, tf.constant([self.seed, i], tf.int64))
+            result[start:start + batch_size] = np.clip(np.round(blur.numpy()), 0, 255).astype(np.uint8)
+
+        return result
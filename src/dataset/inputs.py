@@ -0,0 +1,230 @@
+import numpy as np
+import tensorflow as tf
+
+from dataset.augment import BlurAugmentation
+from dataset.manifest import split_manifest, frame_name
+from dataset.prepare import prepare_cifar, prepare_reds
+from dataset.TensorflowDatasetLoader import TensorflowDatasetLoader, TFRecordDatasetLoader, model_inputs
+from nn.distribute import shard_dataset, generator_dataset
+from utils.dataset import PairArrayIterator, PairFileIterator, random_crops
+
+rescale = 1./255
+validation_split = 0.1
+# Channel last
+input_shape = (None, None, 3)
+random_crop_size = (256, 256)
+
+
+def blur_augmentation(params, subset='training'):
+    """
+    Blur augmentation of the run (see dataset/augment.py), if online_blur. Each subset has its own seed, derived from
+    the seed of the run: the batches of the subsets do not share their degradations.
+
+    :param params (Params): Parameters
+    :param subset (string): 'training', 'validation' or 'test'
+    :return: augmentation (BlurAugmentation): Augmentation, None without online_blur
+    """
+    if not params.online_blur:
+        return None
+
+    seed = params.seed
+    if subset != 'training':
+        seed = int(np.random.SeedSequence([params.seed, ['validation', 'test'].index(subset)]).generate_state(1)[0])
+
+    return BlurAugmentation(params.blur_sigma, params.motion_blur, seed=seed % (2 ** 31 - 1))
+
+
+def augmented_array_inputs(images, batch_size, augmentation, seed=None):
+    """
+    Creates an infinite tf.data pipeline of (sharp, blur) batches from an array of sharp images, blurred on the fly
+    (new degradations and order at each epoch). Only the indexes are shuffled: the images of each batch are read from
+    the (memory-mapped) array when the batch is needed.
+
+    :param images (np.array): uint8 sharp images with shape (n_images, height, width, channels)
+    :param batch_size (int): Batch size
+    :param augmentation (BlurAugmentation): Blur augmentation
+    :param seed (int): Seed of the shuffling
+    :return: dataset (tf.data.Dataset): ((sharp, blur),) batches
+    """
+    def read_batch(indexes):
+        sharp = tf.numpy_function(lambda i: images[np.sort(i)], [indexes], tf.uint8)
+        sharp.set_shape((None,) + tuple(images.shape[1:]))
+
+        return tf.cast(sharp, tf.float32) * rescale
+
+    dataset = tf.data.Dataset.range(len(images))
+    dataset = dataset.shuffle(buffer_size=max(1, len(images)), seed=seed).batch(batch_size)
+    dataset = dataset.map(read_batch, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+
+    return augmentation.apply(dataset.repeat()).map(model_inputs).prefetch(tf.data.experimental.AUTOTUNE)
+
+
+def training_inputs(params, paths, batch_size, strategy=None):
+    """
+    Creates the training and validation inputs of the task (random crops for reds, whole images for cifar). The
+    batches are packed as a single input ((sharp, blur),), since the models have no targets.
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :param batch_size (int): Global batch size
+    :param strategy (tf.distribute.Strategy): Strategy of the training; with several replicas, the batches are split
+        among them
+    :return: inputs (Tuple[object, object, int, int]): training and validation inputs (tf.data.Dataset or
+        generators, infinite), training and validation steps per epoch
+    """
+    augmentation = blur_augmentation(params)
+
+    if 'reds' in params.task and params.input_backend == 'tfdata':
+        manifest = prepare_reds(paths)['train']
+
+        # tf.data pipelines: parallel decoding and paired random crop, out of the Python thread. The validation
+        # batches come in a fixed order, with the same patches and degradations at each epoch. Both memory caches fit
+        # in the same budget, the training one first
+        loaders = []
+        budget = params.cache_budget
+        for subset in ['training', 'validation']:
+            loaders.append(TensorflowDatasetLoader(manifest=manifest, batch_size=batch_size,
+                                                   patch_size=random_crop_size, subset=subset,
+                                                   validation_split=validation_split, shuffle=subset == 'training',
+                                                   centered=False, cache=params.cache, cache_budget=budget,
+                                                   cache_path=paths.cache, seed=params.seed,
+                                                   blur_augmentation=blur_augmentation(params, subset),
+                                                   fixed=subset == 'validation'))
+            if budget is not None:
+                budget = max(0, budget - loaders[-1].cache_bytes)
+
+        train = loaders[0].dataset.map(model_inputs)
+        validation = loaders[1].dataset.map(model_inputs)
+        train_steps = loaders[0].samples // batch_size
+        validation_steps = loaders[1].samples // batch_size
+    elif 'reds' in params.task and params.input_backend == 'tfrecord':
+        # Pairs packed in TFRecord shards (see dataset/tfrecord.py), read in parallel; the validation shards are the
+        # first ones, with the same patches and degradations at each epoch
+        loaders = [TFRecordDatasetLoader(paths.reds_tfrecords['train'] + '*.tfrecord', batch_size=batch_size,
+                                         patch_size=random_crop_size, subset=subset,
+                                         validation_split=validation_split, shuffle=subset == 'training',
+                                         centered=False, seed=params.seed,
+                                         blur_augmentation=blur_augmentation(params, subset),
+                                         fixed=subset == 'validation')
+                   for subset in ['training', 'validation']]
+
+        train = loaders[0].dataset.map(model_inputs)
+        validation = loaders[1].dataset.map(model_inputs)
+        train_steps = loaders[0].samples // batch_size
+        validation_steps = loaders[1].samples // batch_size
+    elif 'reds' in params.task:
+        manifest = prepare_reds(paths)['train']
+
+        # The (sharp, blur) pairs of the manifest are read together and cropped
+        generators = {}
+        for subset in ['training', 'validation']:
+            rows = split_manifest(manifest, subset, validation_split)
+            generators[subset] = PairFileIterator([row['sharp'] for row in rows], [row['blur'] for row in rows],
+                                                  batch_size=batch_size, seed=params.seed, rescale=rescale)
+
+        train = (model_inputs(*batch) for batch in random_crops(generators['training'], random_crop_size))
+        validation = (model_inputs(*batch) for batch in random_crops(generators['validation'], random_crop_size))
+        train_steps = generators['training'].samples // batch_size
+        validation_steps = generators['validation'].samples // batch_size
+    elif augmentation is not None:
+        cifar = prepare_cifar(paths, blur=False)
+
+        # Only the sharp images are stored: the training images are blurred in the pipeline, the validation ones
+        # (head of the set, as with the ImageDataGenerator) once, in a fixed order
+        split = int(len(cifar['train']) * validation_split)
+        train = augmented_array_inputs(cifar['train'][split:], batch_size, augmentation, params.seed)
+        val_generator = PairArrayIterator(cifar['train'][:split],
+                                          blur_augmentation(params, 'validation').blur_array(cifar['train'][:split]),
+                                          batch_size=batch_size, shuffle=False, rescale=rescale)
+        validation = (model_inputs(*batch) for batch in val_generator)
+        train_steps = (len(cifar['train']) - split + batch_size - 1) // batch_size
+        validation_steps = len(val_generator)
+    else:
+        cifar = prepare_cifar(paths)
+
+        # The sharp and blur images are read together from the memory-mapped arrays
+        train_generator = PairArrayIterator(cifar['train'], cifar['train_b'], batch_size=batch_size,
+                                            seed=params.seed, subset='training', validation_split=validation_split,
+                                            rescale=rescale)
+        val_generator = PairArrayIterator(cifar['train'], cifar['train_b'], batch_size=batch_size, seed=params.seed,
+                                          subset='validation', validation_split=validation_split, rescale=rescale)
+
+        train = (model_inputs(*batch) for batch in train_generator)
+        validation = (model_inputs(*batch) for batch in val_generator)
+        train_steps = len(train_generator)
+        validation_steps = len(val_generator)
+
+    # With several replicas, the training and validation batches are split among them (the generators are wrapped in
+    # tf.data pipelines)
+    if strategy is not None and strategy.num_replicas_in_sync > 1:
+        if not isinstance(train, tf.data.Dataset):
+            train = generator_dataset(train, input_shape)
+        if not isinstance(validation, tf.data.Dataset):
+            validation = generator_dataset(validation, input_shape)
+
+        train = shard_dataset(train)
+        validation = shard_dataset(validation)
+
+    return train, validation, train_steps, validation_steps
+
+
+def reds_test_inputs(params, paths, manifest=None, sharp=True):
+    """
+    Creates the input of the reds validation set used for testing: whole images, in order, one pass.
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :param manifest (list): Rows of the validation manifest to predict (default: all of them)
+    :param sharp (boolean): True for (sharp, blur) batches; False for batches of blur images only, the sharp ones are
+        not read (e.g. to predict)
+    :return: inputs (Tuple[iterable, list, int]): batches of predict_batch_size images, names of the images (relative
+        to the output folder) and number of batches
+    """
+    if manifest is None:
+        manifest = prepare_reds(paths)['val']
+    names = [frame_name(row) for row in manifest]
+    batch_size = params.predict_batch_size
+    n_batches = (len(manifest) + batch_size - 1) // batch_size
+
+    if params.input_backend != 'keras' and sharp:
+        loader = TensorflowDatasetLoader(manifest=manifest, batch_size=batch_size, shuffle=False, repeat=False,
+                                         crop=False, centered=False, cache=False)
+
+        return loader.dataset, names, n_batches
+
+    if params.input_backend != 'keras':
+        dataset = tf.data.Dataset.from_tensor_slices([row['blur'] for row in manifest])
+        dataset = dataset.map(lambda path: TensorflowDatasetLoader.load_image(path, tf.float32, centered=False),
+                              num_parallel_calls=tf.data.experimental.AUTOTUNE)
+
+        return dataset.batch(batch_size).prefetch(tf.data.experimental.AUTOTUNE), names, n_batches
+
+    generator = PairFileIterator([row['sharp'] for row in manifest] if sharp else None,
+                                 [row['blur'] for row in manifest], batch_size=batch_size, shuffle=False,
+                                 rescale=rescale)
+    if not sharp:
+        return (blur for _, blur in generator), names, n_batches
+
+    return generator, names, n_batches
+
+
+def cifar_test_inputs(params, paths, batch_size):
+    """
+    Creates the input of the cifar test set: whole images, in order. With online_blur, the test set is blurred once,
+    with the same degradations for a given seed.
+
+    :param params (Params): Parameters
+    :param paths (Paths): Paths of the run
+    :param batch_size (int): Batch size
+    :return: generator (PairArrayIterator): (sharp, blur) batches (infinite)
+    """
+    augmentation = blur_augmentation(params, 'test')
+
+    if augmentation is not None:
+        cifar = prepare_cifar(paths, blur=False)
+        cifar['test_b'] = augmentation.blur_array(cifar['test'])
+    else:
+        cifar = prepare_cifar(paths)
+
+    return PairArrayIterator(cifar['test'], cifar['test_b'], batch_size=batch_size, seed=params.seed, shuffle=False,
+                             rescale=rescale)
@@ -0,0 +1,146 @@
+import csv
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from utils.dataset import png_size
+
+# Columns of the manifest: one row per (sharp, blur) pair, sorted by scene and frame
+manifest_columns = ['scene', 'frame', 'sharp', 'blur', 'height', 'width']
+
+
+def scan_scene(sharp_path, blur_path, scene, extension='.png'):
+    """
+    Lists the (sharp, blur) pairs of a scene, pairing the frames by file name. Only the png headers are read (size).
+
+    :param sharp_path (string): Path to the sharp set
+    :param blur_path (string): Path to the blur set
+    :param scene (string): Name of the scene (sub folder of both sets)
+    :param extension (string): Extension of the images
+    :return: rows (list): Rows of the manifest (dicts with the manifest_columns keys), sorted by frame
+    """
+    sharp_scene = os.path.join(sharp_path, scene)
+    blur_scene = os.path.join(blur_path, scene)
+
+    with os.scandir(sharp_scene) as entries:
+        frames = sorted(entry.name for entry in entries if entry.is_file() and entry.name.endswith(extension))
+    with os.scandir(blur_scene) as entries:
+        blur_frames = set(entry.name for entry in entries if entry.is_file())
+
+    rows = []
+    for frame in frames:
+        if frame not in blur_frames:
+            continue
+
+        sharp_fn = os.path.join(sharp_scene, frame)
+        height, width = png_size(sharp_fn)
+        rows.append({'scene': scene, 'frame': frame, 'sharp': sharp_fn, 'blur': os.path.join(blur_scene, frame),
+                     'height': height, 'width': width})
+
+    return rows
+
+
+def build_manifest(sharp_path, blur_path, workers=None):
+    """
+    Builds the manifest of a reds set (sharp_path/<scene>/<frame>.png paired with blur_path/<scene>/<frame>.png),
+    scanning the scenes in parallel. The images are neither moved nor decoded.
+
+    :param sharp_path (string): Path to the sharp set
+    :param blur_path (string): Path to the blur set
+    :param workers (int): Number of threads scanning the scenes (default: ThreadPoolExecutor default)
+    :return: rows (list): Rows of the manifest, sorted by scene and frame
+    """
+    with os.scandir(sharp_path) as entries:
+        scenes = sorted(entry.name for entry in entries if entry.is_dir())
+    scenes = [scene for scene in scenes if os.path.isdir(os.path.join(blur_path, scene))]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        scanned = executor.map(lambda scene: scan_scene(sharp_path, blur_path, scene), scenes)
+
+        return [row for rows in scanned for row in rows]
+
+
+def write_manifest(rows, path):
+    """
+    Writes a manifest as a csv file.
+
+    :param rows (list): Rows of the manifest
+    :param path (string): Path of the csv file
+    :return: void
+    """
+    Path(os.path.dirname(path) or '.').mkdir(parents=True, exist_ok=True)
+
+    # Written aside and renamed, a concurrent reader never sees a partial manifest
+    with open(path + '.tmp', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=manifest_columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    os.replace(path + '.tmp', path)
+
+
+def read_manifest(path):
+    """
+    Reads a manifest csv file.
+
+    :param path (string): Path of the csv file
+    :return: rows (list): Rows of the manifest
+    """
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    for row in rows:
+        row['height'] = int(row['height'])
+        row['width'] = int(row['width'])
+
+    return rows
+
+
+def load_manifest(sharp_path, blur_path, path, rebuild=False):
+    """
+    Reads the manifest of a reds set, building (and saving) it if it does not exist.
+
+    :param sharp_path (string): Path to the sharp set
+    :param blur_path (string): Path to the blur set
+    :param path (string): Path of the csv file
+    :param rebuild (boolean): True for building the manifest even if it exists
+    :return: rows (list): Rows of the manifest
+    """
+    if not rebuild and os.path.exists(path):
+        return read_manifest(path)
+
+    rows = build_manifest(sharp_path, blur_path)
+    write_manifest(rows, path)
+    print('Indexed {} pairs of {} in {}'.format(len(rows), sharp_path, path))
+
+    return rows
+
+
+def split_manifest(rows, subset=None, validation_split=0.0):
+    """
+    Selects a subset of the rows, with the same semantic of the ImageDataGenerator: the validation subset is the first
+    validation_split fraction of the rows.
+
+    :param rows (list): Rows of the manifest
+    :param subset (string): 'training', 'validation' or None (all the rows)
+    :param validation_split (float): Fraction of the rows reserved to the validation subset
+    :return: rows (list): Selected rows
+    """
+    split = int(validation_split * len(rows))
+
+    if subset == 'training':
+        return rows[split:]
+    if subset == 'validation':
+        return rows[:split]
+
+    return rows
+
+
+def frame_name(row):
+    """
+    Name of the frame of a row, relative to the set folder (e.g. '000/00000000.png').
+
+    :param row (dict): Row of the manifest
+    :return: name (string): Name
+    """
+    return row['scene'] + '/' + row['frame']
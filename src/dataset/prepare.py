@@ -0,0 +1,52 @@
+import os
+from pathlib import Path
+
+from dataset.manifest import load_manifest
+from utils.dataset import load_cifar, blur_cifar, save_cifar_npy, convert_cifar_pickles, load_cifar_npy
+
+
+def prepare_cifar(paths, workers=None, blur=True):
+    """
+    If the cifar needed structure does not exists, creates it: load, reshape and blur the datasets, saved as .npy.
+
+    The blurring draws the sigmas from the random module: seed it before (the saved dataset was created with
+    seed = 42).
+
+    :param paths (Paths): Paths of the run
+    :param workers (int): Number of processes used to blur (default: number of cpus)
+    :param blur (boolean): False for the sharp sets only (blurred on the fly, see dataset/augment.py)
+    :return: cifar (dict): for each set ('train', 'test' and, if blur, 'train_b', 'test_b'), the memory-mapped images
+        with shape (n_images, 32, 32, 3)
+    """
+    keys = ['train', 'test', 'train_b', 'test_b'] if blur else ['train', 'test']
+
+    # Convert the pickled sets of older versions, if any
+    convert_cifar_pickles({key: (paths.cifar_pickles[key], paths.cifar_npy[key]) for key in keys})
+
+    if not all(os.path.exists(paths.cifar_npy[key]) for key in keys):
+        dataset = load_cifar(paths.cifar)
+        ds_blurred = blur_cifar(dataset, workers=workers if workers is not None else os.cpu_count()) if blur else None
+
+        Path(paths.cifar_modified).mkdir(parents=True, exist_ok=True)
+
+        for k in ['train', 'test']:
+            print('Saving the new CIFAR-10 dataset')
+            # Save the updated datasets
+            save_cifar_npy(dataset[k], paths.cifar_npy[k])
+            if blur:
+                save_cifar_npy(ds_blurred[k], paths.cifar_npy[k+'_b'])
+
+    return load_cifar_npy({key: paths.cifar_npy[key] for key in keys})
+
+
+def prepare_reds(paths, rebuild=False):
+    """
+    Indexes the reds train and validation sets: if missing (or if rebuild), builds their manifests (see
+    dataset/manifest.py) with a parallel scan of the scenes. The images are left where they are and never read.
+
+    :param paths (Paths): Paths of the run
+    :param rebuild (boolean): True for rebuilding the existing manifests (e.g. after adding scenes)
+    :return: manifests (dict): for each set ('train', 'val'), the rows of its manifest
+    """
+    return {key: load_manifest(paths.reds[key+'_s'], paths.reds[key+'_b'], paths.reds_manifests[key], rebuild)
+            for key in ['train', 'val']}
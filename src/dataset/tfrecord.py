@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from utils.dataset import reds_pairs, png_size, png_signature
+
+# Available encodings of the images inside the records:
+# - 'png': the original png bytes, copied without decoding
+# - 'reencode': the png bytes re-encoded (lossless) with a low compression level, faster to decode
+# - 'raw': the decoded uint8 pixels, no decoding needed at read time (bigger records)
+encodings = ['png', 'reencode', 'raw']
+reencode_compression = 1
+# Number of pairs of each shard, written next to the shards
+index_name = 'index.json'
+
+
+def bytes_feature(value):
+    """
+    Wraps bytes into a tf.train.Feature.
+
+    :param value (bytes): Value
+    :return: feature (tf.train.Feature): Feature
+    """
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+
+
+def int64_feature(value):
+    """
+    Wraps an int into a tf.train.Feature.
+
+    :param value (int): Value
+    :return: feature (tf.train.Feature): Feature
+    """
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
+
+
+def encode_image(path, encoding):
+    """
+    Reads an image and encodes it for the records.
+
+    :param path (string): Path to the png image
+    :param encoding (string): One of encodings
+    :return: encoded (Tuple[bytes, int, int]): Encoded bytes, height and width of the image
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if not data.startswith(png_signature):
+        raise ValueError('{} is not a png image'.format(path))
+
+    if encoding == 'png':
+        # Height and width are read from the header, no need to decode the image
+        height, width = png_size(path)
+
+        return data, height, width
+
+    # Keep the RGB order of the decoded tensors
+    image = cv2.cvtColor(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+    height, width = image.shape[0], image.shape[1]
+
+    if encoding == 'raw':
+        return image.tobytes(), height, width
+
+    _, buffer = cv2.imencode('.png', cv2.cvtColor(image, cv2.COLOR_RGB2BGR),
+                             [cv2.IMWRITE_PNG_COMPRESSION, reencode_compression])
+
+    return buffer.tobytes(), height, width
+
+
+def pair_example(name, sharp_path, blur_path, encoding):
+    """
+    Serializes an aligned (sharp, blur) pair.
+
+    :param name (string): Relative path of the pair (used to name the predictions)
+    :param sharp_path (string): Path to the sharp image
+    :param blur_path (string): Path to the blur image
+    :param encoding (string): One of encodings
+    :return: example (bytes): Serialized tf.train.Example
+    """
+    sharp, height, width = encode_image(sharp_path, encoding)
+    blur, _, _ = encode_image(blur_path, encoding)
+
+    features = {
+        'name': bytes_feature(name.encode()),
+        'sharp': bytes_feature(sharp),
+        'blur': bytes_feature(blur),
+        'height': int64_feature(height),
+        'width': int64_feature(width),
+        'encoding': bytes_feature(encoding.encode()),
+    }
+
+    return tf.train.Example(features=tf.train.Features(feature=features)).SerializeToString()
+
+
+def write_shard(pairs, path, encoding):
+    """
+    Writes a list of pairs into a single TFRecord file.
+
+    :param pairs (list): List of tuples (relative path, sharp path, blur path)
+    :param path (string): Path of the shard
+    :param encoding (string): One of encodings
+    :return: count (int): Number of written pairs
+    """
+    with tf.io.TFRecordWriter(path) as writer:
+        for name, sharp_path, blur_path in pairs:
+            writer.write(pair_example(name, sharp_path, blur_path, encoding))
+
+    return len(pairs)
+
+
+def write_reds_tfrecords(sharp_path, blur_path, output_path, n_shards=16, encoding='png', workers=None):
+    """
+    Packs the aligned (sharp, blur) pairs of a reds set into sharded TFRecord files. The pairs are read from the
+    original folders, that are left untouched.
+
+    :param sharp_path (string): Path to the sharp set
+    :param blur_path (string): Path to the blur set
+    :param output_path (string): Folder where to write the shards
+    :param n_shards (int): Number of shards
+    :param encoding (string): One of encodings
+    :param workers (int): Number of shards written in parallel
+    :return: paths (list): Paths of the written shards
+    """
+    if encoding not in encodings:
+        raise ValueError('Unknown encoding {}, expected one of {}'.format(encoding, encodings))
+
+    print('Writing REDS {} TFRecords to {}'.format(sharp_path, output_path))
+    pairs = reds_pairs(sharp_path, blur_path)
+    n_shards = max(1, min(n_shards, len(pairs)))
+    Path(output_path).mkdir(parents=True, exist_ok=True)
+
+    # Consecutive frames in the same shard: each shard is read sequentially
+    chunks = np.array_split(np.arange(len(pairs)), n_shards)
+    paths = [os.path.join(output_path, 'pairs-{:05d}-of-{:05d}.tfrecord'.format(i, n_shards)) for i in range(n_shards)]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(write_shard, [pairs[i] for i in chunk], path, encoding)
+                   for chunk, path in zip(chunks, paths)]
+        counts = [future.result() for future in futures]
+        count = sum(counts)
+
+    with open(os.path.join(output_path, index_name), 'w') as f:
+        json.dump({os.path.basename(path): n for path, n in zip(paths, counts)}, f, indent=1)
+
+    print('Written {} pairs in {} shards'.format(count, n_shards))
+
+    return paths
+
+
+def shard_counts(files):
+    """
+    Number of pairs of each shard, read from the index written with the shards (the shards without index are counted,
+    reading them once).
+
+    :param files (list): Paths of the shards
+    :return: counts (list): Number of pairs of each shard
+    """
+    index = {}
+    for directory in sorted(set(os.path.dirname(path) for path in files)):
+        index_path = os.path.join(directory, index_name)
+        if tf.io.gfile.exists(index_path):
+            with tf.io.gfile.GFile(index_path) as f:
+                index.update({os.path.join(directory, name): n for name, n in json.load(f).items()})
+
+    return [index[path] if path in index else int(tf.data.TFRecordDataset(path).reduce(0, lambda n, _: n + 1))
+            for path in files]
+
+
+def parse_pair(serialized):
+    """
+    Parses and decodes a serialized pair.
+
+    :param serialized (tf.Tensor): Serialized tf.train.Example
+    :return: pair (Tuple[tf.Tensor, tf.Tensor, tf.Tensor]): name, sharp and blur uint8 images
+    """
+    features = {
+        'name': tf.io.FixedLenFeature([], tf.string),
+        'sharp': tf.io.FixedLenFeature([], tf.string),
+        'blur': tf.io.FixedLenFeature([], tf.string),
+        'height': tf.io.FixedLenFeature([], tf.int64),
+        'width': tf.io.FixedLenFeature([], tf.int64),
+        'encoding': tf.io.FixedLenFeature([], tf.string),
+    }
+    example = tf.io.parse_single_example(serialized, features)
+    shape = tf.stack([example['height'], example['width'], 3])
+
+    def decode(data):
+        return tf.cond(tf.equal(example['encoding'], 'raw'),
+                       lambda: tf.reshape(tf.io.decode_raw(data, tf.uint8), shape),
+                       lambda: tf.image.decode_png(data, channels=3))
+
+    return example['name'], decode(example['sharp']), decode(example['blur'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack the REDS (sharp, blur) pairs into sharded TFRecord files.')
+    parser.add_argument('sharp_path', help='Path to the sharp set (e.g. ../res/datasets/REDS/train/train_sharp/)')
+    parser.add_argument('blur_path', help='Path to the blur set (e.g. ../res/datasets/REDS/train/train_blur/)')
+    parser.add_argument('output_path', help='Folder where to write the shards')
+    parser.add_argument('--shards', type=int, default=16, help='Number of shards')
+    parser.add_argument('--encoding', choices=encodings, default='png', help='Encoding of the images')
+    parser.add_argument('--workers', type=int, default=None, help='Number of shards written in parallel')
+    args = parser.parse_args()
+
+    write_reds_tfrecords(args.sharp_path, args.blur_path, args.output_path, args.shards, args.encoding, args.workers)
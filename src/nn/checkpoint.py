@@ -0,0 +1,145 @@
+import os
+import shutil
+
+import tensorflow as tf
+from tensorflow.keras.callbacks import Callback
+
+from utils.config import checkpoint_sources
+
+# Validation metric selecting the best checkpoint (the higher the better)
+best_monitor = 'val_mean_scales_psnr'
+
+
+def checkpointable_dataset(dataset):
+    """
+    Lets the iterators of a dataset be saved in a checkpoint although the dataset draws random numbers (random crops,
+    blur degradations): the states of their generators are not saved, the restored iterator draws new numbers.
+
+    :param dataset (tf.data.Dataset): Dataset
+    :return: dataset (tf.data.Dataset): Dataset with the checkpoint options
+    """
+    options = tf.data.Options()
+    options.experimental_external_state_policy = tf.data.experimental.ExternalStatePolicy.IGNORE
+
+    return dataset.with_options(options)
+
+
+def restore_inference_model(inference_model, directory, source='latest'):
+    """
+    Restores the weights of an inference model from a training checkpoint (see RotatingCheckpoint): the training
+    model and the optimizer are not read.
+
+    :param inference_model (tf.keras.Model): Inference model (blur input only)
+    :param directory (string): Directory of the checkpoints of the training
+    :param source (string): 'latest' for the latest checkpoint, 'best' for the best one
+    :return: path (string): Path of the restored checkpoint
+    """
+    if source not in checkpoint_sources:
+        raise ValueError('Unknown checkpoint {}, expected one of {}'.format(source, checkpoint_sources))
+
+    path = tf.train.latest_checkpoint(directory if source == 'latest' else os.path.join(directory, 'best'))
+    if path is None:
+        raise FileNotFoundError('No {} checkpoint in {}'.format(source, directory))
+
+    # All the layers of the inference model must be in the checkpoint (saved with its inference_model)
+    status = tf.train.Checkpoint(inference_model=inference_model).restore(path)
+    status.expect_partial().assert_existing_objects_matched()
+    print('Restored the inference model from {}'.format(path))
+
+    return path
+
+
+class RotatingCheckpoint(Callback):
+    """
+    Callback saving the training state (model, optimizer and number of completed epochs) with tf.train.Checkpoint:
+    the last max_to_keep checkpoints are kept in directory, and the best one (highest validation PSNR) in
+    directory/best. The checkpoints are written asynchronously: the variables are copied and the training goes on while
+    a background thread writes them. With several workers, all of them take part in the saves but only the chief
+    writes to directory: the other ones write to a temporary directory, removed at the end of the training (as the
+    Keras BackupAndRestore does).
+    """
+    def __init__(self, directory, model, max_to_keep=3, period=1, monitor=best_monitor, async_save=True,
+                 inference_model=None, iterator=None):
+        """
+        Class constructor.
+
+        :param directory (string): Directory of the checkpoints
+        :param model (tf.keras.Model): Compiled training model
+        :param max_to_keep (int): Number of most recent checkpoints kept (the older ones are deleted)
+        :param period (int): Frequency of the checkpoints, in epochs
+        :param monitor (string): Validation metric of the best checkpoint (the higher the better)
+        :param async_save (boolean): True for writing the checkpoints in a background thread
+        :param inference_model (tf.keras.Model): Inference model sharing the layers of model, saved too (its
+            variables are not duplicated) so that it can be restored alone (see restore_inference_model)
+        :param iterator (tf.data.Iterator): Iterator of the training batches (see checkpointable_dataset), whose
+            position (and shuffle buffers) is saved and restored too: a resumed training goes on with the next batches
+            of the interrupted one. The iterators distributed over several replicas cannot be saved
+        """
+        super().__init__()
+        self.directory = directory
+        self.period = max(1, period)
+
+        strategy = model.distribute_strategy
+        self.chief = strategy.extended.should_checkpoint
+        if self.chief:
+            self.write_directory = directory
+        else:
+            resolver = getattr(strategy, 'cluster_resolver', None)
+            task_id = resolver.task_id if resolver is not None and resolver.task_id is not None else 0
+            self.write_directory = os.path.join(directory, 'workertemp_{}'.format(task_id))
+
+        self.monitor = monitor
+        self.options = tf.train.CheckpointOptions(enable_async=async_save)
+
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False, name='epoch')
+        self.best = tf.Variable(float('-inf'), dtype=tf.float64, trainable=False, name='best')
+        objects = {'model': model, 'optimizer': model.optimizer, 'epoch': self.epoch, 'best': self.best}
+        if inference_model is not None:
+            objects['inference_model'] = inference_model
+        if isinstance(iterator, tf.data.Iterator):
+            objects['iterator'] = iterator
+        elif iterator is not None:
+            print('The position of the input pipeline is not saved (iterator distributed over several replicas)')
+        self.checkpoint = tf.train.Checkpoint(**objects)
+        self.manager = tf.train.CheckpointManager(self.checkpoint, self.write_directory,
+                                                  max_to_keep=max(1, max_to_keep))
+        self.best_manager = tf.train.CheckpointManager(self.checkpoint, os.path.join(self.write_directory, 'best'),
+                                                       max_to_keep=1)
+
+    def restore(self):
+        """
+        Restores the latest checkpoint (of the chief), if any. The optimizer variables are restored when they are
+        created (first training step).
+
+        :return: epoch (int): Number of completed epochs of the restored checkpoint (None if there is no checkpoint)
+        """
+        path = tf.train.latest_checkpoint(self.directory)
+        if path is None:
+            return None
+
+        # expect_partial: the optimizer variables do not exist yet
+        self.checkpoint.restore(path).expect_partial()
+        print('Resumed from {} (epoch {})'.format(path, int(self.epoch.numpy())))
+
+        return int(self.epoch.numpy())
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        self.epoch.assign(epoch + 1)
+
+        value = logs.get(self.monitor)
+        improved = value is not None and value > self.best.numpy()
+        if improved:
+            self.best.assign(value)
+
+        if (epoch + 1) % self.period == 0:
+            self.manager.save(checkpoint_number=epoch + 1, options=self.options)
+        if improved:
+            self.best_manager.save(checkpoint_number=epoch + 1, options=self.options)
+
+    def on_train_end(self, logs=None):
+        # Wait for the pending writes
+        self.checkpoint.sync()
+
+        if not self.chief:
+            shutil.rmtree(self.write_directory, ignore_errors=True)
@@ -0,0 +1,90 @@
+import os
+
+import tensorflow as tf
+
+# Available strategies:
+# - 'auto': 'multi_worker' if TF_CONFIG is set, 'mirrored' if there are several local devices, 'default' otherwise
+# - 'default': single device (GPU if available, else CPU)
+# - 'mirrored': data parallelism on all the local GPUs (or on the virtual CPU devices, if there are no GPUs)
+# - 'multi_worker': data parallelism on several hosts, configured by the TF_CONFIG environment variable
+strategies = ['auto', 'default', 'mirrored', 'multi_worker']
+
+
+def configure_devices(virtual_cpus=0):
+    """
+    Configures the local devices. Must be called before any other TensorFlow operation.
+
+    :param virtual_cpus (int): If > 1, the CPU is split into this number of logical devices (to test the
+        distributed training on a single machine without GPUs)
+    :return: void
+    """
+    # Avoids memory overflow
+    for gpu in tf.config.list_physical_devices('GPU'):
+        tf.config.experimental.set_memory_growth(gpu, True)
+
+    if virtual_cpus > 1:
+        cpu = tf.config.list_physical_devices('CPU')[0]
+        tf.config.set_logical_device_configuration(cpu, [tf.config.LogicalDeviceConfiguration()
+                                                         for _ in range(virtual_cpus)])
+
+
+def get_strategy(name='auto'):
+    """
+    Creates the distribution strategy.
+
+    :param name (string): One of strategies
+    :return: strategy (tf.distribute.Strategy): Strategy
+    """
+    if name not in strategies:
+        raise ValueError('Unknown strategy {}, expected one of {}'.format(name, strategies))
+
+    gpus = tf.config.list_logical_devices('GPU')
+    cpus = tf.config.list_logical_devices('CPU')
+
+    if name == 'auto':
+        if 'TF_CONFIG' in os.environ:
+            name = 'multi_worker'
+        elif len(gpus) > 1 or (len(gpus) == 0 and len(cpus) > 1):
+            name = 'mirrored'
+        else:
+            name = 'default'
+
+    if name == 'multi_worker':
+        strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    elif name == 'mirrored':
+        devices = [device.name for device in (gpus if len(gpus) > 0 else cpus)]
+        strategy = tf.distribute.MirroredStrategy(devices=devices)
+    else:
+        strategy = tf.distribute.get_strategy()
+
+    print('Distribution strategy: {} ({} replicas)'.format(name, strategy.num_replicas_in_sync))
+
+    return strategy
+
+
+def shard_dataset(dataset):
+    """
+    Lets the strategy shard a dataset by element (each worker keeps its share of every batch), which works for any
+    source (file lists, generators, TFRecords).
+
+    :param dataset (tf.data.Dataset): Dataset
+    :return: dataset (tf.data.Dataset): Dataset with the sharding options
+    """
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.DATA
+
+    return dataset.with_options(options)
+
+
+def generator_dataset(generator, input_shape=(None, None, 3)):
+    """
+    Wraps a Python generator of ((sharp, blur),) batches into a tf.data.Dataset, so that the strategy can split its
+    batches among the replicas.
+
+    :param generator (generator): Generator of ((sharp, blur),) batches
+    :param input_shape (Tuple[int, int, int]): Shape of the images
+    :return: dataset (tf.data.Dataset): Dataset
+    """
+    spec = tf.TensorSpec(shape=(None,) + tuple(input_shape), dtype=tf.float32)
+
+    return tf.data.Dataset.from_generator(lambda: generator, output_signature=((spec, spec),))
@@ -0,0 +1,66 @@
+import tensorflow as tf
+
+
+@tf.function
+def batch_metrics(sharp, deblurred, max_val=1.0):
+    """
+    Computes the sums over a batch of the per-image MSE, PSNR and SSIM.
+
+    Note that tf.image.ssim uses an 11x11 gaussian window, while the scikit-image SSIM of utils/eval.py uses a 7x7
+    uniform one: the two SSIM values are close but not identical.
+
+    :param sharp (tf.Tensor): Sharp images with shape (n_images, height, width, channels), in [0, max_val]
+    :param deblurred (tf.Tensor): Deblurred images, same shape of sharp
+    :param max_val (float): Dynamic range of the images
+    :return: sums (Tuple[tf.Tensor, tf.Tensor, tf.Tensor]): sums of MSE, PSNR and SSIM
+    """
+    sharp = tf.cast(sharp, tf.float32)
+    deblurred = tf.cast(deblurred, tf.float32)
+
+    mse = tf.reduce_mean(tf.math.squared_difference(sharp, deblurred), axis=[1, 2, 3])
+    psnr = tf.image.psnr(sharp, deblurred, max_val=max_val)
+    ssim = tf.image.ssim(sharp, deblurred, max_val=max_val)
+
+    return tf.reduce_sum(mse), tf.reduce_sum(psnr), tf.reduce_sum(ssim)
+
+
+class StreamingImageMetrics:
+    """
+    Class to accumulate the average MSE, PSNR and SSIM of the predictions batch by batch, without keeping the images.
+    """
+    def __init__(self, max_val=1.0):
+        """
+        Class constructor.
+
+        :param max_val (float): Dynamic range of the images
+        """
+        self.max_val = max_val
+        self.sum_mse = 0.
+        self.sum_psnr = 0.
+        self.sum_ssim = 0.
+        self.count = 0
+
+    def update(self, sharp, deblurred):
+        """
+        Adds a batch of predictions.
+
+        :param sharp (np.array or tf.Tensor): Sharp images with shape (n_images, height, width, channels)
+        :param deblurred (np.array or tf.Tensor): Deblurred images, same shape of sharp
+        :return: void
+        """
+        mse, psnr, ssim = batch_metrics(sharp, deblurred, self.max_val)
+
+        self.sum_mse += float(mse)
+        self.sum_psnr += float(psnr)
+        self.sum_ssim += float(ssim)
+        self.count += int(sharp.shape[0])
+
+    def result(self):
+        """
+        Returns the averages over the images seen so far.
+
+        :return: metrics (Tuple[float, float, float]): average MSE, PSNR, SSIM, respectively
+        """
+        count = max(1, self.count)
+
+        return self.sum_mse / count, self.sum_psnr / count, self.sum_ssim / count
@@ -0,0 +1,583 @@
+import numpy as np
+import tensorflow as tf
+
+from tensorflow.keras import Input
+from tensorflow.keras.layers import Conv2D, Conv2DTranspose, Add, Dropout, MaxPooling2D, Concatenate, LeakyReLU, \
+    BatchNormalization, ReLU, Layer
+from tensorflow.keras.models import Model
+
+from utils.config import model_types
+
+# Number of image channels, number of scale levels, starting scale
+channels = 3
+n_levels = 3
+starting_scale = 0.5
+
+
+# Models
+def res_net_block(x, filters, ksize):
+    """
+    Define a ResNet block (Conv2D -> Conv2D).
+
+    :param x (tf.keras.Model): Keras model on which the block will be appended (Functional API)
+    :param filters (int): Number of filters
+    :param ksize (int): Kernel size
+    :return: y (tf.keras.Model): Updated model
+    """
+    net = Conv2D(filters=filters, kernel_size=(ksize, ksize), padding='same', activation='relu')(x)
+    net = Conv2D(filters=filters, kernel_size=(ksize, ksize), padding='same', activation=None)(net)
+
+    return net  # + x
+
+
+def scaled_size(image, scale):
+    """
+    Height and width of an image scaled by a factor, computed at runtime (so that the same graph works for any input
+    size).
+
+    :param image (tf.Tensor): Images with shape (batch, height, width, channels)
+    :param scale (float): Scale factor
+    :return: size (tf.Tensor): int32 tensor [height * scale, width * scale] (rounded)
+    """
+    size = tf.cast(tf.shape(image)[1:3], tf.float32) * scale
+
+    return tf.cast(tf.round(size), tf.int32)
+
+
+def srn_network(name='srn_network'):
+    """
+    Define the encoder-decoder of a single scale of the srn model. Its input is the blurred image concatenated to the
+    prediction of the previous (coarser) scale; its output is the prediction at this scale.
+
+    :param name (string): Name of the model
+    :return: network (tf.keras.Model): Encoder-decoder (any height and width, multiple of 4)
+    """
+    inp_all = Input(shape=(None, None, 2 * channels), name='inp')
+
+    # Encoder
+    conv1_1 = Conv2D(filters=32, kernel_size=(5, 5), padding='same', activation='relu')(inp_all)
+    conv1_2 = res_net_block(conv1_1, 32, 5)
+    conv1_3 = res_net_block(conv1_2, 32, 5)
+    conv1_4 = res_net_block(conv1_3, 32, 5)
+
+    conv2_1 = Conv2D(filters=64, kernel_size=(5, 5), strides=2, padding='same', activation='relu')(conv1_4)
+    conv2_2 = res_net_block(conv2_1, 64, 5)
+    conv2_3 = res_net_block(conv2_2, 64, 5)
+    conv2_4 = res_net_block(conv2_3, 64, 5)
+
+    conv3_1 = Conv2D(filters=128, kernel_size=(5, 5), strides=2, padding='same', activation='relu')(conv2_4)
+    conv3_2 = res_net_block(conv3_1, 128, 5)
+    conv3_3 = res_net_block(conv3_2, 128, 5)
+    conv3_4 = res_net_block(conv3_3, 128, 5)
+
+    # Decoder
+    deconv3_4 = conv3_4
+    deconv3_3 = res_net_block(deconv3_4, 128, 5)
+    deconv3_2 = res_net_block(deconv3_3, 128, 5)
+    deconv3_1 = res_net_block(deconv3_2, 128, 5)
+
+    deconv2_4 = Conv2DTranspose(filters=64, kernel_size=(4, 4), strides=2, padding='same',
+                                activation='relu')(deconv3_1)
+    # Skip connection (cat2, cat1)
+    cat2 = Add()([deconv2_4, conv2_4])
+    deconv2_3 = res_net_block(cat2, 64, 5)
+    deconv2_2 = res_net_block(deconv2_3, 64, 5)
+    deconv2_1 = res_net_block(deconv2_2, 64, 5)
+
+    deconv1_4 = Conv2DTranspose(filters=32, kernel_size=(4, 4), strides=2, padding='same',
+                                activation='relu')(deconv2_1)
+    cat1 = Add()([deconv1_4, conv1_4])
+    deconv1_3 = res_net_block(cat1, 32, 5)
+    deconv1_2 = res_net_block(deconv1_3, 32, 5)
+    deconv1_1 = res_net_block(deconv1_2, 32, 5)
+
+    # float32 output, also with a mixed precision policy
+    output = Conv2D(filters=channels, kernel_size=(5, 5), padding='same', activation=None,
+                    dtype='float32')(deconv1_1)
+
+    return Model(inputs=inp_all, outputs=output, name=name)
+
+
+class ScaleRecurrentNetwork(Layer):
+    """
+    srn model as a Keras layer: the same encoder-decoder (same weights) is applied from the coarsest to the finest
+    scale, each time on the blurred image and on the upsampled prediction of the previous scale. The sizes of the
+    scales are computed from the input at runtime, so the same layer works for crops and full frames.
+    """
+    def __init__(self, levels=n_levels, scale=starting_scale, **kwargs):
+        """
+        Class constructor.
+
+        :param levels (int): Number of scale levels
+        :param scale (float): Scale factor between consecutive levels
+        """
+        super().__init__(**kwargs)
+        self.levels = levels
+        self.scale = scale
+        self.network = srn_network()
+
+    def call(self, inputs, training=None):
+        """
+        Deblurs the input at each scale.
+
+        :param inputs (tf.Tensor): Blur images with shape (batch, height, width, channels)
+        :param training (boolean): True in training
+        :return: x_unwrap (list): Predictions of each scale, from the coarsest to the finest (original size)
+        """
+        inputs = tf.cast(inputs, tf.float32)
+        inp_pred = inputs
+        x_unwrap = []
+
+        for i in range(self.levels):
+            size = scaled_size(inputs, self.scale ** (self.levels - i - 1))
+
+            # Resize the blurred and prediction images
+            inp_blur = tf.image.resize(inputs, size)
+            inp_pred = tf.image.resize(inp_pred, size)
+            inp_all = tf.concat([inp_blur, inp_pred], axis=3)
+
+            inp_pred = self.network(inp_all, training=training)
+            x_unwrap.append(inp_pred)
+
+        return x_unwrap
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'levels': self.levels, 'scale': self.scale})
+
+        return config
+
+
+def model_srn_shared(inp, x_unwrap=[]):
+    """
+    Define the srn model, with the weights shared among the scales. See relation for deeper explanation of this part
+    of the code.
+
+    :param inp (tf.keras.layers.Layer): Input of the NN
+    :param x_unwrap (list): List of the logical scales (see relation)
+    :return: inp_pred (tf.keras.layers.Layer): last layer of the network (see relation)
+    """
+    outputs = ScaleRecurrentNetwork(name='srn')(inp)
+    x_unwrap.extend(outputs)
+
+    return outputs[-1]
+
+
+# def generator(inp):
+def model_srn(inp, x_unwrap=[]):
+    """
+    Define the srn model with a different encoder-decoder (different weights) for each scale, as in the released
+    srn models. See relation for deeper explanation of this part of the code.
+
+    :param inp (tf.keras.layers.Layer): Input of the NN
+    :param x_unwrap (list): List of the logical scales (see relation)
+    :return: inp_pred (tf.keras.layers.Layer): last layer of the network (see relation)
+    """
+    # x_unwrap = []
+    inp_pred = inp
+    # Iterate over the number of levels
+    for i in range(n_levels):
+        # Compute the scale to resize the h and w of the image
+        scale = starting_scale ** (n_levels - i - 1)
+        size = scaled_size(inp, scale)
+
+        # Resize the blurred and prediction images
+        inp_blur = tf.image.resize(inp, size)
+        inp_pred = tf.image.resize(inp_pred, size)
+        inp_all = tf.concat([inp_blur, inp_pred], axis=3, name='inp')
+
+        # Encoder
+        conv1_1 = Conv2D(filters=32, kernel_size=(5, 5), padding='same', activation='relu')(inp_all)
+        conv1_2 = res_net_block(conv1_1, 32, 5)
+        conv1_3 = res_net_block(conv1_2, 32, 5)
+        conv1_4 = res_net_block(conv1_3, 32, 5)
+
+        conv2_1 = Conv2D(filters=64, kernel_size=(5, 5), strides=2, padding='same',
+                         activation='relu')(conv1_4)
+        conv2_2 = res_net_block(conv2_1, 64, 5)
+        conv2_3 = res_net_block(conv2_2, 64, 5)
+        conv2_4 = res_net_block(conv2_3, 64, 5)
+
+        conv3_1 = Conv2D(filters=128, kernel_size=(5, 5), strides=2, padding='same',
+                         activation='relu')(conv2_4)
+        conv3_2 = res_net_block(conv3_1, 128, 5)
+        conv3_3 = res_net_block(conv3_2, 128, 5)
+        conv3_4 = res_net_block(conv3_3, 128, 5)
+
+        # Decoder
+        deconv3_4 = conv3_4
+        deconv3_3 = res_net_block(deconv3_4, 128, 5)
+        deconv3_2 = res_net_block(deconv3_3, 128, 5)
+        deconv3_1 = res_net_block(deconv3_2, 128, 5)
+
+        deconv2_4 = Conv2DTranspose(filters=64, kernel_size=(4, 4), strides=2, padding='same',
+                                    activation='relu')(deconv3_1)
+        # Skip connection (cat2, cat1)
+        cat2 = Add()([deconv2_4, conv2_4])
+        deconv2_3 = res_net_block(cat2, 64, 5)
+        deconv2_2 = res_net_block(deconv2_3, 64, 5)
+        deconv2_1 = res_net_block(deconv2_2, 64, 5)
+
+        deconv1_4 = Conv2DTranspose(filters=32, kernel_size=(4, 4), strides=2, padding='same',
+                                    activation='relu')(deconv2_1)
+        cat1 = Add()([deconv1_4, conv1_4])
+        deconv1_3 = res_net_block(cat1, 32, 5)
+        deconv1_2 = res_net_block(deconv1_3, 32, 5)
+        deconv1_1 = res_net_block(deconv1_2, 32, 5)
+
+        # float32 output, also with a mixed precision policy
+        inp_pred = Conv2D(filters=channels, kernel_size=(5, 5), padding='same', activation=None,
+                          dtype='float32')(deconv1_1)
+
+        if i >= 0:
+            x_unwrap.append(inp_pred)
+
+    # return x_unwrap
+    return inp_pred
+
+
+def model_fcn(inp, dilated=False):
+    """
+    Define the fcn model. See relation for deeper explanation of this part of the code.
+
+    :param inp (tf.keras.layers.Layer): Input of the NN
+    :return: output (tf.keras.layers.Layer): last layer of the network (see relation)
+    """
+    # Hyperparameters
+    input_kernel = (3, 3)
+    hidden_kernel = (3, 3)
+    output_kernel = (3, 3)
+    input_filters = 64
+    hidden_filters = 256
+    output_filters = 3
+    input_activation = 'relu'
+    hidden_activation = 'relu'
+    output_activation = 'sigmoid'
+    padding = 'same'
+    kernel_regularizer = None
+    activity_regularizer = None
+    dilation_rate_outer = (1, 1) if not dilated else (2, 2)
+    dilation_rate_inner = (1, 1) if not dilated else (4, 4)
+
+    conv1 = Conv2D(input_filters, kernel_size=input_kernel, activation=input_activation, padding=padding,
+                   kernel_regularizer=kernel_regularizer, activity_regularizer=activity_regularizer)(inp)
+    conv2 = Conv2D(hidden_filters, kernel_size=hidden_kernel, activation=hidden_activation, padding=padding,
+                   kernel_regularizer=kernel_regularizer, activity_regularizer=activity_regularizer,
+                   dilation_rate=dilation_rate_outer)(conv1)
+    conv3 = Conv2D(hidden_filters, kernel_size=hidden_kernel, activation=hidden_activation, padding=padding,
+                   kernel_regularizer=kernel_regularizer, activity_regularizer=activity_regularizer,
+                   dilation_rate=dilation_rate_inner)(conv2)
+    conv4 = Conv2D(hidden_filters, kernel_size=hidden_kernel, activation=hidden_activation, padding=padding,
+                   kernel_regularizer=kernel_regularizer, activity_regularizer=activity_regularizer,
+                   dilation_rate=dilation_rate_inner)(conv3)
+    conv5 = Conv2D(hidden_filters, kernel_size=hidden_kernel, activation=hidden_activation, padding=padding,
+                   kernel_regularizer=kernel_regularizer, activity_regularizer=activity_regularizer,
+                   dilation_rate=dilation_rate_outer)(conv4)
+    conv6 = Conv2D(hidden_filters, kernel_size=hidden_kernel, activation=hidden_activation, padding=padding,
+                   kernel_regularizer=kernel_regularizer, activity_regularizer=activity_regularizer)(conv5)
+    drop = Dropout(0.5)(conv6)
+    output = Conv2D(output_filters, kernel_size=output_kernel, activation=output_activation, padding=padding,
+                    kernel_regularizer=kernel_regularizer, activity_regularizer=activity_regularizer,
+                    dtype='float32')(drop)
+
+    return output
+
+
+def model_unet(inp):
+    """
+    Define the unet model. See relation for deeper explanation of this part of the code.
+
+    :param inp (tf.keras.layers.Layer): Input of the NN
+    :return: output (tf.keras.layers.Layer): last layer of the network (see relation)
+    """
+    padding = 'same'
+    strides = (2, 2)
+    kernel_size = (3, 3)
+
+    conv1 = Conv2D(32, kernel_size, padding=padding)(inp)
+    conv1 = LeakyReLU(alpha=0.2)(conv1)
+    conv1 = Conv2D(32, kernel_size, padding=padding)(conv1)
+    conv1 = LeakyReLU(alpha=0.2)(conv1)
+    pool1 = MaxPooling2D(pool_size=(3, 3), strides=strides, padding=padding)(conv1)
+
+    conv2 = Conv2D(64, kernel_size, padding=padding)(pool1)
+    conv2 = LeakyReLU(alpha=0.2)(conv2)
+    conv2 = Conv2D(64, kernel_size, padding=padding)(conv2)
+    conv2 = LeakyReLU(alpha=0.2)(conv2)
+    pool2 = MaxPooling2D(pool_size=(3, 3), strides=strides, padding=padding)(conv2)
+
+    conv3 = Conv2D(128, kernel_size, padding=padding)(pool2)
+    conv3 = LeakyReLU(alpha=0.2)(conv3)
+    conv3 = Conv2D(128, kernel_size, padding=padding)(conv3)
+    conv3 = LeakyReLU(alpha=0.2)(conv3)
+    pool3 = MaxPooling2D(pool_size=kernel_size, strides=strides, padding=padding)(conv3)
+
+    conv4 = Conv2D(256, kernel_size, padding=padding)(pool3)
+    conv4 = LeakyReLU(alpha=0.2)(conv4)
+    conv4 = Conv2D(256, kernel_size, padding=padding)(conv4)
+    conv4 = LeakyReLU(alpha=0.2)(conv4)
+    pool4 = MaxPooling2D(pool_size=(3, 3), strides=strides, padding=padding)(conv4)
+
+    conv5 = Conv2D(512, kernel_size, padding=padding)(pool4)
+    conv5 = LeakyReLU(alpha=0.2)(conv5)
+    conv5 = Conv2D(512, kernel_size, padding=padding)(conv5)
+    conv5 = LeakyReLU(alpha=0.2)(conv5)
+
+    up6 = Conv2DTranspose(256, kernel_size, strides=strides, padding=padding)(
+        conv5)
+    up6 = Concatenate()([conv4, up6])
+    conv6 = Conv2D(256, kernel_size, padding=padding)(up6)
+    conv6 = LeakyReLU(alpha=0.2)(conv6)
+    conv6 = Conv2D(256, kernel_size, padding=padding)(conv6)
+    conv6 = LeakyReLU(alpha=0.2)(conv6)
+
+    up7 = Conv2DTranspose(128, kernel_size, strides=strides, padding=padding)(
+        conv6)
+    up7 = Concatenate()([conv3, up7])
+    conv7 = Conv2D(128, kernel_size, padding=padding)(up7)
+    conv7 = LeakyReLU(alpha=0.2)(conv7)
+    conv7 = Conv2D(128, kernel_size, padding=padding)(conv7)
+    conv7 = LeakyReLU(alpha=0.2)(conv7)
+
+    up8 = Conv2DTranspose(64, kernel_size, strides=strides, padding=padding)(
+        conv7)
+    up8 = Concatenate()([conv2, up8])
+    conv8 = Conv2D(64, kernel_size, padding=padding)(up8)
+    conv8 = LeakyReLU(alpha=0.2)(conv8)
+    conv8 = Conv2D(64, kernel_size, padding=padding)(conv8)
+    conv8 = LeakyReLU(alpha=0.2)(conv8)
+
+    up9 = Conv2DTranspose(32, kernel_size, strides=strides, padding=padding)(
+        conv8)
+    up9 = Concatenate()([conv1, up9])
+    conv9 = Conv2D(32, kernel_size, padding=padding)(up9)
+    conv9 = LeakyReLU(alpha=0.2)(conv9)
+    conv9 = Conv2D(32, kernel_size, padding=padding)(conv9)
+    conv9 = LeakyReLU(alpha=0.2)(conv9)
+
+    conv10 = Conv2D(12, kernel_size, padding=padding)(conv9)
+    conv10 = LeakyReLU(alpha=0.2)(conv10)
+    drop = Dropout(0.3)(conv10)
+
+    output = Conv2D(3, kernel_size, padding=padding, activation='sigmoid', dtype='float32')(drop)
+
+    return output
+
+
+def model_rednet(inp):
+    """
+    Define the rednet model. See relation for deeper explanation of this part of the code.
+
+    :param inp (tf.keras.layers.Layer): Input of the NN
+    :return: output (tf.keras.layers.Layer): last layer of the network (see relation)
+    """
+    # Hyperparameters
+    depth = 20  # Number of fully convolutional layers
+    n_filters = 128  # Number of filters in each convolutional layer
+    kernel_size = (3, 3)  # Kernel size
+    # Step for connecting encoder layers with decoder layers through add. For skip_step=2, at each 2 layers, the j-th
+    # encoder layer E_j is connected with the  i = (depth - j) th decoder
+    skip_step = 2
+
+    num_connections = np.ceil(depth / (2 * skip_step)) if skip_step > 0 else 0  # 5
+    y = inp
+    encoder_layers = []
+    for i in range(depth // 2):
+        y = Conv2D(n_filters, kernel_size=kernel_size, padding='same', use_bias=False)(y)
+        y = BatchNormalization()(y)
+        y = ReLU()(y)
+        encoder_layers.append(y)
+    j = int((num_connections - 1) * skip_step)  # Encoder layers count # 8
+    k = int(depth - (num_connections - 1) * skip_step)  # Decoder layers count # 12
+    for i in range(depth // 2 + 1, depth):
+        y = Conv2DTranspose(n_filters, kernel_size=kernel_size, padding='same', use_bias=False)(y)
+        y = BatchNormalization()(y)
+        if i == k:
+            y = Add()([encoder_layers[j - 1], y])
+            k += skip_step
+            j -= skip_step
+        y = ReLU()(y)
+    y = Conv2DTranspose(3, kernel_size=kernel_size, padding="same", use_bias=False)(y)
+    y = BatchNormalization()(y)
+    # Residual with the input and output in float32, also with a mixed precision policy
+    y = Add(dtype='float32')([inp, y])
+    output = ReLU(dtype='float32')(y)
+
+    return output
+
+
+# Losses
+def custom_loss_srn(x_unwrap, img_gt):
+    """
+    Loss of the srn NN. See relation.
+
+    :param x_unwrap (list): List of the logical scales (see relation)
+    :param img_gt (tf.keras.layers.Layer): GT input (sharp images)
+    :return: loss (float): loss value
+    """
+
+    loss_total = 0
+    for i in range(n_levels):
+        gt_i = tf.image.resize(tf.cast(img_gt, tf.float32), tf.shape(x_unwrap[i])[1:3])
+        loss = tf.reduce_mean((gt_i - tf.cast(x_unwrap[i], tf.float32)) ** 2)
+        loss_total += loss
+
+    return loss_total
+
+
+def custom_loss_others(img_gt, output):
+    """
+    Loss of the others NN (fcn, unet, rednet). See relation.
+
+    :param img_gt (tf.keras.layers.Layer): GT input (sharp images)
+    :param output (tf.keras.layers.Layer): Output of the NN
+    :return: loss (float): loss value
+    """
+    return tf.reduce_mean((tf.cast(img_gt, tf.float32) - tf.cast(output, tf.float32)) ** 2)
+
+
+# Metrics
+def log10(x):
+    """
+    Compute the log10 (instead of ln) of a tf.Tensor.
+
+    :param x (tf.Tensor): input
+    :return log10 (tf.Tensor): output
+    """
+    numerator = tf.math.log(x)
+    denominator = tf.math.log(tf.constant(10, dtype=numerator.dtype))
+    return numerator / denominator
+
+
+def custom_psnr_srn(x_unwrap, input_sharp, last_level=False):
+    """
+    PSNR metric (between predicted and sharp image).
+
+    :param x_unwrap (list): List of the logical scales (see relation)
+    :param input_sharp (tf.keras.layers.Layer): GT input (sharp images)
+    :param last_level (boolean): True if the psnr is computed only for the last level;
+        False for averaging over the 3 levels
+    :return: psnr (float): psnr
+    """
+    metric_total = 0
+    for i in range(n_levels):
+        gt_i = tf.image.resize(tf.cast(input_sharp, tf.float32), tf.shape(x_unwrap[i])[1:3])
+        metric = 20*log10((1.0 ** 2) / tf.math.sqrt(tf.reduce_mean((gt_i - tf.cast(x_unwrap[i], tf.float32)) ** 2)))
+        metric_total += metric
+
+    metric_total /= n_levels
+
+    if last_level:
+        return metric
+
+    return metric_total
+
+
+def custom_psnr_others(input_sharp, output):
+    """
+    PSNR metric (between predicted and sharp image).
+    :param input_sharp (tf.keras.layers.Layer): GT input (sharp images)
+    :param output (tf.keras.layers.Layer): Output of the NN
+    :return: psnr (float): psnr
+    """
+    return 20*log10((1.0 ** 2) / tf.math.sqrt(tf.reduce_mean((tf.cast(input_sharp, tf.float32) -
+                                                               tf.cast(output, tf.float32)) ** 2)))
+
+
+def deblur_output(model_type, input_blur, x_unwrap=None):
+    """
+    Appends the chosen architecture to the blur input.
+
+    :param model_type (string): 'srn', 'srn_shared', 'fcn', 'unet' or 'rednet'
+    :param input_blur (tf.keras.layers.Layer): Blur input of the NN
+    :param x_unwrap (list): List filled with the logical scales (srn only)
+    :return: output (tf.keras.layers.Layer): last layer of the network
+    """
+    if x_unwrap is None:
+        x_unwrap = []
+
+    if 'srn_shared' in model_type:
+        return model_srn_shared(input_blur, x_unwrap)
+    elif 'srn' in model_type:
+        return model_srn(input_blur, x_unwrap)
+    elif 'fcn' in model_type:
+        return model_fcn(input_blur)
+    elif 'unet' in model_type:
+        return model_unet(input_blur)
+    elif 'rednet' in model_type:
+        return model_rednet(input_blur)
+
+    raise ValueError('Unknown model {}, expected one of {}'.format(model_type, model_types))
+
+
+def build_model(model_type, input_shape=(None, None, 3)):
+    """
+    Builds the training model, with the sharp and blur inputs and the loss/metric added to the graph, and the
+    inference model, with the blur input only. The two models share the layers (and so the weights).
+
+    :param model_type (string): 'srn', 'srn_shared', 'fcn', 'unet' or 'rednet'
+    :param input_shape (Tuple[int, int, int]): Shape of the inputs (channel last)
+    :return: models (Tuple[tf.keras.Model, tf.keras.Model]): training and inference models (not compiled)
+    """
+    # Define the 2 inputs of the NN (sharp and blur)
+    input_sharp = Input(shape=input_shape, name='input_sharp')
+    input_blur = Input(shape=input_shape, name='input_blur')
+
+    # Define the output (prediction of deblurred)
+    x_unwrap = []
+    output = deblur_output(model_type, input_blur, x_unwrap)
+
+    if 'srn' in model_type:
+        loss = custom_loss_srn(x_unwrap, input_sharp)
+        custom_psnr = custom_psnr_srn(x_unwrap, input_sharp)
+    else:
+        loss = custom_loss_others(input_sharp, output)
+        custom_psnr = custom_psnr_others(input_sharp, output)
+
+    # Define the model
+    model = Model(inputs=[input_sharp, input_blur], outputs=output)
+
+    # x_unwrap = generator(input_blur)
+    # model = Model(inputs=[input_sharp, input_blur], outputs=x_unwrap)
+
+    # Add custom loss and metric
+    model.add_loss(loss)
+    # Since training happens on batch of images we will use the mean of SSIM values of all the images in the batch as
+    # the loss value -> batch_mean(mean_scales_mse)
+    model.add_metric(custom_psnr, name='mean_scales_psnr', aggregation='mean')  # name = 'psnr'
+
+    inference_model = Model(inputs=input_blur, outputs=output, name='inference_'+model_type)
+
+    return model, inference_model
+
+
+def build_inference_model(model_type, input_shape=(None, None, 3)):
+    """
+    Builds the inference model alone (blur input only, no loss). The weights of a trained model (saved by the training
+    model) can be loaded into it.
+
+    :param model_type (string): 'srn', 'srn_shared', 'fcn', 'unet' or 'rednet'
+    :param input_shape (Tuple[int, int, int]): Shape of the input (channel last)
+    :return: inference_model (tf.keras.Model): Inference model
+    """
+    input_blur = Input(shape=input_shape, name='input_blur')
+    output = deblur_output(model_type, input_blur)
+
+    return Model(inputs=input_blur, outputs=output, name='inference_'+model_type)
+
+
+def export_inference_model(inference_model, export_path, input_shape=(None, None, 3)):
+    """
+    Saves the inference model as a SavedModel with a fixed 'serving_default' signature: a float32 batch of blur images
+    in [0, 1] ('input_blur') mapped to the deblurred images ('output').
+
+    :param inference_model (tf.keras.Model): Inference model
+    :param export_path (string): Folder of the SavedModel
+    :param input_shape (Tuple[int, int, int]): Shape of the input images (None for any height/width)
+    :return: void
+    """
+    @tf.function(input_signature=[tf.TensorSpec([None] + list(input_shape), tf.float32, name='input_blur')])
+    def serve(input_blur):
+        return {'output': inference_model(input_blur, training=False)}
+
+    tf.saved_model.save(inference_model, export_path, signatures={'serving_default': serve})
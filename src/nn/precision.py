@@ -0,0 +1,35 @@
+import tensorflow as tf
+
+# Supported precisions (Keras mixed precision policies)
+precisions = ['float32', 'mixed_float16', 'mixed_bfloat16']
+
+
+def set_precision(precision):
+    """
+    Sets the global Keras policy. Must be called before building the models.
+
+    With a mixed policy the layers compute in float16/bfloat16 while keeping float32 variables; the output layers of
+    the models, the losses and the PSNR stay in float32 (see nn/models.py).
+
+    :param precision (string): One of precisions
+    :return: void
+    """
+    if precision not in precisions:
+        raise ValueError('Unknown precision {}, expected one of {}'.format(precision, precisions))
+
+    tf.keras.mixed_precision.set_global_policy(precision)
+
+
+def wrap_optimizer(optimizer, precision):
+    """
+    Wraps the optimizer with dynamic loss scaling when needed (float16 gradients may underflow; bfloat16 has the same
+    exponent range of float32 and needs no scaling).
+
+    :param optimizer (tf.keras.optimizers.Optimizer): Optimizer
+    :param precision (string): One of precisions
+    :return: optimizer (tf.keras.optimizers.Optimizer): Optimizer, wrapped if needed
+    """
+    if precision == 'mixed_float16':
+        return tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+
+    return optimizer
@@ -0,0 +1,177 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+
+class PredictEngine:
+    """
+    Class to run the predictions of an inference model (blur input only) on batches of images, with a compiled forward
+    pass, while a pool of threads encodes and writes the predicted images.
+    """
+    def __init__(self, inference_model, jit_compile=True, writers=None, max_pending=64, predict_function=None):
+        """
+        Class constructor.
+
+        :param inference_model (tf.keras.Model): Inference model (blur input only); None with predict_function
+        :param jit_compile (boolean): True for compiling the forward pass with XLA
+        :param writers (int): Number of threads encoding and writing the images (default: number of cpus, max 8)
+        :param max_pending (int): Max number of images waiting to be written; the predictions wait when it is reached
+        :param predict_function (function): Function of a batch of blur images (np.array) returning the deblurred
+            images, run instead of the forward pass of inference_model (e.g. a TFLite model, see nn/quantize.py)
+        """
+        self.model = inference_model
+        if predict_function is None:
+            forward = tf.function(lambda images: inference_model(images, training=False), jit_compile=jit_compile)
+
+            def predict_function(images):
+                return forward(tf.convert_to_tensor(images, dtype=tf.float32)).numpy()
+        self.predict_function = predict_function
+
+        if writers is None:
+            writers = min(8, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=writers)
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+
+        # Seconds spent in each stage
+        self.lock = threading.Lock()
+        self.timings = {'load': 0., 'infer': 0., 'encode': 0., 'write': 0.}
+
+    def add_time(self, stage, seconds):
+        """
+        Adds the time spent in a stage.
+
+        :param stage (string): 'load', 'infer', 'encode' or 'write'
+        :param seconds (float): Seconds
+        :return: void
+        """
+        with self.lock:
+            self.timings[stage] += seconds
+
+    def predict(self, images):
+        """
+        Predicts a batch of images.
+
+        :param images (np.array): Blur images with shape (n_images, height, width, channels), in [0, 1]
+        :return: predictions (np.array): Deblurred images, same shape of images
+        """
+        a = time.perf_counter()
+        predictions = np.asarray(self.predict_function(images), dtype=np.float32)
+        self.add_time('infer', time.perf_counter() - a)
+
+        return predictions
+
+    def write(self, image, path):
+        """
+        Encodes an image as png and writes it (called by the writer threads).
+
+        :param image (np.array): Image with shape (height, width, channels), in [0, 1], RGB
+        :param path (string): Path of the png file
+        :return: void
+        """
+        try:
+            a = time.perf_counter()
+            imguint8 = np.clip(image * 255, 0, 255).round().astype(np.uint8)
+            _, buffer = cv2.imencode('.png', cv2.cvtColor(imguint8, cv2.COLOR_RGB2BGR))
+            b = time.perf_counter()
+
+            with open(path, 'wb') as f:
+                f.write(buffer.tobytes())
+            c = time.perf_counter()
+
+            self.add_time('encode', b - a)
+            self.add_time('write', c - b)
+        finally:
+            self.pending.release()
+
+    def submit(self, image, path):
+        """
+        Queues an image to be written; blocks while too many images are waiting. A failed write (of a previous image)
+        is raised here, without waiting for the end of the predictions.
+
+        :param image (np.array): Image with shape (height, width, channels), in [0, 1], RGB
+        :param path (string): Path of the png file
+        :return: void
+        """
+        # Only the images still being written are kept
+        futures = []
+        for future in self.futures:
+            if not future.done():
+                futures.append(future)
+            elif future.exception() is not None:
+                raise future.exception()
+        self.futures = futures
+
+        self.pending.acquire()
+        self.futures.append(self.executor.submit(self.write, image, path))
+
+    def timed(self, batches):
+        """
+        Yields the batches, adding the time spent waiting for them to the 'load' stage.
+
+        :param batches (iterable): Batches of images
+        :return: batches (generator): The same batches
+        """
+        iterator = iter(batches)
+
+        while True:
+            a = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            self.add_time('load', time.perf_counter() - a)
+
+            yield batch
+
+    def run(self, batches, names, out_path):
+        """
+        Predicts all the batches and writes the predictions.
+
+        :param batches (iterable): Batches of blur images (n_images, height, width, channels), in [0, 1]
+        :param names (iterable): Names of the images (relative to out_path), in the same order of the batches
+        :param out_path (string): Path where to save the predictions
+        :return: count (int): Number of predicted images
+        """
+        names = iter(names)
+        count = 0
+
+        for batch in self.timed(batches):
+            for prediction in self.predict(batch):
+                self.submit(prediction, os.path.join(out_path, next(names)))
+                count += 1
+
+            print('Predicted {}'.format(count))
+
+        return count
+
+    def close(self):
+        """
+        Waits for the pending images to be written and stops the writers.
+
+        :return: timings (dict): for each stage, the total seconds spent
+        """
+        for future in self.futures:
+            future.result()
+        self.futures = []
+        self.executor.shutdown()
+
+        return dict(self.timings)
+
+    @staticmethod
+    def report(timings, count):
+        """
+        Prints the average time per image of each stage.
+
+        :param timings (dict): for each stage, the total seconds spent (see close)
+        :param count (int): Number of predicted images
+        :return: void
+        """
+        print('Predicted {} images. Avg. time per image: {}'.format(
+            count, ', '.join('{} {:.2f} ms'.format(stage, timings[stage] * 1000 / max(1, count))
+                             for stage in timings)))
@@ -0,0 +1,125 @@
+import csv
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.callbacks import Callback
+
+# Fraction of the step time spent waiting for the input above which an epoch is reported as input-bound
+input_bound_threshold = 0.1
+
+
+def timed_next(iterator):
+    """
+    Gets the next element of an iterator in a tf.function, measuring the time spent waiting for it.
+
+    :param iterator (iterator): tf.data iterator (or distributed iterator)
+    :return: element, seconds (Tuple[object, tf.Tensor]): next element and float64 seconds spent waiting
+    """
+    start = tf.timestamp()
+    with tf.control_dependencies([start]):
+        element = next(iterator)
+    with tf.control_dependencies(tf.nest.flatten(element, expand_composites=True)):
+        end = tf.timestamp()
+    # The step consumes the element only after end: otherwise end may run after the compute of the step
+    with tf.control_dependencies([end]):
+        element = tf.nest.map_structure(tf.identity, element, expand_composites=True)
+
+    return element, end - start
+
+
+class StepTimer(Callback):
+    """
+    Callback recording the time of each training step, split in the time spent waiting for the input ('input_wait' of
+    the logs, measured by the custom training loop of nn/training.py) and the compute time, and printing a summary at
+    the end of each epoch. Without 'input_wait' in the logs (e.g. model.fit), only the step times are recorded.
+    """
+    def __init__(self, csv_path=None, skip_first=True):
+        """
+        Class constructor.
+
+        :param csv_path (string): CSV file where the per-step times are saved (epoch, step, steps, total, input wait,
+            compute, in milliseconds; input wait and compute are empty if not measured); None for not saving them
+        :param skip_first (boolean): True for excluding the first call of the training (tracing and compilation) from
+            the summary
+        """
+        super().__init__()
+        self.csv_path = csv_path
+        self.skip_first = skip_first
+        self.writer = None
+        self.file = None
+        self.epoch = 0
+        self.start = None
+        self.last_step = -1
+        self.first = True
+        self.records = []
+
+    def on_train_begin(self, logs=None):
+        self.first = True
+
+        if self.csv_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.csv_path)), exist_ok=True)
+            self.file = open(self.csv_path, 'w', newline='')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(['epoch', 'step', 'steps', 'total_ms', 'input_wait_ms', 'compute_ms'])
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+        self.last_step = -1
+        self.records = []
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        total = time.perf_counter() - self.start
+        wait = float(logs['input_wait']) if logs is not None and 'input_wait' in logs else np.nan
+        # Steps run by this call (steps_per_execution)
+        steps = batch - self.last_step
+        self.last_step = batch
+
+        if self.writer is not None:
+            split = [wait * 1000, (total - wait) * 1000] if not np.isnan(wait) else ['', '']
+            self.writer.writerow([self.epoch, batch, steps, total * 1000] + split)
+
+        if self.first and self.skip_first:
+            self.first = False
+            return
+        self.first = False
+
+        self.records.append((steps, total, wait))
+
+    def on_epoch_end(self, epoch, logs=None):
+        if len(self.records) == 0:
+            return
+
+        steps, total, wait = (np.array(column, dtype=np.float64) for column in zip(*self.records))
+        per_step = total / steps * 1000
+
+        if np.isnan(wait).any():
+            print('\nEpoch {} step times: {:.0f} steps, {:.1f} ms/step (p50 {:.1f}, p90 {:.1f}), input wait not '
+                  'measured (custom training_loop only)'.format(
+                      epoch + 1, steps.sum(), total.sum() / steps.sum() * 1000, np.percentile(per_step, 50),
+                      np.percentile(per_step, 90)))
+            if self.file is not None:
+                self.file.flush()
+            return
+
+        print('\nEpoch {} step times: {:.0f} steps, {:.1f} ms/step (p50 {:.1f}, p90 {:.1f}), input wait {:.1f} ms/step '
+              '({:.1f}%), compute {:.1f} ms/step'.format(
+                  epoch + 1, steps.sum(), total.sum() / steps.sum() * 1000, np.percentile(per_step, 50),
+                  np.percentile(per_step, 90), wait.sum() / steps.sum() * 1000, 100 * wait.sum() / total.sum(),
+                  (total.sum() - wait.sum()) / steps.sum() * 1000))
+
+        if wait.sum() > input_bound_threshold * total.sum():
+            print('Epoch {} is input-bound: the model waits for the input pipeline'.format(epoch + 1))
+
+        if self.file is not None:
+            self.file.flush()
+
+    def on_train_end(self, logs=None):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.writer = None
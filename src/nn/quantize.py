@@ -0,0 +1,145 @@
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from utils.config import quantization_modes
+from utils.eval import array_metrics
+
+
+def convert_tflite(inference_model, mode, input_size, representative_images=None):
+    """
+    Converts an inference model to TFLite, with a fixed input of a single image (the CPU predictions are made image
+    by image, or tile by tile).
+
+    :param inference_model (tf.keras.Model): Inference model (blur input only)
+    :param mode (string): One of quantization_modes
+    :param input_size (Tuple[int, int]): height and width of the input images
+    :param representative_images (iterable): Blur images (height, width, channels) in [0, 1], calibrating the 'int8'
+        quantization
+    :return: model (bytes): TFLite flatbuffer
+    """
+    if mode not in quantization_modes:
+        raise ValueError('Unknown quantization {}, expected one of {}'.format(mode, quantization_modes))
+
+    @tf.function(input_signature=[tf.TensorSpec([1] + list(input_size) + [3], tf.float32, name='input_blur')])
+    def serve(input_blur):
+        return inference_model(input_blur, training=False)
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([serve.get_concrete_function()], inference_model)
+
+    if mode != 'float32':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if mode == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == 'int8':
+        if representative_images is None:
+            raise ValueError('The int8 quantization needs representative images')
+
+        converter.representative_dataset = lambda: ([np.asarray(image, np.float32)[None]]
+                                                    for image in representative_images)
+        # Integer kernels only (the conversion fails if an op has none), with uint8 input and output (see
+        # TFLiteModel.quantize and dequantize)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+        converter.inference_output_type = tf.uint8
+
+    return converter.convert()
+
+
+class TFLiteModel:
+    """
+    Class to run the predictions of a TFLite model (see convert_tflite) on batches of images.
+    """
+    def __init__(self, model_content=None, model_path=None, num_threads=None):
+        """
+        Class constructor.
+
+        :param model_content (bytes): TFLite flatbuffer
+        :param model_path (string): Path of the .tflite file (if model_content is not given)
+        :param num_threads (int): Number of threads of the interpreter (default: number of cpus)
+        """
+        self.interpreter = tf.lite.Interpreter(model_content=model_content, model_path=model_path,
+                                               num_threads=num_threads if num_threads is not None else os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+
+    @staticmethod
+    def quantize(x, details):
+        """
+        Converts a float tensor to the type of an input (quantized, if integer).
+
+        :param x (np.array): Float tensor
+        :param details (dict): Details of the input (interpreter.get_input_details)
+        :return: x (np.array): Converted tensor
+        """
+        if np.issubdtype(details['dtype'], np.floating):
+            return x.astype(details['dtype'])
+
+        scale, zero_point = details['quantization']
+        info = np.iinfo(details['dtype'])
+
+        return np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(details['dtype'])
+
+    @staticmethod
+    def dequantize(x, details):
+        """
+        Converts an output to float (dequantized, if integer).
+
+        :param x (np.array): Output tensor
+        :param details (dict): Details of the output (interpreter.get_output_details)
+        :return: x (np.array): Float tensor
+        """
+        if np.issubdtype(details['dtype'], np.floating):
+            return x.astype(np.float32)
+
+        scale, zero_point = details['quantization']
+
+        return (x.astype(np.float32) - zero_point) * scale
+
+    def predict(self, images):
+        """
+        Predicts a batch of images, one at a time.
+
+        :param images (np.array): Blur images with shape (n_images, height, width, channels), in [0, 1]
+        :return: predictions (np.array): Deblurred images, same shape of images
+        """
+        predictions = []
+
+        for image in images:
+            self.interpreter.set_tensor(self.input['index'], self.quantize(np.asarray(image)[None], self.input))
+            self.interpreter.invoke()
+            predictions.append(self.dequantize(self.interpreter.get_tensor(self.output['index']), self.output)[0])
+
+        return np.stack(predictions)
+
+
+def evaluate_predictions(predict, sharp, blur, batch_size=8):
+    """
+    Evaluates a prediction function (MSE, PSNR, SSIM of utils/eval.py, and latency).
+
+    :param predict (function): Function of a batch of blur images, returning the deblurred images
+    :param sharp (np.array): Sharp images with shape (n_images, height, width, channels), in [0, 1]
+    :param blur (np.array): Blur images, same shape of sharp
+    :param batch_size (int): Number of images predicted at once
+    :return: metrics (dict): average 'mse', 'psnr', 'ssim' and 'ms_per_image'
+    """
+    # Warm up (compilation, allocations)
+    predict(blur[:1])
+
+    seconds = 0.
+    metrics = []
+    for start in range(0, len(blur), batch_size):
+        a = time.perf_counter()
+        predictions = predict(blur[start:start + batch_size])
+        seconds += time.perf_counter() - a
+
+        for orig, deb in zip(sharp[start:start + batch_size], predictions):
+            metrics.append(array_metrics(orig.astype(np.float64), np.clip(deb, 0, 1).astype(np.float64)))
+
+    mse, psnr, ssim = np.mean(metrics, axis=0)
+
+    return {'mse': float(mse), 'psnr': float(psnr), 'ssim': float(ssim), 'ms_per_image': 1000 * seconds / len(blur)}
@@ -0,0 +1,377 @@
+import io
+import json
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from utils.tiling import pad_to_multiple
+
+# Upper bounds (seconds) of the buckets of the latency histograms
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.)
+# Upper bounds of the buckets of the batch size histogram
+batch_size_buckets = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class Histogram:
+    """
+    Class for a thread-safe histogram, rendered in the Prometheus text format (cumulative buckets, sum and count).
+    """
+    def __init__(self, name, description, buckets=latency_buckets):
+        """
+        Class constructor.
+
+        :param name (string): Name of the metric
+        :param description (string): Description of the metric
+        :param buckets (tuple): Upper bounds of the buckets, sorted
+        """
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        Adds a value.
+
+        :param value (float): Value (e.g. seconds)
+        :return: void
+        """
+        i = int(np.searchsorted(self.buckets, value))
+
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self):
+        """
+        Renders the histogram.
+
+        :return: lines (list): Lines of the Prometheus text format
+        """
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} histogram'.format(self.name)]
+        cumulative = 0
+        for bound, bucket_count in zip(list(self.buckets) + ['+Inf'], counts):
+            cumulative += bucket_count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, bound, cumulative))
+        lines.append('{}_sum {}'.format(self.name, total))
+        lines.append('{}_count {}'.format(self.name, count))
+
+        return lines
+
+
+class ServerMetrics:
+    """
+    Class for the metrics of the inference server: counters, throughput, latency and batch size histograms.
+    """
+    def __init__(self):
+        """
+        Class constructor.
+        """
+        self.start = time.time()
+        self.lock = threading.Lock()
+        self.counters = {'requests_total': 0, 'errors_total': 0, 'images_total': 0, 'batches_total': 0}
+
+        self.request_latency = Histogram('deblur_request_latency_seconds', 'Time from the request to the response')
+        self.queue_latency = Histogram('deblur_queue_latency_seconds', 'Time waiting to be batched')
+        self.inference_latency = Histogram('deblur_inference_latency_seconds', 'Time of the forward pass of a batch')
+        self.batch_size = Histogram('deblur_batch_size', 'Number of images of each batch', batch_size_buckets)
+
+    def increment(self, counter, value=1):
+        """
+        Increments a counter.
+
+        :param counter (string): Name of the counter
+        :param value (int): Increment
+        :return: void
+        """
+        with self.lock:
+            self.counters[counter] += value
+
+    def render(self):
+        """
+        Renders the metrics.
+
+        :return: text (string): Prometheus text format
+        """
+        with self.lock:
+            counters = dict(self.counters)
+        uptime = time.time() - self.start
+
+        lines = []
+        for name, value in counters.items():
+            lines += ['# TYPE deblur_{} counter'.format(name), 'deblur_{} {}'.format(name, value)]
+        lines += ['# TYPE deblur_uptime_seconds gauge', 'deblur_uptime_seconds {:.3f}'.format(uptime),
+                  '# TYPE deblur_images_per_second gauge',
+                  'deblur_images_per_second {:.3f}'.format(counters['images_total'] / max(uptime, 1e-9))]
+        for histogram in [self.request_latency, self.queue_latency, self.inference_latency, self.batch_size]:
+            lines += histogram.render()
+
+        return '\n'.join(lines) + '\n'
+
+
+class DynamicBatcher:
+    """
+    Class to group the concurrent prediction requests into batches: the requests with the same image shape are
+    predicted together, as soon as max_batch_size of them are waiting or the oldest one has waited batch_window
+    seconds. A single thread runs the predictions.
+    """
+    def __init__(self, predict, max_batch_size=8, batch_window=0.005, metrics=None):
+        """
+        Class constructor.
+
+        :param predict (function): Function of a batch of images (n_images, height, width, channels), returning the
+            predictions
+        :param max_batch_size (int): Max number of images of a batch
+        :param batch_window (float): Max seconds a request waits for other requests of the same shape
+        :param metrics (ServerMetrics): Metrics updated by the batcher (optional)
+        """
+        self.predict = predict
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_window = batch_window
+        self.metrics = metrics
+
+        # For each shape, the waiting requests (image, future, arrival time), oldest first
+        self.pending = {}
+        self.condition = threading.Condition()
+        self.closed = False
+
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, image):
+        """
+        Queues an image to be predicted.
+
+        :param image (np.array): Image with shape (height, width, channels)
+        :return: future (concurrent.futures.Future): Future of the prediction
+        """
+        future = Future()
+
+        with self.condition:
+            if self.closed:
+                raise RuntimeError('The batcher is closed')
+
+            self.pending.setdefault(image.shape, []).append((image, future, time.perf_counter()))
+            self.condition.notify()
+
+        return future
+
+    def next_batch(self):
+        """
+        Waits for the next batch: the requests of the shape with the oldest request.
+
+        :return: requests (list): Requests of the batch (None when closed and no request is waiting)
+        """
+        with self.condition:
+            while True:
+                if len(self.pending) == 0:
+                    if self.closed:
+                        return None
+                    self.condition.wait()
+                    continue
+
+                shape = min(self.pending, key=lambda s: self.pending[s][0][2])
+                requests = self.pending[shape]
+                remaining = requests[0][2] + self.batch_window - time.perf_counter()
+
+                if len(requests) >= self.max_batch_size or remaining <= 0 or self.closed:
+                    batch = requests[:self.max_batch_size]
+                    if len(requests) > self.max_batch_size:
+                        self.pending[shape] = requests[self.max_batch_size:]
+                    else:
+                        del self.pending[shape]
+
+                    return batch
+
+                self.condition.wait(remaining)
+
+    def loop(self):
+        """
+        Predicts the batches (run by the batcher thread).
+
+        :return: void
+        """
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+
+            a = time.perf_counter()
+            try:
+                predictions = self.predict(np.stack([image for image, _, _ in batch]))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            b = time.perf_counter()
+
+            if self.metrics is not None:
+                self.metrics.increment('batches_total')
+                self.metrics.increment('images_total', len(batch))
+                self.metrics.batch_size.observe(len(batch))
+                self.metrics.inference_latency.observe(b - a)
+                for _, _, arrival in batch:
+                    self.metrics.queue_latency.observe(a - arrival)
+
+            for (_, future, _), prediction in zip(batch, predictions):
+                future.set_result(prediction)
+
+    def close(self):
+        """
+        Predicts the waiting requests and stops the batcher thread.
+
+        :return: void
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+        self.thread.join()
+
+
+def decode_image(body):
+    """
+    Decodes the body of a request: a png image or a .npy array (uint8 in [0, 255] or float in [0, 1]).
+
+    :param body (bytes): Body of the request
+    :return: image, kind (Tuple[np.array, string]): float32 RGB image in [0, 1] with shape (height, width, 3) and
+        'png' or 'npy'
+    """
+    if body.startswith(b'\x89PNG'):
+        image = cv2.imdecode(np.frombuffer(body, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError('Invalid png image')
+
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB).astype(np.float32) / 255., 'png'
+
+    if body.startswith(b'\x93NUMPY'):
+        image = np.load(io.BytesIO(body), allow_pickle=False)
+        if image.ndim != 3 or image.shape[2] != 3:
+            raise ValueError('Expected an array with shape (height, width, 3), got {}'.format(image.shape))
+
+        if image.dtype == np.uint8:
+            return image.astype(np.float32) / 255., 'npy'
+
+        return image.astype(np.float32), 'npy'
+
+    raise ValueError('Expected a png image or a .npy array')
+
+
+def encode_image(image, kind):
+    """
+    Encodes a prediction in the format of the request.
+
+    :param image (np.array): RGB image in [0, 1] with shape (height, width, 3)
+    :param kind (string): 'png' (8 bits png) or 'npy' (float32 .npy array)
+    :return: body, content_type (Tuple[bytes, string]): Body and content type of the response
+    """
+    if kind == 'png':
+        imguint8 = np.clip(image * 255, 0, 255).round().astype(np.uint8)
+        _, buffer = cv2.imencode('.png', cv2.cvtColor(imguint8, cv2.COLOR_RGB2BGR))
+
+        return buffer.tobytes(), 'image/png'
+
+    buffer = io.BytesIO()
+    np.save(buffer, np.clip(image, 0, 1).astype(np.float32), allow_pickle=False)
+
+    return buffer.getvalue(), 'application/octet-stream'
+
+
+class DeblurRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handler of the requests of the inference server:
+    - POST /deblur: body with a png image or a .npy array, answered with the deblurred image in the same format
+    - GET /metrics: metrics in the Prometheus text format
+    - GET /health: 'ok'
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def send(self, code, body, content_type='text/plain; charset=utf-8'):
+        """
+        Sends a response.
+
+        :param code (int): HTTP status code
+        :param body (bytes or string): Body
+        :param content_type (string): Content type
+        :return: void
+        """
+        if isinstance(body, str):
+            body = body.encode()
+
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.send(200, self.server.metrics.render(), 'text/plain; version=0.0.4')
+        elif self.path == '/health':
+            self.send(200, 'ok\n')
+        else:
+            self.send(404, 'Not found\n')
+
+    def do_POST(self):
+        if self.path != '/deblur':
+            self.send(404, 'Not found\n')
+            return
+
+        a = time.perf_counter()
+        metrics = self.server.metrics
+        metrics.increment('requests_total')
+
+        try:
+            image, kind = decode_image(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError as e:
+            metrics.increment('errors_total')
+            self.send(400, json.dumps({'error': str(e)}), 'application/json')
+            return
+
+        try:
+            height, width = image.shape[:2]
+            prediction = self.server.batcher.submit(pad_to_multiple(image, self.server.pad_multiple)).result()
+            body, content_type = encode_image(prediction[:height, :width], kind)
+        except Exception as e:
+            metrics.increment('errors_total')
+            self.send(500, json.dumps({'error': str(e)}), 'application/json')
+            return
+
+        self.send(200, body, content_type)
+        metrics.request_latency.observe(time.perf_counter() - a)
+
+    def log_message(self, format, *args):
+        # The requests are counted in the metrics, not logged one by one
+        pass
+
+
+class DeblurServer(ThreadingHTTPServer):
+    """
+    HTTP inference server: each request is handled by a thread and predicted by the shared DynamicBatcher.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, batcher, metrics, pad_multiple=16):
+        """
+        Class constructor.
+
+        :param address (Tuple[string, int]): Host and port
+        :param batcher (DynamicBatcher): Batcher running the predictions
+        :param metrics (ServerMetrics): Metrics of the server
+        :param pad_multiple (int): The images are padded to multiples of pad_multiple (and the predictions cropped)
+        """
+        super().__init__(address, DeblurRequestHandler)
+        self.batcher = batcher
+        self.metrics = metrics
+        self.pad_multiple = pad_multiple
@@ -0,0 +1,329 @@
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+video_extensions = ('.mp4', '.avi', '.mov', '.mkv')
+image_extensions = ('.png', '.jpg', '.jpeg')
+# Codec of the written videos, for each extension (default: mp4v)
+video_codecs = {'.avi': 'MJPG'}
+
+
+def is_video(path):
+    """
+    True if the path is a video file (by extension).
+
+    :param path (string): Path
+    :return: is_video (boolean): True for a video file
+    """
+    return path.lower().endswith(video_extensions)
+
+
+class FrameSource:
+    """
+    Class to read the frames of a video file or of a directory of images (e.g. a REDS scene), one at a time.
+    """
+    def __init__(self, path, fps=24.):
+        """
+        Class constructor.
+
+        :param path (string): Path of the video file or of the directory
+        :param fps (float): Frame rate of a directory of images (a video file has its own)
+        """
+        self.path = path
+        self.fps = fps
+
+        if is_video(path):
+            capture = cv2.VideoCapture(path)
+            if not capture.isOpened():
+                raise IOError('Cannot open the video {}'.format(path))
+            self.fps = capture.get(cv2.CAP_PROP_FPS) or fps
+            self.length = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            capture.release()
+        else:
+            self.names = sorted(f for f in os.listdir(path) if f.lower().endswith(image_extensions))
+            self.length = len(self.names)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        """
+        Yields the frames.
+
+        :return: frames (generator): (name, RGB uint8 frame with shape (height, width, 3))
+        """
+        if not is_video(self.path):
+            for name in self.names:
+                yield name, cv2.cvtColor(cv2.imread(os.path.join(self.path, name)), cv2.COLOR_BGR2RGB)
+            return
+
+        capture = cv2.VideoCapture(self.path)
+        try:
+            index = 0
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    return
+
+                yield '{:08d}.png'.format(index), cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                index += 1
+        finally:
+            capture.release()
+
+
+class FrameSink:
+    """
+    Class to write frames to a video file or to a directory of png images.
+    """
+    def __init__(self, path, fps=24.):
+        """
+        Class constructor.
+
+        :param path (string): Path of the video file (by extension, see video_extensions) or of the directory
+        :param fps (float): Frame rate of the video
+        """
+        self.path = path
+        self.fps = fps
+        self.writer = None
+
+        Path(os.path.dirname(path) if is_video(path) else path).mkdir(parents=True, exist_ok=True)
+
+    def write(self, name, frame):
+        """
+        Writes a frame.
+
+        :param name (string): Name of the frame (file name in a directory)
+        :param frame (np.array): RGB uint8 frame with shape (height, width, 3)
+        :return: void
+        """
+        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+
+        if not is_video(self.path):
+            cv2.imwrite(os.path.join(self.path, os.path.splitext(name)[0] + '.png'), frame)
+            return
+
+        if self.writer is None:
+            # The size of the video is the one of the first frame
+            codec = video_codecs.get(os.path.splitext(self.path)[1].lower(), 'mp4v')
+            self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*codec), self.fps,
+                                          (frame.shape[1], frame.shape[0]))
+            if not self.writer.isOpened():
+                raise IOError('Cannot write the video {}'.format(self.path))
+
+        self.writer.write(frame)
+
+    def close(self):
+        """
+        Closes the video (if any).
+
+        :return: void
+        """
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
+
+
+class StreamingPipeline:
+    """
+    Class to deblur a stream of frames with three stages running at the same time: decoding (a thread), inference
+    (the calling thread) and encoding (a thread). The stages exchange the frames through bounded queues, so the memory
+    does not depend on the length of the stream.
+    """
+    def __init__(self, predict, batch_size=4, queue_size=8):
+        """
+        Class constructor.
+
+        :param predict (function): Function of a batch of float frames (n_frames, height, width, 3) in [0, 1],
+            returning the deblurred frames
+        :param batch_size (int): Max number of consecutive frames predicted together
+        :param queue_size (int): Max number of frames waiting between two stages
+        """
+        self.predict = predict
+        self.batch_size = max(1, batch_size)
+        self.queue_size = max(1, queue_size)
+
+        self.failed = threading.Event()
+        self.errors = []
+        # Busy seconds of each stage
+        self.timings = {'decode': 0., 'infer': 0., 'encode': 0.}
+
+    def put(self, q, item):
+        """
+        Puts an item in a queue, giving up if a stage failed.
+
+        :param q (queue.Queue): Queue
+        :param item (object): Item
+        :return: ok (boolean): False if a stage failed
+        """
+        while not self.failed.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def get(self, q):
+        """
+        Gets an item from a queue, giving up if a stage failed.
+
+        :param q (queue.Queue): Queue
+        :return: item (object): Item (None if a stage failed)
+        """
+        while not self.failed.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+        return None
+
+    def fail(self, error):
+        """
+        Records the error of a stage and stops the others.
+
+        :param error (Exception): Error
+        :return: void
+        """
+        self.errors.append(error)
+        self.failed.set()
+
+    def decode(self, source, decoded):
+        """
+        Decoding stage: reads the frames of the source (run by the decoding thread).
+
+        :param source (iterable): (name, RGB uint8 frame)
+        :param decoded (queue.Queue): Queue of the decoded frames (None at the end)
+        :return: void
+        """
+        try:
+            frames = iter(source)
+            while True:
+                a = time.perf_counter()
+                frame = next(frames, None)
+                self.timings['decode'] += time.perf_counter() - a
+
+                if not self.put(decoded, frame) or frame is None:
+                    return
+        except Exception as e:
+            self.fail(e)
+
+    def encode(self, sink, predicted):
+        """
+        Encoding stage: writes the deblurred frames to the sink (run by the encoding thread).
+
+        :param sink (FrameSink): Sink
+        :param predicted (queue.Queue): Queue of the deblurred frames (None at the end)
+        :return: void
+        """
+        try:
+            while True:
+                item = self.get(predicted)
+                if item is None:
+                    return
+
+                a = time.perf_counter()
+                name, frame = item
+                sink.write(name, np.clip(frame * 255, 0, 255).round().astype(np.uint8))
+                self.timings['encode'] += time.perf_counter() - a
+        except Exception as e:
+            self.fail(e)
+
+    def infer(self, names, frames, predicted):
+        """
+        Inference stage: predicts a batch of frames and queues the predictions.
+
+        :param names (list): Names of the frames
+        :param frames (list): RGB uint8 frames, with the same shape
+        :param predicted (queue.Queue): Queue of the deblurred frames
+        :return: ok (boolean): False if a stage failed
+        """
+        a = time.perf_counter()
+        predictions = self.predict(np.stack(frames).astype(np.float32) / 255.)
+        self.timings['infer'] += time.perf_counter() - a
+
+        return all(self.put(predicted, (name, prediction)) for name, prediction in zip(names, predictions))
+
+    def run(self, source, sink):
+        """
+        Deblurs all the frames of the source and writes them to the sink.
+
+        :param source (iterable): (name, RGB uint8 frame), e.g. a FrameSource
+        :param sink (FrameSink): Sink
+        :return: stats (dict): 'frames', 'seconds', 'fps' and the busy seconds of each stage
+        """
+        self.failed = threading.Event()
+        self.errors = []
+        self.timings = {'decode': 0., 'infer': 0., 'encode': 0.}
+
+        decoded = queue.Queue(maxsize=self.queue_size)
+        predicted = queue.Queue(maxsize=self.queue_size)
+        decoder = threading.Thread(target=self.decode, args=(source, decoded), daemon=True)
+        encoder = threading.Thread(target=self.encode, args=(sink, predicted), daemon=True)
+
+        start = time.perf_counter()
+        decoder.start()
+        encoder.start()
+
+        count = 0
+        names = []
+        frames = []
+        try:
+            while True:
+                item = self.get(decoded)
+                # Predict the pending frames at the end, or when the shape changes
+                if len(frames) > 0 and (item is None or item[1].shape != frames[0].shape):
+                    if not self.infer(names, frames, predicted):
+                        break
+                    count += len(frames)
+                    names = []
+                    frames = []
+
+                if item is None:
+                    break
+
+                names.append(item[0])
+                frames.append(item[1])
+                if len(frames) >= self.batch_size:
+                    if not self.infer(names, frames, predicted):
+                        break
+                    count += len(frames)
+                    names = []
+                    frames = []
+        except Exception as e:
+            self.fail(e)
+        finally:
+            self.put(predicted, None)
+            encoder.join()
+            self.failed.set()
+            decoder.join()
+            sink.close()
+
+        if len(self.errors) > 0:
+            raise self.errors[0]
+
+        seconds = time.perf_counter() - start
+        stats = {'frames': count, 'seconds': seconds, 'fps': count / seconds if seconds > 0 else 0.}
+        stats.update(self.timings)
+
+        return stats
+
+    @staticmethod
+    def report(stats):
+        """
+        Prints the throughput and the busy time per frame of each stage.
+
+        :param stats (dict): Stats returned by run
+        :return: void
+        """
+        frames = max(1, stats['frames'])
+        print('Deblurred {} frames in {:.2f} s ({:.2f} fps). Busy time per frame: decode {:.2f} ms, infer {:.2f} ms, '
+              'encode {:.2f} ms'.format(stats['frames'], stats['seconds'], stats['fps'],
+                                        1000 * stats['decode'] / frames, 1000 * stats['infer'] / frames,
+                                        1000 * stats['encode'] / frames))
@@ -0,0 +1,235 @@
+import tensorflow as tf
+from tensorflow.keras.callbacks import CallbackList
+
+from nn.distribute import generator_dataset
+from nn.profiling import timed_next
+
+
+class Trainer:
+    """
+    Class to train a model whose loss and metrics are added to the graph (model.add_loss/add_metric, see
+    nn/models.py) with a custom loop: each optimizer step accumulates the gradients of accumulation_steps batches, and
+    steps_per_execution optimizer steps run in a single compiled call. The Keras callbacks (TensorBoard,
+    RotatingCheckpoint, LearningRateScheduler, ...) are supported.
+    """
+    def __init__(self, model, accumulation_steps=1, steps_per_execution=1, strategy=None):
+        """
+        Class constructor.
+
+        :param model (tf.keras.Model): Training model (sharp and blur inputs), compiled with its optimizer
+        :param accumulation_steps (int): Number of batches whose gradients are accumulated in each optimizer step (the
+            effective batch size is batch_size * accumulation_steps)
+        :param steps_per_execution (int): Number of optimizer steps in each compiled call
+        :param strategy (tf.distribute.Strategy): Strategy the model was built in (default: current strategy)
+        """
+        if model.optimizer is None:
+            raise ValueError('The model must be compiled with an optimizer')
+
+        self.model = model
+        self.optimizer = model.optimizer
+        self.accumulation_steps = max(1, accumulation_steps)
+        self.steps_per_execution = max(1, steps_per_execution)
+        self.strategy = strategy if strategy is not None else tf.distribute.get_strategy()
+
+        with self.strategy.scope():
+            self.loss_tracker = tf.keras.metrics.Mean(name='loss')
+
+        self.train_function = None
+        self.test_function = None
+
+    @property
+    def metrics(self):
+        """
+        Loss tracker and metrics of the model (add_metric).
+
+        :return: metrics (list): Metrics
+        """
+        return [self.loss_tracker] + [metric for metric in self.model.metrics if metric.name != 'loss']
+
+    def logs(self, prefix=''):
+        """
+        Current values of the metrics.
+
+        :param prefix (string): Prefix of the names ('val_' for the validation)
+        :return: logs (dict): For each metric name, its value
+        """
+        return {prefix + metric.name: float(metric.result()) for metric in self.metrics}
+
+    def reset_metrics(self):
+        """
+        Resets the state of the metrics.
+
+        :return: void
+        """
+        for metric in self.metrics:
+            metric.reset_state()
+
+    def forward(self, batch, training):
+        """
+        Forward pass of a batch, updating the metrics of the model.
+
+        :param batch (tuple): ((sharp, blur),) batch
+        :param training (boolean): True in training
+        :return: loss (tf.Tensor): Loss of the batch (sum of model.losses)
+        """
+        inputs = batch[0]
+        self.model(list(inputs), training=training)
+        loss = tf.add_n(self.model.losses)
+        self.loss_tracker.update_state(loss)
+
+        return loss
+
+    def replica_train_step(self, batches):
+        """
+        One optimizer step on a replica: the gradients of the batches are accumulated and applied once.
+
+        :param batches (list): accumulation_steps ((sharp, blur),) batches
+        :return: void
+        """
+        variables = self.model.trainable_variables
+        gradients = [tf.zeros_like(variable) for variable in variables]
+        # The gradients are summed over the replicas: scale to the mean over replicas and accumulated batches
+        scale = 1. / (self.strategy.num_replicas_in_sync * self.accumulation_steps)
+        loss_scale = isinstance(self.optimizer, tf.keras.mixed_precision.LossScaleOptimizer)
+
+        for batch in batches:
+            with tf.GradientTape() as tape:
+                loss = self.forward(batch, training=True) * scale
+                if loss_scale:
+                    loss = self.optimizer.get_scaled_loss(loss)
+
+            batch_gradients = tape.gradient(loss, variables)
+            if loss_scale:
+                batch_gradients = self.optimizer.get_unscaled_gradients(batch_gradients)
+
+            gradients = [g + b for g, b in zip(gradients, batch_gradients)]
+
+        self.optimizer.apply_gradients(zip(gradients, variables))
+
+    def make_train_function(self):
+        """
+        Compiled function running n optimizer steps on the batches of an (distributed) iterator. It returns the
+        seconds spent waiting for the batches.
+
+        :return: train_function (tf.function): function of (iterator, n)
+        """
+        def train_function(iterator, n):
+            wait = tf.constant(0., dtype=tf.float64)
+
+            for _ in tf.range(n):
+                batches = []
+                for _ in range(self.accumulation_steps):
+                    batch, batch_wait = timed_next(iterator)
+                    batches.append(batch)
+                    wait += batch_wait
+
+                self.strategy.run(self.replica_train_step, args=(batches,))
+
+            return wait
+
+        return tf.function(train_function)
+
+    def make_test_function(self):
+        """
+        Compiled function evaluating n batches of an (distributed) iterator.
+
+        :return: test_function (tf.function): function of (iterator, n)
+        """
+        def test_function(iterator, n):
+            for _ in tf.range(n):
+                self.strategy.run(self.forward, args=(next(iterator), False))
+
+        return tf.function(test_function)
+
+    def distribute(self, data, input_shape):
+        """
+        Distributed iterator over a dataset or a generator of ((sharp, blur),) batches.
+
+        :param data (tf.data.Dataset or generator): Batches (an iterator already returned by distribute is kept)
+        :param input_shape (Tuple[int, int, int]): Shape of the images (for the generators)
+        :return: iterator (iterator): Distributed iterator
+        """
+        if isinstance(data, (tf.data.Iterator, tf.distribute.DistributedIterator)):
+            return data
+        if not isinstance(data, tf.data.Dataset):
+            data = generator_dataset(data, input_shape)
+
+        return iter(self.strategy.experimental_distribute_dataset(data))
+
+    def evaluate(self, iterator, steps):
+        """
+        Evaluates steps batches.
+
+        :param iterator (iterator): Distributed iterator
+        :param steps (int): Number of batches
+        :return: logs (dict): Validation metrics ('val_' prefix)
+        """
+        if self.test_function is None:
+            self.test_function = self.make_test_function()
+
+        self.reset_metrics()
+        self.test_function(iterator, tf.constant(steps))
+
+        return self.logs('val_')
+
+    def fit(self, train_data, epochs, steps_per_epoch, callbacks=None, validation_data=None, validation_steps=None,
+            initial_epoch=0, input_shape=(None, None, 3), verbose=1):
+        """
+        Trains the model, like model.fit. steps_per_epoch counts the batches (as in model.fit): each epoch makes
+        steps_per_epoch // accumulation_steps optimizer steps.
+
+        :param train_data (tf.data.Dataset or generator): Infinite training batches ((sharp, blur),), or their
+            iterator (see distribute; e.g. to save its position in the checkpoints)
+        :param epochs (int): Last epoch
+        :param steps_per_epoch (int): Number of training batches per epoch
+        :param callbacks (list): Keras callbacks
+        :param validation_data (tf.data.Dataset or generator): Infinite validation batches ((sharp, blur),)
+        :param validation_steps (int): Number of validation batches per epoch
+        :param initial_epoch (int): Epoch at which to start the training (to resume a training)
+        :param input_shape (Tuple[int, int, int]): Shape of the images (for the generators)
+        :param verbose (int): 1 to show a progress bar, 0 otherwise
+        :return: history (tf.keras.callbacks.History): History of the metrics
+        """
+        steps = max(1, steps_per_epoch // self.accumulation_steps)
+
+        callbacks = CallbackList(callbacks, add_history=True, add_progbar=verbose != 0, model=self.model,
+                                 verbose=verbose, epochs=epochs, steps=steps)
+
+        if self.train_function is None:
+            self.train_function = self.make_train_function()
+
+        train_iterator = self.distribute(train_data, input_shape)
+        validation_iterator = self.distribute(validation_data, input_shape) \
+            if validation_data is not None and validation_steps else None
+
+        self.model.stop_training = False
+        callbacks.on_train_begin()
+        logs = {}
+
+        for epoch in range(initial_epoch, epochs):
+            self.reset_metrics()
+            callbacks.on_epoch_begin(epoch)
+
+            step = 0
+            while step < steps:
+                n = min(self.steps_per_execution, steps - step)
+
+                callbacks.on_train_batch_begin(step)
+                wait = self.train_function(train_iterator, tf.constant(n))
+                step += n
+                logs = self.logs()
+                # Seconds spent waiting for the input in this call (see nn/profiling.py)
+                logs['input_wait'] = float(wait)
+                callbacks.on_train_batch_end(step - 1, logs)
+
+            if validation_iterator is not None:
+                logs.update(self.evaluate(validation_iterator, validation_steps))
+
+            callbacks.on_epoch_end(epoch, logs)
+
+            if self.model.stop_training:
+                break
+
+        callbacks.on_train_end(logs)
+
+        return self.model.history
@@ -0,0 +1,236 @@
+import datetime
+import json
+from dataclasses import dataclass, field, fields
+from typing import Optional, Tuple, Union
+
+tasks = ['cifar', 'reds']
+input_backends = ['tfdata', 'keras', 'tfrecord']
+# 'srn' is the srn of the released models (different weights for each scale); 'srn_shared' shares the weights among
+# the scales (see nn/models.py)
+model_types = ['srn', 'srn_shared', 'fcn', 'unet', 'rednet']
+# Available training loops:
+# - 'fit': model.fit
+# - 'custom': Trainer (gradient accumulation, see nn/training.py)
+training_loops = ['fit', 'custom']
+# Available TFLite variants (see nn/quantize.py):
+# - 'float32': no quantization (reference of the TFLite latency)
+# - 'dynamic': int8 weights, float activations (dynamic range quantization)
+# - 'float16': float16 weights
+# - 'int8': int8 weights and activations (full integer, uint8 input and output), calibrated on a representative
+#   dataset
+quantization_modes = ['float32', 'dynamic', 'float16', 'int8']
+# Checkpoints of a training an inference model can be restored from (see nn/checkpoint.py)
+checkpoint_sources = ['latest', 'best']
+# Commands run by the "action" of params.json, when no command is given
+actions = {0: 'train', 1: 'predict', 2: 'evaluate', 3: 'export', 4: 'quantize'}
+
+
+@dataclass
+class Params:
+    """
+    (Hyper)parameters of a run, as in the params.json file (see README).
+    """
+    task: str = 'cifar'
+    model: str = 'srn'
+    epochs: int = 100
+    batch_size: int = 32
+    initial_lr: float = 1e-4
+    load_epoch: int = 0
+    action: int = 0
+    subset: bool = False
+    seed: int = 42
+    mc_period: int = 1
+    keep_checkpoints: int = 3
+    async_checkpoint: bool = True
+    resume: bool = True
+    checkpoint_input: bool = True
+    load_checkpoint: Optional[str] = None
+    input_backend: str = 'tfdata'
+    cache: Union[bool, str, None] = 'memory'
+    cache_budget_gb: Optional[float] = 16
+    tile_size: Optional[Tuple[int, int]] = None
+    tile_overlap: int = 32
+    predict_batch_size: int = 8
+    prediction_cache: bool = True
+    prediction_cache_gb: float = 10
+    jit_compile: bool = True
+    precision: str = 'float32'
+    strategy: str = 'auto'
+    virtual_cpus: int = 0
+    training_loop: str = 'fit'
+    accumulation_steps: int = 1
+    steps_per_execution: int = 1
+    profile: bool = False
+    profile_steps: Tuple[int, int] = (10, 20)
+    online_blur: bool = False
+    blur_sigma: Tuple[float, float] = (0, 3)
+    motion_blur: float = 0.
+    tflite_modes: Tuple[str, ...] = ('float32', 'dynamic', 'float16', 'int8')
+    tflite_mode: Optional[str] = None
+    representative_samples: int = 100
+    drift_samples: int = 100
+    stream_input: Optional[str] = None
+    stream_output: Optional[str] = None
+    stream_fps: float = 24.
+    stream_queue_size: int = 8
+    serve_host: str = '127.0.0.1'
+    serve_port: int = 8500
+    serve_max_batch_size: int = 8
+    serve_batch_window_ms: float = 5.
+
+    def __post_init__(self):
+        if self.tile_size is not None:
+            self.tile_size = tuple(self.tile_size)
+        self.profile_steps = tuple(self.profile_steps)
+        self.blur_sigma = tuple(self.blur_sigma)
+        self.tflite_modes = tuple(self.tflite_modes)
+
+        if self.task not in tasks:
+            raise ValueError('Unknown task {}, expected one of {}'.format(self.task, tasks))
+        if self.model not in model_types:
+            raise ValueError('Unknown model {}, expected one of {}'.format(self.model, model_types))
+        if self.training_loop not in training_loops:
+            raise ValueError('Unknown training_loop {}, expected one of {}'.format(self.training_loop, training_loops))
+        unknown_modes = [mode for mode in self.tflite_modes if mode not in quantization_modes]
+        if len(unknown_modes) > 0:
+            raise ValueError('Unknown tflite_modes {}, expected some of {}'.format(unknown_modes, quantization_modes))
+        if self.tflite_mode is not None and self.tflite_mode not in quantization_modes:
+            raise ValueError('Unknown tflite_mode {}, expected one of {}'.format(self.tflite_mode, quantization_modes))
+        if self.load_checkpoint is not None and self.load_checkpoint not in checkpoint_sources:
+            raise ValueError('Unknown load_checkpoint {}, expected one of {}'.format(self.load_checkpoint,
+                                                                                   checkpoint_sources))
+        if self.input_backend not in input_backends:
+            raise ValueError('Unknown input_backend {}, expected one of {}'.format(self.input_backend, input_backends))
+        if self.action not in actions:
+            raise ValueError('Unknown action {}, expected one of {}'.format(self.action, list(actions)))
+        if self.online_blur and 'reds' in self.task and self.input_backend == 'keras':
+            raise ValueError('online_blur needs the tfdata or tfrecord input_backend')
+
+    @property
+    def task_path(self):
+        """
+        'reds' or 'cifar'; used to create the paths where to save things (e.g. logs, ...).
+        """
+        return 'reds' if 'reds' in self.task else 'cifar'
+
+    @property
+    def target_size(self):
+        """
+        Size (height, width) of the images of the task.
+        """
+        return (720, 1280) if 'reds' in self.task else (32, 32)
+
+    @property
+    def cache_budget(self):
+        """
+        Max size of the memory cache of the tf.data pipelines, in bytes (None for no limit).
+        """
+        return int(self.cache_budget_gb * 1e9) if self.cache_budget_gb is not None else None
+
+
+def load_params(json_path, overrides=None):
+    """
+    Loads the parameters from a params.json file.
+
+    :param json_path (string): Path to the json file
+    :param overrides (dict): Parameters replacing the ones of the file
+    :return: params (Params): Parameters
+    """
+    with open(json_path) as json_file:
+        data = json.load(json_file)
+
+    data.update(overrides or {})
+
+    known = set(f.name for f in fields(Params))
+    unknown = sorted(set(data) - known)
+    if len(unknown) > 0:
+        raise ValueError('Unknown parameters {}, expected some of {}'.format(unknown, sorted(known)))
+
+    return Params(**data)
+
+
+@dataclass
+class Paths:
+    """
+    Paths of the datasets, models, logs and predictions of a run. Relative paths are relative to the src folder.
+    """
+    res: str = '../res/'
+    cifar: str = ''
+    cifar_modified: str = ''
+    # The sets are stored as uint8 .npy files, memory-mapped when loaded
+    cifar_npy: dict = field(default_factory=dict)
+    # Pickles created by older versions, converted once to .npy
+    cifar_pickles: dict = field(default_factory=dict)
+    cifar_saved: dict = field(default_factory=dict)
+    # Sharp and blur sets of reds ('train_s', 'train_b', 'val_s', 'val_b')
+    reds: dict = field(default_factory=dict)
+    # Manifests (csv index of the pairs, see dataset/manifest.py) of the reds sets ('train', 'val')
+    reds_manifests: dict = field(default_factory=dict)
+    # Folders of the TFRecord shards (see dataset/tfrecord.py) of the reds sets ('train', 'val')
+    reds_tfrecords: dict = field(default_factory=dict)
+    reds_test_blur: str = ''
+    logs: str = ''
+    # Directory of the checkpoints of the training (see nn/checkpoint.py)
+    checkpoints: str = ''
+    model_weights: str = ''
+    final_model: str = ''
+    export: str = ''
+    # Prefix of the TFLite models (<prefix>-<mode>.tflite) and of their report
+    tflite: str = ''
+    cache: str = ''
+    # Directory of the prediction cache (see utils/prediction_cache.py)
+    prediction_cache: str = ''
+    out_reds: str = ''
+    out_stream: str = ''
+    out_cifar: str = ''
+
+    @classmethod
+    def from_params(cls, params, res='../res/'):
+        """
+        Paths of a run.
+
+        :param params (Params): Parameters
+        :param res (string): Resources folder (datasets, models, logs)
+        :return: paths (Paths): Paths
+        """
+        task_path = params.task_path
+
+        cifar = res + 'datasets/cifar-10/'
+        cifar_modified = cifar + 'modified/'
+        cifar_base = {'train': cifar_modified+'data_batch_unified', 'test': cifar_modified+'test_batch',
+                      'train_b': cifar_modified+'data_batch_unified_blurred',
+                      'test_b': cifar_modified+'test_batch_blurred'}
+
+        reds_path = res + 'datasets/REDS/'
+        # Work on a subset of train and validation sets for quick tests (reds only)
+        train, val = ('train_s', 'val_s') if params.subset and 'reds' in params.task else ('train', 'val')
+        reds = {'train_s': reds_path+train+'/train_sharp/', 'train_b': reds_path+train+'/train_blur/',
+                'val_s': reds_path+val+'/val_sharp/', 'val_b': reds_path+val+'/val_blur/'}
+
+        base_model_path = res + 'models/' + task_path
+        model_name = task_path + '-' + params.model + '-' + str(params.load_epoch)
+
+        return cls(
+            res=res,
+            cifar=cifar,
+            cifar_modified=cifar_modified,
+            cifar_npy={key: cifar_base[key]+'.npy' for key in cifar_base},
+            cifar_pickles=cifar_base,
+            cifar_saved={'train': cifar+'saved/train/original/', 'train_b': cifar+'saved/train/blurred/',
+                         'test': cifar+'saved/test/original/', 'test_b': cifar+'saved/test/blurred/'},
+            reds=reds,
+            reds_manifests={'train': reds_path+train+'/manifest.csv', 'val': reds_path+val+'/manifest.csv'},
+            reds_tfrecords={'train': reds_path+'tfrecord/'+train+'/', 'val': reds_path+'tfrecord/'+val+'/'},
+            reds_test_blur=reds_path + 'test/test_blur/',
+            logs=res + 'logs/' + task_path + '/' + task_path + datetime.datetime.now().strftime('%Y%m%d-%H%M%S'),
+            checkpoints=base_model_path + '/checkpoints/' + task_path + '-' + params.model,
+            model_weights=base_model_path + '/model-' + model_name + '.h5',
+            final_model=base_model_path,
+            export=base_model_path + '/export/' + model_name,
+            tflite=base_model_path + '/tflite/' + model_name,
+            cache=res + 'cache/',
+            prediction_cache=res + 'cache/predictions/',
+            out_reds=reds_path + 'out/val/',
+            out_stream=reds_path + 'out/stream/',
+            out_cifar=cifar + 'saved/out/test/folder/',
+        )
@@ -1,11 +1,9 @@
 import os
 import pickle
 import random
-import shutil
-from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
 from os import listdir
 from os.path import join, isfile
-from pathlib import Path
 
 import cv2
 import numpy as np
@@ -56,44 +54,98 @@ def load_cifar(path):
     return {'train': train, 'val': [], 'test': test}
 
 
-def blur_cifar(ds):  # TODO1 do multiprocessing
+def sample_sigmas(ds):
     """
-    Applies gaussian blurring with random stdev in [0, 3].
-
-    The saved dataset was created with seed = 42.
+    Draws the random sigma of each image, in the same order used by the original per-image blurring loop (so that a
+    given seed always produces the same blurred dataset).
 
-    :param ds (np.array): Loaded dataset
-    :return: blurred (np.array): Blurred dataset
+    :param ds (dict): Loaded dataset
+    :return: sigmas (dict): for each set, a list with an np.array of sigmas for each batch
     """
-    print('Blurring CIFAR-10')
-    result = {key: [] for key in ds}
+    sigmas = {key: [] for key in ds}
 
     for key in ds:
         for entry in ds[key]:
-            tmp = []
+            sigmas[key].append(np.array([random.randint(min_sigma, max_sigma) for _ in range(len(entry[b'data']))]))
 
-            for image in entry[b'data']:
-                blurred = []  # 0 = red, 1 = green, 2 = blue
-                # Compute the random sigma
-                sigma = random.randint(min_sigma, max_sigma)
+    return sigmas
 
-                # for sigma in range(4):
-                #    blurred = []
-                for i in range(3):
-                    # For each channel, blur the image
-                    img_c = np.reshape(image[channel * i:channel * (i + 1)], (image_size, image_size))
 
-                    blurred_c = np.reshape(gaussian_filter(img_c, sigma), (channel,))
-                    # blurred_c = np.reshape(cv2.GaussianBlur(src=img_c, sigmaX=sigma), (channel,)) # TODO1 check
-                    blurred.extend(blurred_c)
+def blur_group(images, sigma):
+    """
+    Blurs a group of images sharing the same sigma.
+
+    The filter is applied only along the spatial axes, so the result is identical to blurring each channel of each
+    image separately.
+
+    :param images (np.array): Images with shape (n_images, 3, height, width)
+    :param sigma (int): Standard deviation of the gaussian kernel
+    :return: blurred (np.array): Blurred images, same shape and dtype of images
+    """
+    return gaussian_filter(images, sigma=(0, 0, sigma, sigma))
 
-                tmp.append(blurred)
-                # img = np.array(reshape_img(blurred))
-                # cv2.imwrite('/home/alby/'+str(sigma)+'.png', img)
 
-            new_entry = deepcopy(entry)  # a bit heavy
-            new_entry[b'data'] = np.array(tmp)
-            result[key].append(new_entry)
+def blur_batch(data, sigmas, executor=None, chunk_size=2048):
+    """
+    Blurs a cifar batch, grouping the images by sigma.
+
+    :param data (np.array): Flat images with shape (n_images, 3 * channel)
+    :param sigmas (np.array): Sigma of each image
+    :param executor (concurrent.futures.Executor): Optional pool used to blur the chunks in parallel
+    :param chunk_size (int): Max number of images of a group blurred by a single task
+    :return: blurred (np.array): Blurred flat images, same shape and dtype of data
+    """
+    images = data.reshape(-1, 3, image_size, image_size)
+    result = np.empty_like(images)
+
+    tasks = []
+    for sigma in np.unique(sigmas):
+        idx = np.flatnonzero(sigmas == sigma)
+
+        for i in range(0, len(idx), chunk_size):
+            chunk = idx[i:i + chunk_size]
+            tasks.append((chunk, images[chunk], int(sigma)))
+
+    if executor is None:
+        for chunk, group, sigma in tasks:
+            result[chunk] = blur_group(group, sigma)
+    else:
+        futures = [(chunk, executor.submit(blur_group, group, sigma)) for chunk, group, sigma in tasks]
+        for chunk, future in futures:
+            result[chunk] = future.result()
+
+    return result.reshape(data.shape)
+
+
+def blur_cifar(ds, workers=None):
+    """
+    Applies gaussian blurring with random stdev in [0, 3].
+
+    The sigmas are drawn image by image (as in the original implementation), then the images are blurred in groups
+    sharing the same sigma. The output is bit-identical to the per-image, per-channel blurring.
+
+    The saved dataset was created with seed = 42.
+
+    :param ds (dict): Loaded dataset
+    :param workers (int): Number of processes used to blur; if None or 1, blur in the current process
+    :return: blurred (dict): Blurred dataset
+    """
+    print('Blurring CIFAR-10')
+    result = {key: [] for key in ds}
+    sigmas = sample_sigmas(ds)
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers is not None and workers > 1 else None
+
+    try:
+        for key in ds:
+            for entry, entry_sigmas in zip(ds[key], sigmas[key]):
+                # Shallow copy: only the data is replaced, labels and filenames are shared with the original entry
+                new_entry = dict(entry)
+                new_entry[b'data'] = blur_batch(np.asarray(entry[b'data']), entry_sigmas, executor)
+                result[key].append(new_entry)
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
     return result
 
@@ -102,44 +154,48 @@ def reshape_img(image):
     """
     Reshape an image into the form (height, width, channels).
 
-    :param image (np.array): Loaded image
-    :return: reshaped (np.array): Reshaped image
+    :param image (np.array): Loaded image (flat, channel by channel)
+    :return: reshaped (np.array): Reshaped image (a view of image)
     """
-    img = []
+    return np.asarray(image).reshape(3, image_size, image_size).transpose(1, 2, 0)  # (3, 32, 32) -> (32, 32, 3)
 
-    for i in range(3):
-        img_c = np.reshape(image[channel * i:channel * (i + 1)], (image_size, image_size))
 
-        img.append(img_c)
+def cifar_images(ds):
+    """
+    Flat images of a cifar set.
 
-    reshaped = np.array(img).swapaxes(0, 1).swapaxes(1, 2)  # (3, 32, 32) -> (32, 32, 3)
+    :param ds (list or np.array): Loaded set (list of batch dicts, as returned by load_cifar) or flat images
+    :return: batches (list): np.arrays of flat images with shape (n_images, 3 * channel), not copied
+    """
+    if isinstance(ds, np.ndarray):
+        return [ds]
 
-    return reshaped
+    return [np.asarray(entry[b'data']) for entry in ds]
 
 
-def reshape_cifar(ds):  # TODO1 do multiprocessing
+def reshape_cifar(ds, out=None):
     """
-    Reshape the cifar into the form (n_images, height, width, channels).
+    Reshape the cifar into the form (n_images, height, width, channels), batch by batch with a single
+    reshape/transpose.
 
-    :param ds (np.array): Loaded dataset
-    :return: reshaped (np.array): Reshaped dataset
+    :param ds (list or np.array): Loaded set (list of batch dicts, as returned by load_cifar) or flat images
+    :param out (np.array): Array (e.g. a memory-mapped .npy file, see create_npy) with shape
+        (n_images, height, width, channels) where to write the images (default: a new array)
+    :return: reshaped (np.array): Reshaped dataset (out, if given)
     """
     print('Reshaping CIFAR-10')
-    result = []
-
-    for entry in ds:
-        for image in entry[b'data']:
-            img = []
+    batches = cifar_images(ds)
 
-            for i in range(3):
-                img_c = np.reshape(image[channel * i:channel * (i + 1)], (image_size, image_size))
+    if out is None:
+        out = np.empty((sum(len(b) for b in batches), image_size, image_size, 3),
+                       dtype=batches[0].dtype if len(batches) > 0 else np.uint8)
 
-                img.append(img_c)
+    start = 0
+    for batch in batches:
+        out[start:start + len(batch)] = batch.reshape(-1, 3, image_size, image_size).transpose(0, 2, 3, 1)
+        start += len(batch)
 
-            img_m = np.array(img).swapaxes(0, 1).swapaxes(1, 2)  # (3, 32, 32) -> (32, 32, 3)
-            result.append(img_m)
-
-    return np.array(result)
+    return out
 
 
 def save_cifar(ds, path):
@@ -158,61 +214,267 @@ def save_cifar(ds, path):
         count += 1
 
 
-def reds_merge(input_path):
+def save_npy(array, path):
     """
-    Merge all the reds scene into a single folder (flow_from_directory format)
-    :param input_path (string): Path containing the reds dataset
+    Saves an array of images as an uint8 .npy file.
+
+    :param array (np.array): Images with shape (n_images, height, width, channels)
+    :param path (string): Destination path (should end with .npy)
     :return: void
     """
-    print('Merging REDS {}'.format(input_path))
+    np.save(path, np.asarray(array, dtype=np.uint8))
 
-    root, dirs, files = next(os.walk(input_path))
-    dirs.sort()
 
-    count = 0
-    for dir_ in dirs:
-        root_n, dirs_n, files_n = next(os.walk(os.path.join(root, dir_)))
-        files_n.sort()
+def create_npy(path, shape, dtype=np.uint8):
+    """
+    Creates a .npy file and opens it as a writable memory map, to be filled in place (e.g. by reshape_cifar).
 
-        for file in files_n:
-            filename = os.path.join(root_n, file)
-            # or move/copy to a 'merged' folder
-            # shutil.move(filename, os.path.join(input_path, str(count)+".png"))
+    :param path (string): Destination path (should end with .npy)
+    :param shape (tuple): Shape of the array
+    :param dtype (dtype): dtype of the array
+    :return: array (np.memmap): Memory-mapped array
+    """
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
 
-            # Copy to the new folder
-            shutil.copyfile(filename, os.path.join(input_path, str(count)+".png"))
 
-            count += 1
+def save_cifar_npy(ds, path):
+    """
+    Reshapes a cifar set straight into an uint8 .npy file. The file is written aside and renamed when complete.
 
-        shutil.rmtree(root_n)
+    :param ds (list or np.array): Loaded set (list of batch dicts, as returned by load_cifar) or flat images
+    :param path (string): Destination path (should end with .npy)
+    :return: void
+    """
+    tmp_path = path + '.tmp.npy'
+    images = create_npy(tmp_path, (sum(len(b) for b in cifar_images(ds)), image_size, image_size, 3))
+    reshape_cifar(ds, out=images)
+    images.flush()
+    del images
+
+    os.replace(tmp_path, path)
 
 
-def keras_folder(paths):
+def load_npy(path):
     """
-    Adds a dummy folder to be compatible with the flow_from_directory (e.g. train/train_blur/folder/<list of images>).
-    :param paths (dict): dict containing for each set (train, val, test) the paths to the dataset
-    :return: new_paths (dict): updated paths
+    Opens an uint8 .npy file as a read-only memory map: nothing is read until the images are accessed.
+
+    :param path (string): Path to the .npy file
+    :return: images (np.memmap): Memory-mapped images
     """
-    print('Moving images into the folder needed by the flow_from_directory')
+    return np.load(path, mmap_mode='r')
+
 
-    res = {key: '' for key in paths}
+def convert_cifar_pickles(paths):
+    """
+    One-shot conversion of the pickled cifar sets (created by older versions) to .npy files.
 
+    :param paths (dict): for each set, a tuple (pickle path, npy path)
+    :return: void
+    """
     for key in paths:
-        p = paths[key]
-        # Add the 'folder/' directory
-        new_p = p + 'folder/'
+        pickle_path, npy_path = paths[key]
+
+        if os.path.exists(pickle_path) and not os.path.exists(npy_path):
+            print('Converting {} to {}'.format(pickle_path, npy_path))
+            save_npy(unpickle(pickle_path), npy_path)
+
+
+def load_cifar_npy(paths):
+    """
+    Loads the cifar sets stored as .npy files.
+
+    :param paths (dict): for each set, the path to the .npy file
+    :return: dict: for each set, the memory-mapped images
+    """
+    return {key: load_npy(paths[key]) for key in paths}
 
-        files = [f for f in listdir(p)]
 
-        # Create the folder if not existing
-        Path(new_p).mkdir(parents=True, exist_ok=True)
-        for f in files:
-            # Move to the new folder
-            shutil.move(p + f, new_p)
+class PairArrayIterator:
+    """
+    Infinite iterator over aligned batches of sharp and blur images, read from (memory-mapped) arrays.
 
-        res[key] = new_p
+    Only the images of the current batch are read and converted to float; it replaces a pair of
+    ImageDataGenerator.flow, which copy the whole arrays in memory. The validation_split semantic is the same of the
+    ImageDataGenerator (the validation subset is the head of the arrays).
+    """
+    def __init__(self, sharp, blur, batch_size=32, shuffle=True, seed=None, subset=None, validation_split=0.0,
+                 rescale=1./255):
+        """
+        Class constructor.
+
+        :param sharp (np.array): Sharp images with shape (n_images, height, width, channels)
+        :param blur (np.array): Blur images with shape (n_images, height, width, channels)
+        :param batch_size (int): Batch size
+        :param shuffle (boolean): True for shuffling the images at each epoch
+        :param seed (int): Seed of the shuffling
+        :param subset (string): 'training', 'validation' or None (whole arrays)
+        :param validation_split (float): Fraction of the images reserved to the validation subset
+        :param rescale (float): Factor multiplied to the images
+        """
+        split = int(len(blur) * validation_split)
+
+        if subset == 'training':
+            self.indexes = np.arange(split, len(blur))
+        elif subset == 'validation':
+            self.indexes = np.arange(0, split)
+        else:
+            self.indexes = np.arange(0, len(blur))
+
+        self.sharp = sharp
+        self.blur = blur
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rescale = rescale
+        self.samples = len(self.indexes)
+        self.rng = np.random.RandomState(seed)
+
+        self.order = self.indexes
+        self.position = 0
+
+    def __len__(self):
+        return (self.samples + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.position == 0 and self.shuffle:
+            self.order = self.rng.permutation(self.indexes)
+
+        idx = self.order[self.position:self.position + self.batch_size]
+        self.position += self.batch_size
+        if self.position >= self.samples:
+            self.position = 0
+
+        # Sorted indexes read the memory map (or the files) sequentially
+        return self.read_batch(np.sort(idx))
+
+    def read_batch(self, idx):
+        """
+        Reads the images of a batch.
+
+        :param idx (np.array): Indexes of the images
+        :return: batch (list): sharp and blur images, float32 and rescaled
+        """
+        sharp_batch = self.sharp[idx].astype(np.float32) * self.rescale
+        blur_batch = self.blur[idx].astype(np.float32) * self.rescale
+
+        return [sharp_batch, blur_batch]
+
+
+class PairFileIterator(PairArrayIterator):
+    """
+    Infinite iterator over aligned batches of sharp and blur images, read from image files (e.g. the pairs of a reds
+    manifest). The pairs are read together, so their alignment never depends on two generators staying in sync.
+    """
+    def __init__(self, sharp_paths, blur_paths, batch_size=32, shuffle=True, seed=None, rescale=1./255):
+        """
+        Class constructor.
+
+        :param sharp_paths (list): Paths to the sharp images (None for reading only the blur images, e.g. to predict)
+        :param blur_paths (list): Paths to the blur images (aligned with the sharp ones)
+        :param batch_size (int): Batch size
+        :param shuffle (boolean): True for shuffling the images at each epoch
+        :param seed (int): Seed of the shuffling
+        :param rescale (float): Factor multiplied to the images
+        """
+        super().__init__(sharp_paths, blur_paths, batch_size=batch_size, shuffle=shuffle, seed=seed, rescale=rescale)
+
+    def read_batch(self, idx):
+        """
+        Reads (and decodes, as RGB) the images of a batch.
+
+        :param idx (np.array): Indexes of the images
+        :return: batch (list): sharp (None without sharp_paths) and blur images, float32 and rescaled
+        """
+        return [np.stack([cv2.cvtColor(cv2.imread(paths[i]), cv2.COLOR_BGR2RGB) for i in idx]).astype(np.float32) *
+                self.rescale if paths is not None else None for paths in [self.sharp, self.blur]]
+
+
+# First bytes of every png file
+png_signature = b'\x89PNG\r\n\x1a\n'
+
+
+def png_size(path):
+    """
+    Reads the size of a png image from its header, without decoding it.
+
+    :param path (string): Path to the png image
+    :return: size (Tuple[int, int]): height and width of the image
+    """
+    with open(path, 'rb') as f:
+        header = f.read(24)
 
-    return res
+    if len(header) < 24 or not header.startswith(png_signature):
+        raise ValueError('{} is not a png image'.format(path))
+
+    # The IHDR chunk (width, height) follows the 8 bytes signature and the chunk length and type
+    return int.from_bytes(header[20:24], 'big'), int.from_bytes(header[16:20], 'big')
+
+
+def reds_pairs(sharp_path, blur_path, extension='.png'):
+    """
+    Lists the aligned (sharp, blur) image pairs of a reds set, pairing the files by their path relative to the set
+    folder (e.g. train_sharp/000/00000000.png with train_blur/000/00000000.png). Works on both the original layout
+    (one folder per scene) and the merged one.
+
+    :param sharp_path (string): Path to the sharp set
+    :param blur_path (string): Path to the blur set
+    :param extension (string): Extension of the images
+    :return: pairs (list): Sorted list of tuples (relative path, sharp path, blur path)
+    """
+    pairs = []
+
+    for root, dirs, files in os.walk(sharp_path):
+        dirs.sort()
+
+        for file in sorted(files):
+            if not file.endswith(extension):
+                continue
+
+            sharp_fn = os.path.join(root, file)
+            rel = os.path.relpath(sharp_fn, sharp_path)
+            blur_fn = os.path.join(blur_path, rel)
+
+            if isfile(blur_fn):
+                pairs.append((rel, sharp_fn, blur_fn))
+
+    return pairs
+
+
+def random_crop(sharp_batch, blur_batch, random_crop_size=(256, 256)):
+    """
+    Random crops the sharp and blur patch, with the random_crop_size dimension.
+
+    :param sharp_batch (np.array): batch of sharp images
+    :param blur_batch (np.array): batch of blur images
+    :param random_crop_size (Tuple[int, int]): height and width of the crop
+    :return: cropped (Tuple[np.array, np.array]): cropped batch
+    """
+    s = []
+    b = []
+
+    for image_s, image_b in zip(sharp_batch, blur_batch):
+        height, width = image_s.shape[0], image_s.shape[1]
+        dy, dx = random_crop_size
+        x = np.random.randint(0, width - dx + 1)
+        y = np.random.randint(0, height - dy + 1)
+        s.append(image_s[y:(y + dy), x:(x + dx), :])
+        b.append(image_b[y:(y + dy), x:(x + dx), :])
+
+    return np.array(s), np.array(b)
+
+
+def random_crops(batches, random_crop_size=(256, 256)):
+    """
+    Yields batches of sharp and blur images, cropped.
+
+    :param batches (iterable): batches of sharp and blur images (e.g. a PairFileIterator)
+    :param random_crop_size (Tuple[int, int]): height and width of the crops
+    :return: batches (generator): cropped batches of sharp and blur images
+    """
+    for sharp_batch, blur_batch in batches:
+        yield list(random_crop(sharp_batch, blur_batch, random_crop_size))
 
 
 '''
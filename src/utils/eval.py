@@ -1,3 +1,5 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from os import listdir
 from os.path import isfile, join
 
@@ -6,46 +8,139 @@ import cv2
 from skimage.metrics import peak_signal_noise_ratio, mean_squared_error, structural_similarity
 
 
-def avg_metric(sharp_path, deblurred_path):  # TODO1 do multiprocessing in those methods
+def ssim(orig_img, deb_img):
     """
-    Returns the metric evaluation (MSE, PSNR, SSIM) between the sharp_path and deblurred_path.
+    SSIM between two RGB images in [0, 1].
+
+    :param orig_img (np.array): Sharp image
+    :param deb_img (np.array): Deblurred image
+    :return: ssim (float): SSIM
+    """
+    try:
+        return structural_similarity(orig_img, deb_img, data_range=1, channel_axis=-1)
+    except TypeError:  # scikit-image < 0.19
+        return structural_similarity(orig_img, deb_img, data_range=1, multichannel=True)
+
+
+def image_metrics(orig_fn, deb_fn):
+    """
+    Returns the metric evaluation (MSE, PSNR, SSIM) between two image files.
+
+    :param orig_fn (string): Path to the sharp image
+    :param deb_fn (string): Path to the deblurred image
+    :return: metrics (Tuple[float, float, float]): metric evaluation of MSE, PSNR, SSIM, respectively
+    """
+    # Load images
+    orig_img = np.divide(cv2.imread(orig_fn), 255)
+    deb_img = np.divide(cv2.imread(deb_fn), 255)
+
+    return array_metrics(orig_img, deb_img)
+
+
+def array_metrics(orig_img, deb_img):
+    """
+    Returns the metric evaluation (MSE, PSNR, SSIM) between two images in [0, 1].
+
+    :param orig_img (np.array): Sharp image
+    :param deb_img (np.array): Deblurred image
+    :return: metrics (Tuple[float, float, float]): metric evaluation of MSE, PSNR, SSIM, respectively
+    """
+    return mean_squared_error(orig_img, deb_img), peak_signal_noise_ratio(orig_img, deb_img, data_range=1), \
+        ssim(orig_img, deb_img)
+
+
+def pair_files(sharp_path, deblurred_path):
+    """
+    Pairs the images of two folders by file name.
 
     :param sharp_path (string): Path to the sharp set
     :param deblurred_path (string): Path to the deblurred set
-    :return: metrics (Tuple[float, float, float]): metric evaluation of MSE, PSNR, SSIM, respectively
+    :return: names (list): Sorted names of the images found in both folders
     """
-    sum_psnr = 0
-    sum_mse = 0
-    sum_ssim = 0
+    files_orig = set(f for f in listdir(sharp_path) if isfile(join(sharp_path, f)))
+    files_deb = set(f for f in listdir(deblurred_path) if isfile(join(deblurred_path, f)))
 
-    # List all files
-    files_orig = [f for f in listdir(sharp_path) if isfile(join(sharp_path, f))]
-    files_deb = [f for f in listdir(deblurred_path) if isfile(join(deblurred_path, f))]
+    missing = files_orig - files_deb
+    if len(missing) > 0:
+        print('{} sharp images without a deblurred image (e.g. {})'.format(len(missing), sorted(missing)[0]))
 
-    count = 0
-    for orig, deb in zip(files_orig, files_deb):
-        orig_fn = join(sharp_path, orig)
-        deb_fn = join(deblurred_path, deb)
-        # Load images
-        orig_img = cv2.imread(orig_fn)
-        deb_img = cv2.imread(deb_fn)
-        orig_img = np.divide(orig_img, 255)
-        deb_img = np.divide(deb_img, 255)
+    return sorted(files_orig & files_deb)
 
-        # Compute metrics
-        sum_psnr += peak_signal_noise_ratio(orig_img, deb_img)
-        sum_mse += mean_squared_error(orig_img, deb_img)
-        sum_ssim += structural_similarity(orig_img, deb_img, multichannel=True)
 
-        count += 1
-        print('Analyzed: {}/{}'.format(count, len(files_orig)))
+def evaluate_pairs(pairs, workers=None, max_in_flight=None):
+    """
+    Computes the metrics (MSE, PSNR, SSIM) of (sharp, deblurred) image pairs, in a pool of processes. At most
+    max_in_flight images are submitted to the pool at the same time.
+
+    :param pairs (list): Tuples (name, sharp path, deblurred path)
+    :param workers (int): Number of processes (default: number of cpus)
+    :param max_in_flight (int): Max number of images being evaluated or waiting (default: 4 * workers)
+    :return: metrics (dict): 'per_image' (dict of name -> (MSE, PSNR, SSIM)), 'count' and the averages 'mse', 'psnr'
+        and 'ssim'
+    """
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+    max_in_flight = max_in_flight if max_in_flight is not None else 4 * workers
 
-    # Average
-    avg_psnr = sum_psnr/len(files_orig)
-    avg_mse = sum_mse/len(files_orig)
-    avg_ssim = sum_ssim/len(files_orig)
+    per_image = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+        remaining = iter(pairs)
 
-    return avg_mse, avg_psnr, avg_ssim
+        while True:
+            # Keep the pool fed, without submitting the whole set at once
+            for name, orig_fn, deb_fn in remaining:
+                in_flight[executor.submit(image_metrics, orig_fn, deb_fn)] = name
+                if len(in_flight) >= max_in_flight:
+                    break
+
+            if len(in_flight) == 0:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                per_image[in_flight.pop(future)] = future.result()
+
+            print('Analyzed: {}/{}'.format(len(per_image), len(pairs)))
+
+    count = len(per_image)
+    metrics = {'per_image': per_image, 'count': count}
+    for i, key in enumerate(['mse', 'psnr', 'ssim']):
+        metrics[key] = sum(values[i] for values in per_image.values()) / max(1, count)
+
+    return metrics
+
+
+def evaluate(sharp_path, deblurred_path, workers=None, max_in_flight=None):
+    """
+    Computes the metrics (MSE, PSNR, SSIM) between the sharp and deblurred images with the same name (see
+    evaluate_pairs).
+
+    :param sharp_path (string): Path to the sharp set
+    :param deblurred_path (string): Path to the deblurred set
+    :param workers (int): Number of processes (default: number of cpus)
+    :param max_in_flight (int): Max number of images being evaluated or waiting (default: 4 * workers)
+    :return: metrics (dict): see evaluate_pairs
+    """
+    names = pair_files(sharp_path, deblurred_path)
+
+    return evaluate_pairs([(name, join(sharp_path, name), join(deblurred_path, name)) for name in names], workers,
+                          max_in_flight)
+
+
+def avg_metric(sharp_path, deblurred_path, workers=None):
+    """
+    Returns the metric evaluation (MSE, PSNR, SSIM) between the sharp_path and deblurred_path.
+
+    The images are paired by file name and evaluated in parallel (see evaluate).
+
+    :param sharp_path (string): Path to the sharp set
+    :param deblurred_path (string): Path to the deblurred set
+    :param workers (int): Number of processes (default: number of cpus)
+    :return: metrics (Tuple[float, float, float]): metric evaluation of MSE, PSNR, SSIM, respectively
+    """
+    metrics = evaluate(sharp_path, deblurred_path, workers)
+
+    return metrics['mse'], metrics['psnr'], metrics['ssim']
 
 
 def avg_metric_loaded_array(sharp_arr, deblurred_arr):
@@ -65,9 +160,9 @@ def avg_metric_loaded_array(sharp_arr, deblurred_arr):
         # Compute metrics
         orig /= 255.
         deb /= 255.
-        sum_psnr += peak_signal_noise_ratio(orig, deb)
+        sum_psnr += peak_signal_noise_ratio(orig, deb, data_range=1)
         sum_mse += mean_squared_error(orig, deb)
-        sum_ssim += structural_similarity(orig, deb, multichannel=True)
+        sum_ssim += ssim(orig, deb)
 
         count += 1
         print('Analyzed: {}/{}'.format(count, len(sharp_arr)))
@@ -0,0 +1,202 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    SHA-256 of the content of a file.
+
+    :param path (string): Path of the file
+    :param chunk_size (int): Bytes read at once
+    :return: digest (string): Hex digest
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def arrays_digest(arrays):
+    """
+    SHA-256 of a list of arrays (e.g. the weights of a model: model.get_weights()), shapes and dtypes included.
+
+    :param arrays (list): Arrays
+    :return: digest (string): Hex digest
+    """
+    h = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        h.update('{}{}'.format(array.dtype.str, array.shape).encode())
+        h.update(array.data)
+
+    return h.hexdigest()
+
+
+def array_to_bytes(array):
+    """
+    Serializes an array as .npy bytes.
+
+    :param array (np.array): Array
+    :return: data (bytes): .npy bytes
+    """
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+
+    return buffer.getvalue()
+
+
+def array_from_bytes(data):
+    """
+    Deserializes .npy bytes.
+
+    :param data (bytes): .npy bytes
+    :return: array (np.array): Array
+    """
+    return np.load(io.BytesIO(data), allow_pickle=False)
+
+
+class PredictionCache:
+    """
+    Class for a content-addressed cache of the predictions on the local disk: an entry is keyed by the hashes of the
+    input, of the model weights and of the inference settings, so a prediction is reused only if none of them changed.
+    The size of the cache is capped, evicting the least recently used entries (the recency is the modification time of
+    the files, updated on each hit).
+    """
+    def __init__(self, directory, max_bytes):
+        """
+        Class constructor.
+
+        :param directory (string): Directory of the cache
+        :param max_bytes (int): Max size of the cache, in bytes
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        Path(directory).mkdir(parents=True, exist_ok=True)
+
+        # For each key, the size of its entry, least recently used first
+        entries = []
+        for sub in os.scandir(directory):
+            if sub.is_dir():
+                entries += [(entry.stat().st_mtime, entry.name, entry.stat().st_size) for entry in os.scandir(sub.path)
+                            if entry.is_file() and not entry.name.endswith('.tmp')]
+        self.entries = OrderedDict((name, size) for _, name, size in sorted(entries))
+        self.size = sum(self.entries.values())
+        # The cap may have been lowered since the last run
+        self.evict()
+
+    @staticmethod
+    def key(input_digest, weights_digest, settings):
+        """
+        Key of a prediction.
+
+        :param input_digest (string): Hash of the input (see file_digest, arrays_digest)
+        :param weights_digest (string): Hash of the model weights (see arrays_digest)
+        :param settings (dict): Inference settings changing the predictions (json serializable)
+        :return: key (string): Key
+        """
+        data = json.dumps([input_digest, weights_digest, settings], sort_keys=True)
+
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def path(self, key):
+        """
+        Path of the entry of a key.
+
+        :param key (string): Key
+        :return: path (string): Path of the file
+        """
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """
+        Reads an entry, marking it as the most recently used.
+
+        :param key (string): Key
+        :return: data (bytes): Content of the entry (None if it is not in the cache)
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+
+        try:
+            with open(self.path(key), 'rb') as f:
+                data = f.read()
+            os.utime(self.path(key))
+        except FileNotFoundError:  # Evicted by another process
+            with self.lock:
+                self.size -= self.entries.pop(key, 0)
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+
+        return data
+
+    def put(self, key, data):
+        """
+        Adds an entry, evicting the least recently used ones if the cache is full.
+
+        :param key (string): Key
+        :param data (bytes): Content of the entry
+        :return: void
+        """
+        if len(data) > self.max_bytes:
+            return
+
+        path = self.path(key)
+        Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+        # Written aside and renamed, a concurrent reader never sees a partial entry
+        tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        with self.lock:
+            self.size += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the size of the cache is within max_bytes.
+
+        :return: void
+        """
+        with self.lock:
+            evicted = []
+            while self.size > self.max_bytes:
+                key, size = self.entries.popitem(last=False)
+                self.size -= size
+                evicted.append(key)
+
+        for key in evicted:
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def report(self):
+        """
+        Prints the hits and misses and the size of the cache.
+
+        :return: void
+        """
+        print('Prediction cache: {} hits, {} misses, {} entries ({:.1f} MB) in {}'.format(
+            self.hits, self.misses, len(self.entries), self.size / 1e6, self.directory))
@@ -0,0 +1,121 @@
+import numpy as np
+
+
+def tile_starts(length, tile, overlap):
+    """
+    Computes the starting positions of the tiles along an axis. Consecutive tiles overlap by at least overlap pixels
+    and the last tile ends exactly at the end of the axis.
+
+    :param length (int): Length of the axis
+    :param tile (int): Length of a tile
+    :param overlap (int): Min overlap between consecutive tiles
+    :return: starts (list): Starting positions
+    """
+    if length <= tile:
+        return [0]
+
+    stride = max(1, tile - overlap)
+    starts = list(range(0, length - tile, stride))
+    starts.append(length - tile)
+
+    return starts
+
+
+def count_tiles(shape, tile_size, overlap):
+    """
+    Number of tiles needed to cover an image.
+
+    :param shape (Tuple[int, int]): height and width of the image
+    :param tile_size (Tuple[int, int]): height and width of a tile
+    :param overlap (int): Min overlap between consecutive tiles
+    :return: count (int): Number of tiles
+    """
+    return len(tile_starts(shape[0], tile_size[0], overlap)) * len(tile_starts(shape[1], tile_size[1], overlap))
+
+
+def feather_window(tile_size, overlap):
+    """
+    Blending weights of a tile: 1 in the center, linearly decreasing in the overlap border (never 0, so that the
+    borders of the image, covered by a single tile, keep their value).
+
+    :param tile_size (Tuple[int, int]): height and width of a tile
+    :param overlap (int): Width of the feathered border
+    :return: window (np.array): Weights with shape (height, width, 1)
+    """
+    def ramp(length):
+        w = np.ones(length, dtype=np.float32)
+        border = min(overlap, length // 2)
+        if border > 0:
+            r = np.arange(1, border + 1, dtype=np.float32) / (border + 1)
+            w[:border] = r
+            w[length - border:] = r[::-1]
+        return w
+
+    return np.outer(ramp(tile_size[0]), ramp(tile_size[1]))[:, :, np.newaxis]
+
+
+def pad_to_multiple(image, multiple):
+    """
+    Pads an image (replicating its borders) so that its height and width are multiples of multiple (the sizes
+    required by the srn and unet models).
+
+    :param image (np.array): Image with shape (height, width, channels)
+    :param multiple (int): Multiple (1 for no padding)
+    :return: padded (np.array): Padded image
+    """
+    height, width = image.shape[:2]
+    pad_h = -height % multiple
+    pad_w = -width % multiple
+
+    if pad_h == 0 and pad_w == 0:
+        return image
+
+    return np.pad(image, [(0, pad_h), (0, pad_w), (0, 0)], mode='edge')
+
+
+def predict_tiled(predict_fn, images, tile_size=(256, 256), overlap=32, batch_size=8):
+    """
+    Predicts a batch of (possibly large) images tile by tile. The tiles of all the images are predicted in batches and
+    blended back with a feathered window, so the peak memory depends only on the tile size and on the batch size.
+
+    Images smaller than a tile are padded (symmetric) to the tile size.
+
+    :param predict_fn (function): Function mapping a batch of tiles (n, tile_h, tile_w, channels) to the predicted
+        tiles (same shape)
+    :param images (np.array): Images with shape (n_images, height, width, channels)
+    :param tile_size (Tuple[int, int]): height and width of a tile
+    :param overlap (int): Min overlap between consecutive tiles
+    :param batch_size (int): Number of tiles predicted together
+    :return: predictions (np.array): Predicted images, same shape of images
+    """
+    images = np.asarray(images, dtype=np.float32)
+    n, height, width, channels = images.shape
+    th, tw = tile_size
+
+    # Pad the images smaller than a tile
+    ph, pw = max(0, th - height), max(0, tw - width)
+    if ph > 0 or pw > 0:
+        images = np.pad(images, ((0, 0), (0, ph), (0, pw), (0, 0)), mode='symmetric')
+    padded_h, padded_w = images.shape[1], images.shape[2]
+
+    window = feather_window(tile_size, overlap)
+    result = np.zeros(images.shape, dtype=np.float32)
+    weights = np.zeros((n, padded_h, padded_w, 1), dtype=np.float32)
+
+    positions = [(i, y, x) for i in range(n)
+                 for y in tile_starts(padded_h, th, overlap)
+                 for x in tile_starts(padded_w, tw, overlap)]
+
+    for b in range(0, len(positions), batch_size):
+        batch_positions = positions[b:b + batch_size]
+        tiles = np.stack([images[i, y:y + th, x:x + tw] for i, y, x in batch_positions])
+
+        predicted = np.asarray(predict_fn(tiles), dtype=np.float32)
+
+        for (i, y, x), tile in zip(batch_positions, predicted):
+            result[i, y:y + th, x:x + tw] += tile * window
+            weights[i, y:y + th, x:x + tw] += window
+
+    result /= weights
+
+    return result[:, :height, :width]